@@ -7,9 +7,39 @@
 
 import os
 import shutil
+import fnmatch
 from pathlib import Path
 from datetime import datetime
 
+# 清理类别，按删除顺序排列：(类型, 标题)
+CATEGORIES = [
+    ("备份文件", "清理备份文件"),
+    ("历史记录", "清理历史记录"),
+    ("统计缓存", "清理统计缓存"),
+    ("缓存目录", "清理缓存目录"),
+    ("调试日志", "清理调试日志"),
+    ("会话数据", "清理项目会话数据"),
+    ("遥测数据", "清理遥测数据"),
+    ("待办事项", "清理待办事项"),
+    ("插件缓存", "清理插件缓存"),
+    ("Git仓库", "清理 Git 仓库数据"),
+]
+# 整个删除的文件和目录（相对 .claude 目录）
+CLEAN_PATHS = {
+    "history.jsonl": "历史记录",
+    "stats-cache.json": "统计缓存",
+    "cache": "缓存目录",
+    "debug": "调试日志",
+    "projects": "会话数据",
+    "telemetry": "遥测数据",
+    "todos": "待办事项",
+    "plugins/cache": "插件缓存",
+}
+# .claude.json 备份文件
+BACKUP_PATTERN = ".claude.json.backup.*"
+# 插件市场目录：只删除其中的 .git 目录
+MARKETPLACES_DIR = "plugins/marketplaces"
+
 
 class ClaudeCacheCleaner:
     """Claude 缓存清理器"""
@@ -25,23 +55,9 @@ class ClaudeCacheCleaner:
         self.claude_dir = self.base_dir / claude_dir
         self.cleaned_items = []
         self.errors = []
-        self.preview_items = []  # 预览列表
+        self.index = []  # 清理索引（预览、确认和删除共用）
+        self.freed_size = 0
         
-    def get_size(self, path: Path) -> int:
-        """获取文件或目录大小"""
-        if path.is_file():
-            return path.stat().st_size
-        elif path.is_dir():
-            total = 0
-            for item in path.rglob('*'):
-                if item.is_file():
-                    try:
-                        total += item.stat().st_size
-                    except:
-                        pass
-            return total
-        return 0
-    
     def format_size(self, size: int) -> str:
         """格式化文件大小"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -50,237 +66,88 @@ class ClaudeCacheCleaner:
             size /= 1024.0
         return f"{size:.2f} TB"
     
-    def clean_backup_files(self, preview_only=False):
-        """清理 .claude.json 备份文件"""
-        if not preview_only:
-            print("🧹 清理备份文件...")
-        pattern = ".claude.json.backup.*"
-        
-        for backup_file in self.claude_dir.glob(pattern):
-            if preview_only:
-                size = self.get_size(backup_file)
-                self.preview_items.append({
-                    'path': backup_file.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '备份文件'
-                })
-            else:
-                try:
-                    backup_file.unlink()
-                    self.cleaned_items.append(str(backup_file.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: {backup_file.name}")
-                except Exception as e:
-                    self.errors.append(f"删除 {backup_file.name} 失败: {e}")
-                    print(f"  ✗ 失败: {backup_file.name}")
-    
-    def clean_history(self, preview_only=False):
-        """清理历史记录"""
-        if not preview_only:
-            print("\n🧹 清理历史记录...")
-        history_file = self.claude_dir / "history.jsonl"
-        
-        if history_file.exists():
-            if preview_only:
-                size = self.get_size(history_file)
-                self.preview_items.append({
-                    'path': history_file.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '历史记录'
-                })
-            else:
-                try:
-                    history_file.unlink()
-                    self.cleaned_items.append(str(history_file.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: history.jsonl")
-                except Exception as e:
-                    self.errors.append(f"删除 history.jsonl 失败: {e}")
-                    print(f"  ✗ 失败: history.jsonl")
-    
-    def clean_stats_cache(self, preview_only=False):
-        """清理统计缓存"""
-        if not preview_only:
-            print("\n🧹 清理统计缓存...")
-        stats_file = self.claude_dir / "stats-cache.json"
-        
-        if stats_file.exists():
-            if preview_only:
-                size = self.get_size(stats_file)
-                self.preview_items.append({
-                    'path': stats_file.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '统计缓存'
-                })
-            else:
-                try:
-                    stats_file.unlink()
-                    self.cleaned_items.append(str(stats_file.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: stats-cache.json")
-                except Exception as e:
-                    self.errors.append(f"删除 stats-cache.json 失败: {e}")
-                    print(f"  ✗ 失败: stats-cache.json")
-    
-    def clean_cache_dir(self, preview_only=False):
-        """清理 cache 目录"""
-        if not preview_only:
-            print("\n🧹 清理缓存目录...")
-        cache_dir = self.claude_dir / "cache"
-        
-        if cache_dir.exists():
-            if preview_only:
-                size = self.get_size(cache_dir)
-                self.preview_items.append({
-                    'path': cache_dir.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '缓存目录'
-                })
-            else:
-                try:
-                    shutil.rmtree(cache_dir)
-                    self.cleaned_items.append(str(cache_dir.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: cache/ 目录")
-                except Exception as e:
-                    self.errors.append(f"删除 cache/ 目录失败: {e}")
-                    print(f"  ✗ 失败: cache/ 目录")
-    
-    def clean_debug_dir(self, preview_only=False):
-        """清理 debug 目录"""
-        if not preview_only:
-            print("\n🧹 清理调试日志...")
-        debug_dir = self.claude_dir / "debug"
-        
-        if debug_dir.exists():
-            if preview_only:
-                size = self.get_size(debug_dir)
-                self.preview_items.append({
-                    'path': debug_dir.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '调试日志'
-                })
-            else:
-                try:
-                    shutil.rmtree(debug_dir)
-                    self.cleaned_items.append(str(debug_dir.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: debug/ 目录")
-                except Exception as e:
-                    self.errors.append(f"删除 debug/ 目录失败: {e}")
-                    print(f"  ✗ 失败: debug/ 目录")
-    
-    def clean_projects_dir(self, preview_only=False):
-        """清理 projects 目录（会话数据）"""
-        if not preview_only:
-            print("\n🧹 清理项目会话数据...")
-        projects_dir = self.claude_dir / "projects"
-        
-        if projects_dir.exists():
-            if preview_only:
-                size = self.get_size(projects_dir)
-                self.preview_items.append({
-                    'path': projects_dir.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '会话数据'
-                })
-            else:
-                try:
-                    shutil.rmtree(projects_dir)
-                    self.cleaned_items.append(str(projects_dir.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: projects/ 目录")
-                except Exception as e:
-                    self.errors.append(f"删除 projects/ 目录失败: {e}")
-                    print(f"  ✗ 失败: projects/ 目录")
-    
-    def clean_telemetry_dir(self, preview_only=False):
-        """清理 telemetry 目录"""
-        if not preview_only:
-            print("\n🧹 清理遥测数据...")
-        telemetry_dir = self.claude_dir / "telemetry"
-        
-        if telemetry_dir.exists():
-            if preview_only:
-                size = self.get_size(telemetry_dir)
-                self.preview_items.append({
-                    'path': telemetry_dir.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '遥测数据'
-                })
-            else:
-                try:
-                    shutil.rmtree(telemetry_dir)
-                    self.cleaned_items.append(str(telemetry_dir.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: telemetry/ 目录")
-                except Exception as e:
-                    self.errors.append(f"删除 telemetry/ 目录失败: {e}")
-                    print(f"  ✗ 失败: telemetry/ 目录")
-    
-    def clean_todos_dir(self, preview_only=False):
-        """清理 todos 目录"""
-        if not preview_only:
-            print("\n🧹 清理待办事项...")
-        todos_dir = self.claude_dir / "todos"
-        
-        if todos_dir.exists():
-            if preview_only:
-                size = self.get_size(todos_dir)
-                self.preview_items.append({
-                    'path': todos_dir.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '待办事项'
-                })
-            else:
-                try:
-                    shutil.rmtree(todos_dir)
-                    self.cleaned_items.append(str(todos_dir.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: todos/ 目录")
-                except Exception as e:
-                    self.errors.append(f"删除 todos/ 目录失败: {e}")
-                    print(f"  ✗ 失败: todos/ 目录")
-    
-    def clean_plugin_cache(self, preview_only=False):
-        """清理插件缓存"""
-        if not preview_only:
-            print("\n🧹 清理插件缓存...")
-        plugin_cache_dir = self.claude_dir / "plugins" / "cache"
-        
-        if plugin_cache_dir.exists():
-            if preview_only:
-                size = self.get_size(plugin_cache_dir)
-                self.preview_items.append({
-                    'path': plugin_cache_dir.relative_to(self.base_dir),
-                    'size': size,
-                    'type': '插件缓存'
-                })
-            else:
+    def match_candidate(self, rel: str, name: str, is_dir: bool):
+        """判断 .claude 下的条目是否是清理项，是则返回类型"""
+        if rel in CLEAN_PATHS:
+            return CLEAN_PATHS[rel]
+        if "/" not in rel and not is_dir and fnmatch.fnmatch(name, BACKUP_PATTERN):
+            return "备份文件"
+        if is_dir and name == ".git" and rel.startswith(MARKETPLACES_DIR + "/"):
+            return "Git仓库"
+        return None
+
+    def may_contain_candidates(self, rel: str) -> bool:
+        """不是清理项的目录中，只有插件市场目录树还可能包含清理项（.git）"""
+        return rel == "plugins" or rel == MARKETPLACES_DIR or rel.startswith(MARKETPLACES_DIR + "/")
+
+    def scan_index(self):
+        """
+        单次 os.scandir 遍历建立清理索引
+        每个清理项记录路径、类型、大小和文件数，预览、确认和删除都使用这份索引，不再重复扫描；
+        只进入清理项目录和可能包含清理项的目录，每个文件只 stat 一次
+        """
+        self.index = []
+        stack = [(str(self.claude_dir), "", None)]
+        while stack:
+            path, rel, owner = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            if owner is not None:
+                                # 清理项目录内部：只累计大小
+                                if is_dir:
+                                    stack.append((entry.path, entry_rel, owner))
+                                else:
+                                    owner['size'] += entry.stat(follow_symlinks=False).st_size
+                                    owner['files'] += 1
+                                continue
+                            item_type = self.match_candidate(entry_rel, entry.name, is_dir)
+                            if item_type:
+                                item = {
+                                    'path': Path(entry.path),
+                                    'type': item_type,
+                                    'is_dir': is_dir,
+                                    'size': 0 if is_dir else entry.stat(follow_symlinks=False).st_size,
+                                    'files': 0 if is_dir else 1,
+                                }
+                                self.index.append(item)
+                                if is_dir:
+                                    stack.append((entry.path, entry_rel, item))
+                            elif is_dir and self.may_contain_candidates(entry_rel):
+                                stack.append((entry.path, entry_rel, None))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+        order = {item_type: i for i, (item_type, _) in enumerate(CATEGORIES)}
+        self.index.sort(key=lambda item: (order[item['type']], str(item['path'])))
+        return self.index
+
+    def delete_indexed(self):
+        """按类别顺序删除索引中的清理项"""
+        for item_type, title in CATEGORIES:
+            items = [item for item in self.index if item['type'] == item_type]
+            if not items:
+                continue
+            print(f"\n🧹 {title}...")
+            for item in items:
+                rel = item['path'].relative_to(self.claude_dir).as_posix()
+                label = f"{rel}/ 目录" if item['is_dir'] else rel
                 try:
-                    shutil.rmtree(plugin_cache_dir)
-                    self.cleaned_items.append(str(plugin_cache_dir.relative_to(self.base_dir)))
-                    print(f"  ✓ 删除: plugins/cache/ 目录")
+                    if item['is_dir']:
+                        shutil.rmtree(item['path'])
+                    else:
+                        item['path'].unlink()
+                    self.cleaned_items.append(str(item['path'].relative_to(self.base_dir)))
+                    self.freed_size += item['size']
+                    print(f"  ✓ 删除: {label}")
                 except Exception as e:
-                    self.errors.append(f"删除 plugins/cache/ 目录失败: {e}")
-                    print(f"  ✗ 失败: plugins/cache/ 目录")
-    
-    def clean_git_repos(self, preview_only=False):
-        """清理插件市场的 .git 目录"""
-        if not preview_only:
-            print("\n🧹 清理 Git 仓库数据...")
-        marketplaces_dir = self.claude_dir / "plugins" / "marketplaces"
-        
-        if marketplaces_dir.exists():
-            git_dirs = list(marketplaces_dir.rglob(".git"))
-            for git_dir in git_dirs:
-                if preview_only:
-                    size = self.get_size(git_dir)
-                    self.preview_items.append({
-                        'path': git_dir.relative_to(self.base_dir),
-                        'size': size,
-                        'type': 'Git仓库'
-                    })
-                else:
-                    try:
-                        shutil.rmtree(git_dir)
-                        self.cleaned_items.append(str(git_dir.relative_to(self.base_dir)))
-                        print(f"  ✓ 删除: {git_dir.relative_to(self.claude_dir)}")
-                    except Exception as e:
-                        self.errors.append(f"删除 {git_dir.relative_to(self.claude_dir)} 失败: {e}")
-                        print(f"  ✗ 失败: {git_dir.relative_to(self.claude_dir)}")
+                    self.errors.append(f"删除 {label} 失败: {e}")
+                    print(f"  ✗ 失败: {label}")
     
     def generate_report(self):
         """生成清理报告"""
@@ -289,6 +156,7 @@ class ClaudeCacheCleaner:
         print("="*60)
         print(f"✓ 成功清理: {len(self.cleaned_items)} 项")
         print(f"✗ 失败: {len(self.errors)} 项")
+        print(f"💾 释放空间: {self.format_size(self.freed_size)}")
         
         if self.cleaned_items:
             print("\n已清理的项目:")
@@ -307,7 +175,8 @@ class ClaudeCacheCleaner:
             f.write(f"清理时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("="*60 + "\n\n")
             f.write(f"成功清理: {len(self.cleaned_items)} 项\n")
-            f.write(f"失败: {len(self.errors)} 项\n\n")
+            f.write(f"失败: {len(self.errors)} 项\n")
+            f.write(f"释放空间: {self.format_size(self.freed_size)}\n\n")
             
             if self.cleaned_items:
                 f.write("已清理的项目:\n")
@@ -327,35 +196,28 @@ class ClaudeCacheCleaner:
         print("🔍 扫描缓存文件...")
         print("="*60)
         
-        # 预览模式扫描所有文件
-        self.clean_backup_files(preview_only=True)
-        self.clean_history(preview_only=True)
-        self.clean_stats_cache(preview_only=True)
-        self.clean_cache_dir(preview_only=True)
-        self.clean_debug_dir(preview_only=True)
-        self.clean_projects_dir(preview_only=True)
-        self.clean_telemetry_dir(preview_only=True)
-        self.clean_todos_dir(preview_only=True)
-        self.clean_plugin_cache(preview_only=True)
-        self.clean_git_repos(preview_only=True)
+        self.scan_index()
         
-        if not self.preview_items:
+        if not self.index:
             print("\n✨ 没有发现需要清理的缓存文件！")
             return False
         
         # 显示预览列表
-        print(f"\n📋 发现 {len(self.preview_items)} 项可清理内容：")
+        print(f"\n📋 发现 {len(self.index)} 项可清理内容：")
         print("="*60)
         
         total_size = 0
-        for item in self.preview_items:
+        for item in self.index:
             total_size += item['size']
-            print(f"[{item['type']}] {item['path']}")
-            print(f"  大小: {self.format_size(item['size'])}")
+            print(f"[{item['type']}] {item['path'].relative_to(self.base_dir)}")
+            if item['is_dir']:
+                print(f"  大小: {self.format_size(item['size'])}（{item['files']} 个文件）")
+            else:
+                print(f"  大小: {self.format_size(item['size'])}")
             print()
         
         print("="*60)
-        print(f"📊 总计: {len(self.preview_items)} 项，共 {self.format_size(total_size)}")
+        print(f"📊 总计: {len(self.index)} 项，共 {self.format_size(total_size)}")
         print("="*60)
         
         return True
@@ -400,17 +262,8 @@ class ClaudeCacheCleaner:
         print("🧹 开始清理...")
         print("="*60)
         
-        # 执行各项清理任务
-        self.clean_backup_files()
-        self.clean_history()
-        self.clean_stats_cache()
-        self.clean_cache_dir()
-        self.clean_debug_dir()
-        self.clean_projects_dir()
-        self.clean_telemetry_dir()
-        self.clean_todos_dir()
-        self.clean_plugin_cache()
-        self.clean_git_repos()
+        # 按预览时建立的索引删除（不重新扫描）
+        self.delete_indexed()
         
         # 生成报告
         self.generate_report()
@@ -9,10 +9,23 @@ clean_project_cache.py - 清理项目缓存文件和目录
 - 其他临时文件和缓存目录
 
 注意: *.pyd 是 Python 动态链接库（编译后的扩展模块），不是缓存，不应删除！
+
+集中缓存模式（--central）:
+  claude-code-venv 在 .env 中设置 CLAUDE_VENV_PYCACHE=1 后，Claude 运行的 Python 会把字节码
+  写到 claude-code-venv/.venv-state/pycache/current（PYTHONPYCACHEPREFIX），不再散落在项目里。
+  --central 只处理这个目录，不遍历项目：把 current 封存为一代 gen-<时间>，
+  再按年龄和大小上限整代删除。每代只在封存时统计一次大小，之后的清理只需列出顶层目录。
+
+  python Clear_Python_Cache.py --central                      # 默认保留 14 天、总计 512 MB
+  python Clear_Python_Cache.py --central --max-age-days 7 --max-mb 256
+  python Clear_Python_Cache.py --central --dry-run            # 只显示将删除的代
 """
 
 import os
+import sys
+import time
 import shutil
+import argparse
 from pathlib import Path
 import fnmatch
 
@@ -50,6 +63,13 @@ PROTECTED_DIRS = [
     "backup",          # 备份目录
 ]
 
+# 集中缓存目录（与 claude-code-venv/run.py 的 get_pycache_root 一致）
+CENTRAL_PYCACHE_DIR = Path(__file__).resolve().parent.parent / "claude-code-venv" / ".venv-state" / "pycache"
+CENTRAL_CURRENT = "current"           # 当前代（PYTHONPYCACHEPREFIX 指向这里）
+CENTRAL_CREATED_MARKER = ".created"   # 当前代的创建时间
+CENTRAL_SIZE_MARKER = ".size"         # 封存时统计的大小
+CENTRAL_GEN_FORMAT = "gen-%Y%m%d-%H%M%S"
+
 # ==================== 功能函数 ====================
 
 def match_pattern(name, patterns):
@@ -241,5 +261,149 @@ def clean_cache():
     clean_items(target_dirs, target_files, total_size)
 
 
-if __name__ == "__main__":
+# ==================== 集中缓存 ====================
+
+def read_marker(path, default=None):
+    """读取标记文件中的整数，不存在或损坏时返回 default"""
+    try:
+        return int(float(path.read_text().strip()))
+    except (OSError, ValueError):
+        return default
+
+
+def write_marker(path, value):
+    path.write_text(str(int(value)))
+
+
+def rotate_central(root, rotate_hours, dry_run):
+    """
+    当前代存在超过 rotate_hours 时封存为 gen-<时间>（一次 rename），并新建空的当前代
+    返回: 新封存的代目录，未封存时返回 None
+    """
+    current = root / CENTRAL_CURRENT
+    if not current.is_dir():
+        return None
+    now = time.time()
+    created = read_marker(current / CENTRAL_CREATED_MARKER)
+    if created is None:
+        if not dry_run:
+            write_marker(current / CENTRAL_CREATED_MARKER, now)
+        return None
+    if now - created < rotate_hours * 3600:
+        return None
+    sealed = root / time.strftime(CENTRAL_GEN_FORMAT, time.localtime(now))
+    if dry_run:
+        print(f"  将封存当前代 → {sealed.name}")
+        return None
+    os.rename(current, sealed)
+    # Python 写缓存时会自动创建 current，这里提前创建并记录时间
+    current.mkdir(exist_ok=True)
+    write_marker(current / CENTRAL_CREATED_MARKER, now)
+    return sealed
+
+
+def list_generations(root):
+    """
+    列出已封存的代: [(目录, 封存时间, 大小)]，按封存时间从旧到新
+    没有大小记录的代（刚封存）统计一次并写入 .size
+    """
+    generations = []
+    for entry in os.scandir(root):
+        if not entry.is_dir(follow_symlinks=False) or not entry.name.startswith("gen-"):
+            continue
+        try:
+            sealed_at = time.mktime(time.strptime(entry.name, CENTRAL_GEN_FORMAT))
+        except ValueError:
+            continue
+        path = Path(entry.path)
+        size = read_marker(path / CENTRAL_SIZE_MARKER)
+        if size is None:
+            size = get_dir_size(entry.path)
+            write_marker(path / CENTRAL_SIZE_MARKER, size)
+        generations.append((path, sealed_at, size))
+    generations.sort(key=lambda item: item[1])
+    return generations
+
+
+def remove_generation(path):
+    """先改名再删除，删除中断时不会留下看起来完整的代"""
+    trash = path.with_name(f".trash-{path.name}")
+    os.rename(path, trash)
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def prune_central(root, max_age_days, max_mb, rotate_hours, dry_run):
+    """清理集中缓存: 封存当前代，删除过期的代，再从最旧的代开始删除直到不超过大小上限"""
+    print("=" * 80)
+    print("集中 Python 字节码缓存清理")
+    print("=" * 80)
+    print(f"目录: {root}")
+    if not root.is_dir():
+        print("\n集中缓存目录不存在（在 claude-code-venv/.env 中设置 CLAUDE_VENV_PYCACHE=1 开启）")
+        return 0
+
+    # 清理上次中断遗留的删除
+    for entry in root.glob(".trash-gen-*"):
+        shutil.rmtree(entry, ignore_errors=True)
+
+    sealed = rotate_central(root, rotate_hours, dry_run)
+    if sealed:
+        print(f"  ✓ 已封存当前代 → {sealed.name}")
+
+    generations = list_generations(root)
+    now = time.time()
+    budget = max_mb * 1024 * 1024
+    total = sum(size for _, _, size in generations)
+    doomed = []
+    for path, sealed_at, size in generations:
+        expired = now - sealed_at >= max_age_days * 86400
+        if expired or total > budget:
+            doomed.append((path, size, "过期" if expired else "超出大小上限"))
+            total -= size
+
+    print(f"\n已封存 {len(generations)} 代，保留 {len(generations) - len(doomed)} 代（{format_size(total)}，"
+          f"上限 {max_age_days} 天 / {format_size(budget)}，当前代不计入）")
+    freed = 0
+    for path, size, reason in doomed:
+        if dry_run:
+            print(f"  将删除 {path.name} ({format_size(size)}，{reason})")
+            continue
+        try:
+            remove_generation(path)
+            freed += size
+            print(f"  ✓ 已删除 {path.name} ({format_size(size)}，{reason})")
+        except OSError as e:
+            print(f"  ✗ [错误] {path.name}: {e}")
+    if freed:
+        print(f"\n释放空间: {format_size(freed)}")
+    print("=" * 80)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="清理项目缓存文件和目录",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python Clear_Python_Cache.py                                 # 扫描当前目录并确认清理
+  python Clear_Python_Cache.py --central                       # 清理 claude-code-venv 的集中字节码缓存
+  python Clear_Python_Cache.py --central --max-age-days 7 --max-mb 256 --dry-run
+        """
+    )
+    parser.add_argument("--central", nargs="?", const=str(CENTRAL_PYCACHE_DIR), metavar="DIR",
+                        help="清理集中字节码缓存（默认 claude-code-venv/.venv-state/pycache）")
+    parser.add_argument("--max-age-days", type=float, default=14, help="集中缓存保留天数（默认 14）")
+    parser.add_argument("--max-mb", type=float, default=512, help="集中缓存总大小上限（MB，默认 512）")
+    parser.add_argument("--rotate-hours", type=float, default=24, help="当前代存在多久后封存（小时，默认 24）")
+    parser.add_argument("--dry-run", action="store_true", help="只显示将删除的内容")
+    args = parser.parse_args()
+
+    if args.central:
+        return prune_central(Path(args.central), args.max_age_days, args.max_mb, args.rotate_hours, args.dry_run)
     clean_cache()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Claude Code 批量任务
+
+通过 run.py batch 调用，对 JSONL 任务文件中的每一行运行一次非交互的 claude -p：
+- 启动环境只解析一次（复用 run.py 的启动快照），所有任务共用
+- 线程池按 -j 限制并发，每个任务有超时（超时后结束整个进程组）
+- 每完成一个任务就向结果文件追加一行 JSON；Ctrl-C 时取消排队的任务、结束运行中的任务，
+  已完成的结果不会丢失
+- 结束后汇总吞吐量和延迟分位数
+
+任务文件每行一个 JSON 对象：
+    {"id": "t1", "prompt": "总结 README.md"}
+    {"id": "t2", "prompt": "列出 TODO", "cwd": "../project", "timeout": 120, "args": ["--model", "haiku"]}
+也可以每行只写一个字符串作为 prompt。
+
+使用方法：
+    ./run.sh batch jobs.jsonl                       # 默认并发数为 CPU 核数
+    ./run.sh batch jobs.jsonl -j 4 --timeout 300    # 4 个并发，单个任务超时 300 秒
+    ./run.sh batch jobs.jsonl --mock-api            # 使用本地模拟 API（mock_api.py）离线验证
+    ./run.sh batch jobs.jsonl --shards -- --model haiku   # 每个并发槽位使用独立的用户目录分片
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import threading
+import argparse
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+# 结果中保留的 stderr 末尾长度
+STDERR_TAIL = 2000
+
+
+def load_jobs(jobs_file: Path) -> list:
+    """
+    读取 JSONL 任务文件（忽略空行和 # 注释）
+    返回: 任务列表，缺少 id 的任务按行号命名
+    """
+    jobs = []
+    with open(jobs_file, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{jobs_file}:{line_no}: 不是有效的 JSON: {e}")
+            if isinstance(job, str):
+                job = {"prompt": job}
+            if not isinstance(job, dict) or not job.get("prompt"):
+                raise ValueError(f"{jobs_file}:{line_no}: 缺少 prompt")
+            job.setdefault("id", str(line_no))
+            jobs.append(job)
+    return jobs
+
+
+def kill_process_tree(process: subprocess.Popen) -> None:
+    """结束任务进程及其子进程（Claude 会拉起 shell、MCP 等子进程）"""
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+
+
+def parse_output(stdout: str):
+    """解析 --output-format json 的输出，不是 JSON 时返回原文"""
+    try:
+        return json.loads(stdout)
+    except ValueError:
+        return stdout.strip()
+
+
+def run_job(job: dict, cmd: list, env: dict, cwd: Path, timeout: float, running: dict = None) -> dict:
+    """
+    运行单个任务，返回结果记录
+    running 为 {任务 id: Popen}，运行期间登记进程，中断时由调用方结束
+    """
+    job_cwd = Path(job["cwd"]) if job.get("cwd") else cwd
+    if not job_cwd.is_absolute():
+        job_cwd = cwd / job_cwd
+    job_timeout = job.get("timeout") or timeout
+    args = cmd + ["-p", job["prompt"], "--output-format", "json"] + list(job.get("args", []))
+    popen_kwargs = {}
+    if os.name == "nt":
+        popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        popen_kwargs["start_new_session"] = True
+
+    record = {"id": job["id"]}
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(args, env=dict(env, **job.get("env", {})), cwd=str(job_cwd),
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, encoding="utf-8",
+                                   errors="replace", **popen_kwargs)
+    except OSError as e:
+        record.update(status="error", returncode=None, seconds=0.0, error=str(e))
+        return record
+    if running is not None:
+        running[job["id"]] = process
+    try:
+        stdout, stderr = process.communicate(timeout=job_timeout)
+        status = "ok" if process.returncode == 0 else "error"
+    except subprocess.TimeoutExpired:
+        kill_process_tree(process)
+        stdout, stderr = process.communicate()
+        status = "timeout"
+    finally:
+        if running is not None:
+            running.pop(job["id"], None)
+    record.update(
+        status=status,
+        returncode=process.returncode,
+        seconds=round(time.monotonic() - start, 3),
+        output=parse_output(stdout),
+    )
+    if stderr.strip():
+        record["stderr"] = stderr[-STDERR_TAIL:]
+    return record
+
+
+class ShardPool:
+    """
+    --shards：每个并发槽位一个用户目录分片（session_shards.py），任务从池中借用，
+    结束后把所有分片合并回共享用户目录
+    """
+
+    def __init__(self, config_dir: Path, size: int):
+        from session_shards import prepare_shard
+        self.config_dir = config_dir
+        self.batch = time.strftime("%Y%m%d-%H%M%S")
+        self.shards = [prepare_shard(config_dir, f"batch-{self.batch}-{index}") for index in range(1, size + 1)]
+        self.free = queue.Queue()
+        for shard_dir in self.shards:
+            self.free.put(shard_dir)
+
+    def close(self) -> int:
+        """合并并删除所有分片，返回合并的历史记录条数"""
+        from session_shards import merge_shard, remove_shard
+        merged = 0
+        for shard_dir in self.shards:
+            merged += merge_shard(self.config_dir, shard_dir)["history"]
+            remove_shard(shard_dir)
+        return merged
+
+
+def print_summary(results: list, elapsed: float, output_file: Path) -> None:
+    from update import percentile
+
+    counts = {}
+    for record in results:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+    latencies = [record["seconds"] for record in results if record["status"] == "ok"]
+    print()
+    print("=" * 60)
+    print("📊 批量任务汇总")
+    print("=" * 60)
+    print(f"任务: {len(results)} 个（成功 {counts.get('ok', 0)}，失败 {counts.get('error', 0)}，"
+          f"超时 {counts.get('timeout', 0)}，中断 {counts.get('interrupted', 0)}）")
+    print(f"总耗时: {elapsed:.1f}s，吞吐量: {len(results) / elapsed * 60 if elapsed else 0:.1f} 个/分钟")
+    if latencies:
+        print(f"延迟（成功任务）: p50 {percentile(latencies, 50):.2f}s，p90 {percentile(latencies, 90):.2f}s，"
+              f"p99 {percentile(latencies, 99):.2f}s，最大 {max(latencies):.2f}s")
+    print(f"结果文件: {output_file}")
+
+
+def run_batch(env: dict, cmd: list, argv: list, cwd: Path) -> int:
+    """
+    run.py batch 的入口
+    env / cmd 为 run.py 已解析好的启动环境和启动命令，argv 为 batch 之后的参数
+    """
+    parser = argparse.ArgumentParser(
+        prog="run.py batch",
+        description="批量运行非交互的 Claude Code 任务",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  ./run.sh batch jobs.jsonl -j 4 --timeout 300
+  ./run.sh batch jobs.jsonl --mock-api
+  ./run.sh batch jobs.jsonl --shards -- --model haiku    # -- 之后的参数传给每个任务
+        """
+    )
+    parser.add_argument("jobs", help="JSONL 任务文件")
+    parser.add_argument("-j", "--parallel", type=int, default=os.cpu_count() or 1, help="并发数（默认 CPU 核数）")
+    parser.add_argument("--timeout", type=float, default=600, help="单个任务的超时秒数（默认 600）")
+    parser.add_argument("-o", "--output", help="结果 JSONL 文件（默认 <任务文件>.results.jsonl）")
+    parser.add_argument("--mock-api", action="store_true", help="使用本地模拟 API（不消耗额度，用于验证流程和测量开销）")
+    parser.add_argument("--shards", action="store_true", help="每个并发槽位使用独立的用户目录分片，结束后合并")
+    extra = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    jobs_file = Path(args.jobs)
+    output_file = Path(args.output) if args.output else jobs_file.with_name(f"{jobs_file.stem}.results.jsonl")
+    try:
+        jobs = load_jobs(jobs_file)
+    except (OSError, ValueError) as e:
+        print(f"❌ 错误：{e}")
+        return 2
+    if not jobs:
+        print(f"❌ 错误：{jobs_file} 中没有任务")
+        return 2
+    parallel = max(1, min(args.parallel, len(jobs)))
+
+    server = None
+    if args.mock_api:
+        from mock_api import MockAnthropicServer
+        server = MockAnthropicServer()
+        env = dict(env, **server.client_env())
+        print(f"🧪 模拟 API: {server.start()}")
+
+    shard_pool = ShardPool(Path(env["CLAUDE_CONFIG_DIR"]), parallel) if args.shards else None
+    # 正在运行的任务进程（任务进程在独立的会话中，收不到 Ctrl-C，中断时需要逐个结束）
+    running = {}
+    interrupted = threading.Event()
+
+    def run_one(job: dict) -> dict:
+        if interrupted.is_set():
+            return None
+        if shard_pool is None:
+            record = run_job(job, cmd + extra, env, cwd, args.timeout, running)
+        else:
+            shard_dir = shard_pool.free.get()
+            try:
+                record = run_job(job, cmd + extra, dict(env, CLAUDE_CONFIG_DIR=str(shard_dir)), cwd, args.timeout, running)
+            finally:
+                shard_pool.free.put(shard_dir)
+        if interrupted.is_set() and record["status"] == "error":
+            record["status"] = "interrupted"
+        return record
+
+    def record_result(out, record: dict) -> None:
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        results.append(record)
+
+    print(f"📋 {len(jobs)} 个任务，并发 {parallel}，超时 {args.timeout:g}s → {output_file}")
+    results = []
+    start = time.monotonic()
+    try:
+        with open(output_file, "w", encoding="utf-8") as out:
+            pool = ThreadPoolExecutor(max_workers=parallel)
+            futures = [pool.submit(run_one, job) for job in jobs]
+            try:
+                for future in as_completed(futures):
+                    record = future.result()
+                    record_result(out, record)
+                    mark = {"ok": "✅", "timeout": "⏰"}.get(record["status"], "❌")
+                    print(f"{mark} [{len(results)}/{len(jobs)}] {record['id']}: {record['seconds']:.1f}s")
+            except KeyboardInterrupt:
+                # 取消排队的任务，结束正在运行的任务（刚启动的进程也要结束，所以反复检查直到线程全部退出），
+                # 已完成但尚未写入的结果照常写入
+                interrupted.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                while not all(future.done() for future in futures):
+                    for process in list(running.values()):
+                        kill_process_tree(process)
+                    wait(futures, timeout=0.2)
+                written = {id(record) for record in results}
+                for future in futures:
+                    if future.cancelled() or future.exception() is not None:
+                        continue
+                    record = future.result()
+                    if record is not None and id(record) not in written:
+                        record_result(out, record)
+                print(f"\n⚠️  已中断，已取消 {sum(future.cancelled() for future in futures)} 个未开始的任务")
+            pool.shutdown(wait=True)
+    finally:
+        if shard_pool:
+            print(f"🔀 已合并 {shard_pool.close()} 条历史记录到共享用户目录")
+        if server:
+            print(f"🧪 模拟 API 请求: {json.dumps(server.request_counts, ensure_ascii=False)}")
+            server.stop()
+
+    print_summary(results, time.monotonic() - start, output_file)
+    if interrupted.is_set():
+        return 130
+    return 0 if all(record["status"] == "ok" for record in results) else 1
+
+
+if __name__ == "__main__":
+    print("请通过启动器运行：./run.sh batch <任务文件.jsonl>（Windows: run.bat batch ...）")
+    sys.exit(2)
@@ -30,10 +30,11 @@ from pathlib import Path
 class VenvBuilder:
     """虚拟环境构建器"""
     
-    def __init__(self, script_dir, node_version='20.11.0'):
+    def __init__(self, script_dir, node_version='20.11.0', pack_image=False):
         self.script_dir = Path(script_dir)
         self.system = platform.system().lower()
         self.node_version = node_version
+        self.pack_image = pack_image
         
         # 虚拟环境配置
         self.venv_configs = {
@@ -115,8 +116,9 @@ class VenvBuilder:
         return env
 
     def get_portable_npm_paths(self):
-        """返回项目内专用 npm 配置路径，避免读写用户全局配置"""
-        return self.script_dir / '.npmrc.portable', self.script_dir / '.npm-cache'
+        """返回项目内专用 npm 配置路径，避免读写用户全局配置（慢速存储上缓存位于本机，见 cache_location.py）"""
+        from cache_location import get_cache_root
+        return self.script_dir / '.npmrc.portable', get_cache_root(self.script_dir) / '.npm-cache'
 
     def prepare_portable_npm_env(self, env, venv_path):
         """配置仅对当前进程生效的 npm 环境变量"""
@@ -646,10 +648,10 @@ SYSTEM_NAME=\"$(uname -s)\"
 
 case \"$SYSTEM_NAME\" in
     Darwin*)
-        PYTHON_EXE=\"$SCRIPT_DIR/venv_mac/bin/python\"
+        VENV_NAME=\"venv_mac\"
         ;;
     Linux*)
-        PYTHON_EXE=\"$SCRIPT_DIR/venv_linux/bin/python\"
+        VENV_NAME=\"venv_linux\"
         ;;
     *)
         echo \"❌ 不支持的系统：$SYSTEM_NAME\"
@@ -657,6 +659,8 @@ case \"$SYSTEM_NAME\" in
         ;;
 esac
 
+PYTHON_EXE=\"$SCRIPT_DIR/$VENV_NAME/bin/python\"
+
 if [ ! -x \"$PYTHON_EXE\" ]; then
     echo \"❌ 未找到对应虚拟环境：$PYTHON_EXE\"
     echo
@@ -665,6 +669,49 @@ if [ ! -x \"$PYTHON_EXE\" ]; then
     exit 1
 fi
 
+# 启动追踪的纳秒时间戳：BSD date（macOS）不支持 %N，改用 perl / python3
+trace_now() {
+    NOW=\"$(date +%s%N 2>/dev/null)\"
+    case \"$NOW\" in
+        \"\"|*[!0-9]*)
+            NOW=\"$(perl -MTime::HiRes=time -e 'printf \"%.0f\", time() * 1e9' 2>/dev/null \\
+                || python3 -c 'import time; print(time.time_ns())' 2>/dev/null)\"
+            ;;
+    esac
+    echo \"$NOW\"
+}
+
+# run.py 自己处理的参数（启动追踪等）需要经过 Python，不走快速启动
+USE_SNAPSHOT=1
+[ \"${CLAUDE_VENV_SNAPSHOT:-1}\" = \"0\" ] && USE_SNAPSHOT=0
+case \"${CLAUDE_VENV_LAUNCH_TRACE:-0}\" in
+    1|true|yes|on) USE_SNAPSHOT=0; CLAUDE_VENV_TRACE_T0=\"$(trace_now)\" ;;
+esac
+[ \"${1-}\" = \"batch\" ] && USE_SNAPSHOT=0
+for ARG in \"$@\"; do
+    case \"$ARG\" in
+        --) break ;;
+        --readahead-learn|--readahead-warm|--compile-cache-prune|--monitor|--doctor|\\
+        --sessions|--sessions=*|--session-id|--session-id=*|--session-parallel|--session-parallel=*)
+            USE_SNAPSHOT=0
+            ;;
+        --launch-trace|--launch-trace-report)
+            USE_SNAPSHOT=0
+            CLAUDE_VENV_TRACE_T0=\"$(trace_now)\"
+            ;;
+    esac
+done
+[ -n \"${CLAUDE_VENV_TRACE_T0:-}\" ] && export CLAUDE_VENV_TRACE_T0
+
+# 快速启动：run.py 保存的启动环境快照仍然有效时，直接 exec Claude，不启动 Python
+SNAPSHOT_FILE=\"$SCRIPT_DIR/.venv-state/launch-env-$VENV_NAME.sh\"
+if [ \"$USE_SNAPSHOT\" = \"1\" ] && [ -f \"$SNAPSHOT_FILE\" ]; then
+    . \"$SNAPSHOT_FILE\"
+    if claude_venv_snapshot_valid; then
+        claude_venv_launch \"$@\"
+    fi
+fi
+
 exec \"$PYTHON_EXE\" \"$SCRIPT_DIR/run.py\" \"$@\"
 """
         }
@@ -684,6 +731,20 @@ exec \"$PYTHON_EXE\" \"$SCRIPT_DIR/run.py\" \"$@\"
             self.print_success(f"创建入口脚本：{', '.join(created)}")
         return True
     
+    def pack_runtime_image(self, platform_key):
+        """把 claude-code 包打包成单文件运行镜像（见 runtime_image.py）"""
+        config = self.venv_configs[platform_key]
+        venv_path = self.script_dir / config['name']
+        try:
+            from runtime_image import pack_image
+            manifest = pack_image(venv_path)
+            self.print_success(f"运行镜像：{manifest['files']} 个文件，{manifest['bytes'] / 1024 / 1024:.1f} MB")
+            self.print_info("在 .env 中设置 CLAUDE_VENV_IMAGE=1 使用镜像启动")
+            return True
+        except Exception as e:
+            self.print_warning(f"打包运行镜像失败：{e}")
+            return False
+    
     def build(self, platform_key):
         """构建指定平台的虚拟环境"""
         config = self.venv_configs[platform_key]
@@ -716,6 +777,10 @@ exec \"$PYTHON_EXE\" \"$SCRIPT_DIR/run.py\" \"$@\"
         # 创建便捷激活脚本
         self.create_activate_claude_script(platform_key)
         self.create_entry_scripts()
+
+        # 可选：打包单文件运行镜像
+        if self.pack_image:
+            self.pack_runtime_image(platform_key)
         
         self.print_success(f"{config['name']} 构建完成！")
         return True
@@ -757,6 +822,7 @@ def main():
   python3 build_venv.py --win              # 只构建 Windows 虚拟环境
   python3 build_venv.py --mac --linux      # 构建 macOS 和 Linux 虚拟环境
   python3 build_venv.py --node-version 18.19.0  # 指定 Node.js 版本
+  python3 build_venv.py --pack-image       # 构建后打包单文件运行镜像
         """
     )
     
@@ -765,6 +831,7 @@ def main():
     parser.add_argument('--linux', action='store_true', help='构建 Linux 虚拟环境')
     parser.add_argument('--win', action='store_true', help='构建 Windows 虚拟环境')
     parser.add_argument('--node-version', default='20.11.0', help='Node.js 版本（默认：20.11.0）')
+    parser.add_argument('--pack-image', action='store_true', help='构建后把 claude-code 打包成单文件运行镜像（适合网络盘 / U 盘）')
     
     args = parser.parse_args()
     
@@ -772,7 +839,7 @@ def main():
     script_dir = Path(__file__).parent.absolute()
     
     # 创建构建器
-    builder = VenvBuilder(script_dir, node_version=args.node_version)
+    builder = VenvBuilder(script_dir, node_version=args.node_version, pack_image=args.pack_image)
     
     # 检查 Python 版本
     if not builder.check_python_version():
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+按存储介质决定可再生缓存的位置
+
+npm 下载缓存（.npm-cache）和 V8 编译缓存默认放在便携目录里。便携目录在 U 盘、网络盘等慢速介质上时，
+每次 npm 操作和 Claude 启动都要为这些小文件付出额外延迟。本模块：
+- 识别便携目录所在的存储：网络文件系统、可移动设备、本地磁盘；无法识别时实测小文件读写延迟
+- 存储较慢时把缓存放到本机的快速目录（Linux 为 $XDG_CACHE_HOME，macOS 为 ~/Library/Caches，
+  Windows 为 %LOCALAPPDATA%）下的 claude-code-venv/<便携目录 ID>/
+- 决定按机器记录在便携目录的 .cache-location.json 中，之后直接复用；
+  换到另一台电脑时重新判断，本机目录不可用时回退到便携目录
+
+run.py、update.py、build_venv.py 都通过 get_cache_root 取得缓存根目录，
+npm 缓存为 <根目录>/.npm-cache，编译缓存为 <根目录>/.venv-state/compile-cache。
+
+CLAUDE_VENV_CACHE_TIER 可以固定位置：auto（默认）/ portable / local。
+
+使用方法：
+    python3 cache_location.py            # 查看本机的判断结果
+    python3 cache_location.py --reset    # 重新识别（会实测一次读写延迟）
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import platform
+import subprocess
+from pathlib import Path
+
+POINTER_FILE = ".cache-location.json"
+# 网络文件系统
+NETWORK_FSTYPES = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "afpfs", "webdav", "davfs", "9p",
+    "fuse.sshfs", "fuse.rclone", "fuse.gvfsd-fuse", "fuse.davfs2",
+}
+# 常见于 U 盘 / 移动硬盘的文件系统
+REMOVABLE_FSTYPES = {"vfat", "msdos", "exfat", "fuseblk", "ntfs", "ntfs3", "fuse.exfat"}
+# 实测时每次小文件写入 + fsync + 读取的中位耗时超过此值视为慢速存储
+SLOW_LATENCY_MS = 3.0
+# 实测的文件数
+PROBE_FILES = 16
+# Windows GetDriveTypeW 的返回值
+DRIVE_REMOVABLE = 2
+DRIVE_REMOTE = 4
+
+
+def get_machine_id() -> str:
+    """区分机器的 ID（主机名 + 系统 + 用户）"""
+    user = os.environ.get("USER") or os.environ.get("USERNAME") or "user"
+    return f"{socket.gethostname()}/{platform.system()}/{user}"
+
+
+def get_local_cache_base() -> Path:
+    """本机的用户缓存目录"""
+    system = platform.system()
+    if system == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or str(Path.home() / "AppData" / "Local")
+    elif system == "Darwin":
+        base = str(Path.home() / "Library" / "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "claude-code-venv"
+
+
+def get_local_cache_root(script_dir: Path) -> Path:
+    """某个便携目录在本机的缓存目录（按便携目录路径区分）"""
+    return get_local_cache_base() / hashlib.sha1(str(script_dir).encode("utf-8")).hexdigest()[:12]
+
+
+# ==================== 存储识别 ====================
+
+def find_mount(path: Path, mounts: list) -> tuple:
+    """在 (设备, 挂载点, 文件系统类型) 列表中找到 path 所在的挂载点"""
+    target = str(path.resolve())
+    best = (None, None, None)
+    for device, mount, fstype in mounts:
+        if (target == mount or target.startswith(mount.rstrip("/") + "/")) and len(mount) >= len(best[1] or ""):
+            best = (device, mount, fstype)
+    return best
+
+
+def is_removable_block_device(device: str) -> bool:
+    """Linux：根据 /sys/block/<磁盘>/removable 判断设备是否可移动（如 /dev/sdb1 → sdb）"""
+    if not device or not device.startswith("/dev/"):
+        return False
+    name = Path(os.path.realpath(device)).name
+    sys_class = Path("/sys/class/block") / name
+    try:
+        # 分区的上一级目录才是整个磁盘
+        disk = sys_class.resolve().parent if (sys_class / "partition").exists() else sys_class.resolve()
+        return (disk / "removable").read_text().strip() == "1"
+    except OSError:
+        return False
+
+
+def classify_storage(path: Path) -> dict:
+    """
+    按文件系统类型和设备属性识别存储
+    返回: {"kind": "network" / "removable" / "local" / "unknown", "fstype": ..., "mount": ...}
+    """
+    system = platform.system()
+    if system == "Windows":
+        import ctypes
+        drive = os.path.splitdrive(str(path.resolve()))[0] + "\\"
+        if drive.startswith("\\\\"):
+            return {"kind": "network", "fstype": None, "mount": drive}
+        drive_type = ctypes.windll.kernel32.GetDriveTypeW(drive)
+        kind = {DRIVE_REMOTE: "network", DRIVE_REMOVABLE: "removable"}.get(drive_type, "local")
+        return {"kind": kind, "fstype": None, "mount": drive}
+
+    mounts = []
+    local_flags = {}
+    try:
+        if system == "Linux":
+            with open("/proc/mounts", "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 3:
+                        mounts.append((parts[0], parts[1].replace("\\040", " "), parts[2]))
+        else:
+            # macOS / BSD：/dev/disk4s1 on /Volumes/USB (msdos, local, nodev, nosuid)
+            output = subprocess.run(["mount"], capture_output=True, text=True, timeout=5).stdout
+            for line in output.splitlines():
+                head, _, flags = line.rpartition(" (")
+                device, _, mount = head.partition(" on ")
+                flags = [flag.strip() for flag in flags.rstrip(")").split(",")]
+                mounts.append((device, mount, flags[0]))
+                local_flags[mount] = "local" in flags
+    except (OSError, subprocess.SubprocessError):
+        return {"kind": "unknown", "fstype": None, "mount": None}
+
+    device, mount, fstype = find_mount(path, mounts)
+    if fstype is None:
+        kind = "unknown"
+    elif fstype in NETWORK_FSTYPES or (mount in local_flags and not local_flags[mount]):
+        kind = "network"
+    elif fstype in REMOVABLE_FSTYPES or is_removable_block_device(device):
+        kind = "removable"
+    elif system == "Linux" and fstype in ("overlay", "tmpfs", "ramfs", "ext4", "xfs", "btrfs", "f2fs", "zfs", "apfs", "ext3"):
+        kind = "local"
+    elif system != "Linux" and fstype in ("apfs", "hfs", "ufs", "zfs"):
+        kind = "local"
+    else:
+        kind = "unknown"
+    return {"kind": kind, "fstype": fstype, "mount": mount}
+
+
+def measure_small_file_latency(directory: Path, count: int = PROBE_FILES) -> float:
+    """
+    实测小文件延迟：写入 4 KB + fsync + 读取 + 删除
+    返回: 每个文件耗时的中位数（毫秒）
+    """
+    probe_dir = directory / f".cache-probe-{os.getpid()}"
+    probe_dir.mkdir(parents=True, exist_ok=True)
+    payload = os.urandom(4096)
+    timings = []
+    try:
+        for index in range(count):
+            path = probe_dir / f"{index}.bin"
+            start = time.perf_counter()
+            with open(path, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(path, "rb") as f:
+                f.read()
+            path.unlink()
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        for leftover in probe_dir.glob("*"):
+            leftover.unlink()
+        probe_dir.rmdir()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+# ==================== 位置决定 ====================
+
+def read_pointer(script_dir: Path) -> dict:
+    try:
+        with open(script_dir / POINTER_FILE, "r", encoding="utf-8") as f:
+            pointer = json.load(f)
+        return pointer if isinstance(pointer, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def write_pointer(script_dir: Path, pointer: dict) -> None:
+    path = script_dir / POINTER_FILE
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(pointer, f, ensure_ascii=False, indent=2)
+        os.replace(str(tmp), str(path))
+    except OSError:
+        # 便携目录只读时不记录，下次重新判断
+        pass
+
+
+def decide_cache_location(script_dir: Path) -> dict:
+    """识别便携目录的存储，决定本机使用的缓存位置"""
+    storage = classify_storage(script_dir)
+    decision = {
+        "storage": storage["kind"],
+        "fstype": storage["fstype"],
+        "latency_ms": None,
+        "decided_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if storage["kind"] == "unknown":
+        try:
+            decision["latency_ms"] = round(measure_small_file_latency(script_dir), 2)
+        except OSError:
+            pass
+    slow = storage["kind"] in ("network", "removable") or (decision["latency_ms"] or 0) > SLOW_LATENCY_MS
+    decision["tier"] = "local" if slow else "portable"
+    if slow:
+        decision["cache_root"] = str(get_local_cache_root(script_dir))
+    return decision
+
+
+def get_cache_tier(script_dir: Path) -> str:
+    """CLAUDE_VENV_CACHE_TIER：.env 优先，其次是继承的环境变量"""
+    tier = os.environ.get("CLAUDE_VENV_CACHE_TIER", "")
+    try:
+        with open(script_dir / ".env", "r", encoding="utf-8") as f:
+            for line in f:
+                key, sep, value = line.strip().partition("=")
+                if sep and key.strip() == "CLAUDE_VENV_CACHE_TIER":
+                    tier = value.strip()
+    except OSError:
+        pass
+    return (tier or "auto").strip().lower()
+
+
+def get_cache_root(script_dir: Path) -> Path:
+    """
+    返回本机存放可再生缓存的根目录：便携目录本身，或存储较慢时的本机缓存目录
+    """
+    tier = get_cache_tier(script_dir)
+    if tier == "portable":
+        return script_dir
+    if tier == "local":
+        return get_local_cache_root(script_dir)
+
+    machine = get_machine_id()
+    pointer = read_pointer(script_dir)
+    decision = pointer.get(machine)
+    if not decision:
+        decision = decide_cache_location(script_dir)
+        pointer[machine] = decision
+        write_pointer(script_dir, pointer)
+    if decision.get("tier") != "local":
+        return script_dir
+    cache_root = Path(decision["cache_root"])
+    try:
+        cache_root.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        # 本机目录不可用（如家目录只读）时回退到便携目录
+        return script_dir
+    return cache_root
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="按存储介质决定可再生缓存的位置",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python3 cache_location.py
+  python3 cache_location.py --reset
+        """
+    )
+    parser.add_argument("--reset", action="store_true", help="重新识别本机的存储并更新记录")
+    args = parser.parse_args()
+
+    script_dir = Path(__file__).parent.absolute()
+    machine = get_machine_id()
+    if args.reset:
+        pointer = read_pointer(script_dir)
+        pointer.pop(machine, None)
+        write_pointer(script_dir, pointer)
+
+    cache_root = get_cache_root(script_dir)
+    decision = read_pointer(script_dir).get(machine, {})
+    print("=" * 60)
+    print("🗄️  缓存位置")
+    print("=" * 60)
+    print(f"本机: {machine}")
+    print(f"便携目录: {script_dir}")
+    if decision:
+        latency = f"，实测 {decision['latency_ms']} ms/文件" if decision.get("latency_ms") is not None else ""
+        print(f"存储: {decision.get('storage')}（{decision.get('fstype') or '未知文件系统'}{latency}）")
+    tier = get_cache_tier(script_dir)
+    if tier != "auto":
+        print(f"CLAUDE_VENV_CACHE_TIER={tier}")
+    print(f"缓存根目录: {cache_root}{'（便携目录）' if cache_root == script_dir else '（本机）'}")
+    print(f"npm 缓存: {cache_root / '.npm-cache'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
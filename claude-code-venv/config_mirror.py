@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+"""
+Claude Code 用户目录内存镜像
+
+便携盘上的 .claude 目录会被 Claude 持续写入（projects/ 下的会话记录、.claude.json、todos），
+每次写入都落在慢速介质上。开启 CLAUDE_VENV_CONFIG_MIRROR=1 后：
+- run.py 启动时把用户目录镜像到内存文件系统（Linux 为 /dev/shm，其他系统为临时目录）
+- Claude 只读写镜像，后台线程每隔几秒把变化增量回写到便携盘，退出时再完整回写一次
+- 会话记录等追加写入的 .jsonl 文件只回写新增的部分
+- 日志文件 .venv-state/config-mirror-<id>.json 记录镜像位置、会话进程和回写进度，
+  进程异常退出后下次启动会先把镜像中未回写的内容补回便携盘
+- 正常退出后镜像保留在内存中，下次启动只复制便携盘上有变化的文件
+
+使用方法：
+    python3 config_mirror.py status              # 查看镜像状态
+    python3 config_mirror.py recover             # 手动回写异常退出遗留的镜像
+    python3 config_mirror.py recover --discard   # 放弃无法回写的镜像记录（例如镜像在另一台电脑上）
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+# 后台回写的默认间隔（秒）
+DEFAULT_SYNC_INTERVAL = 5
+# 内存文件系统需要额外保留的空间
+FREE_SPACE_MARGIN = 64 * 1024 * 1024
+# 只追加写入的文件：变大时只回写新增部分
+APPEND_SUFFIXES = (".jsonl",)
+# 比较修改时间的容差（FAT/exFAT 的时间精度为 2 秒）
+MTIME_TOLERANCE_NS = 2 * 1000 ** 3
+# 回写锁超过此时间视为残留
+LOCK_STALE_SECONDS = 120
+# 复制过程中的临时文件后缀（扫描时忽略）
+TEMP_SUFFIX = ".mirror-tmp"
+
+
+def get_state_dir(script_dir: Path) -> Path:
+    """返回便携目录的状态目录"""
+    return script_dir / ".venv-state"
+
+
+def get_mirror_id(config_dir: Path) -> str:
+    """按用户目录路径生成镜像 ID"""
+    return hashlib.sha1(str(config_dir).encode("utf-8")).hexdigest()[:12]
+
+
+def get_journal_paths(script_dir: Path, config_dir: Path) -> tuple:
+    """返回 (日志文件, 回写锁) 路径"""
+    base = get_state_dir(script_dir) / f"config-mirror-{get_mirror_id(config_dir)}"
+    return base.with_suffix(".json"), base.with_suffix(".lock")
+
+
+def get_mirror_root(env: dict = None) -> Path:
+    """
+    返回存放镜像的内存目录（CLAUDE_VENV_CONFIG_MIRROR_DIR 可覆盖）
+    Linux 默认 /dev/shm；macOS 可先创建内存盘再指向它
+    """
+    env = os.environ if env is None else env
+    override = env.get("CLAUDE_VENV_CONFIG_MIRROR_DIR")
+    if override:
+        return Path(override).expanduser()
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(str(shm), os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+def get_mirror_dir(root: Path, config_dir: Path) -> Path:
+    """返回某个用户目录的镜像路径，按用户区分"""
+    user = os.environ.get("USER") or os.environ.get("USERNAME") or "user"
+    return root / f"claude-config-{user}-{get_mirror_id(config_dir)}"
+
+
+def is_pid_alive(pid: int) -> bool:
+    """判断本机进程是否存在"""
+    if pid <= 0:
+        return False
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # 已退出但尚未被回收的僵尸进程
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+
+# ==================== 文件扫描与复制 ====================
+
+def scan_tree(root: Path) -> dict:
+    """
+    只读取元数据扫描目录树
+    返回: {相对路径: (类型 f/d/l, 大小, 修改时间 ns)}
+    """
+    entries = {}
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            iterator = os.scandir(str(root / rel_dir) if rel_dir else str(root))
+        except OSError:
+            continue
+        with iterator:
+            for entry in iterator:
+                if entry.name.endswith(TEMP_SUFFIX):
+                    continue
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_symlink():
+                        entries[rel] = ("l", 0, entry.stat(follow_symlinks=False).st_mtime_ns)
+                    elif entry.is_dir():
+                        entries[rel] = ("d", 0, 0)
+                        stack.append(rel)
+                    else:
+                        st = entry.stat()
+                        entries[rel] = ("f", st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+    return entries
+
+
+def same_entry(a: tuple, b: tuple) -> bool:
+    """比较两个扫描结果，修改时间允许文件系统精度误差"""
+    if a is None or b is None or a[0] != b[0]:
+        return False
+    if a[0] != "f":
+        return True
+    return a[1] == b[1] and abs(a[2] - b[2]) < MTIME_TOLERANCE_NS
+
+
+def remove_path(path: Path) -> None:
+    """删除文件、链接或目录（不存在时忽略）"""
+    try:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(str(path))
+        else:
+            path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def copy_entry(src_root: Path, dst_root: Path, rel: str, entry: tuple, previous: tuple = None,
+               durable: bool = False) -> int:
+    """
+    把一个条目从 src_root 复制到 dst_root
+    previous 为上次回写时的状态：只追加的文件变大时只复制新增部分
+    durable 为 True 时写入后 fsync（回写便携盘时使用）
+    返回: 写入的字节数
+    """
+    src = src_root / rel
+    dst = dst_root / rel
+    kind = entry[0]
+
+    if kind == "d":
+        if dst.exists() and not dst.is_dir():
+            remove_path(dst)
+        dst.mkdir(parents=True, exist_ok=True)
+        return 0
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.is_dir() and not dst.is_symlink():
+        remove_path(dst)
+
+    if kind == "l":
+        target = os.readlink(str(src))
+        remove_path(dst)
+        os.symlink(target, str(dst))
+        return 0
+
+    # 追加写入：目标文件仍是上次回写的大小时，只写入新增部分
+    if (previous is not None and previous[0] == "f" and rel.endswith(APPEND_SUFFIXES)
+            and entry[1] > previous[1]):
+        try:
+            if dst.stat().st_size == previous[1]:
+                with open(src, "rb") as fin, open(dst, "ab") as fout:
+                    fin.seek(previous[1])
+                    data = fin.read(entry[1] - previous[1])
+                    fout.write(data)
+                    if durable:
+                        fout.flush()
+                        os.fsync(fout.fileno())
+                os.utime(str(dst), ns=(entry[2], entry[2]))
+                return len(data)
+        except OSError:
+            pass
+
+    # 完整复制：先写临时文件再原子替换，中断时目标文件保持旧内容
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}{TEMP_SUFFIX}")
+    try:
+        shutil.copy2(str(src), str(tmp))
+        if durable:
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+        os.replace(str(tmp), str(dst))
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return entry[1]
+
+
+def sync_trees(src_root: Path, dst_root: Path, src_entries: dict, dst_entries: dict,
+               delete: bool, durable: bool = False) -> dict:
+    """
+    让 dst_root 与 src_root 一致，只复制类型、大小或修改时间不同的条目
+    delete 为 True 时删除 dst_root 中多余的条目
+    返回: {"files", "bytes", "removed"}
+    """
+    stats = {"files": 0, "bytes": 0, "removed": 0}
+    for rel in sorted(src_entries):
+        entry = src_entries[rel]
+        if same_entry(entry, dst_entries.get(rel)):
+            continue
+        try:
+            stats["bytes"] += copy_entry(src_root, dst_root, rel, entry, durable=durable)
+            if entry[0] != "d":
+                stats["files"] += 1
+        except FileNotFoundError:
+            # 扫描后被删除的文件
+            continue
+    if delete:
+        for rel in sorted(set(dst_entries) - set(src_entries), key=lambda r: r.count("/"), reverse=True):
+            remove_path(dst_root / rel)
+            stats["removed"] += 1
+    return stats
+
+
+# ==================== 日志与锁 ====================
+
+def read_journal(journal_file: Path) -> dict:
+    """读取镜像日志，不存在或损坏时返回 None"""
+    try:
+        with open(journal_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_journal(journal_file: Path, journal: dict) -> None:
+    """原子写入镜像日志并落盘，确保异常退出后能找到镜像"""
+    journal_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = journal_file.with_name(f"{journal_file.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(journal, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(str(tmp), str(journal_file))
+
+
+class MirrorLock:
+    """
+    基于 O_EXCL 的回写锁，同一用户目录的多个会话轮流回写
+    超过 LOCK_STALE_SECONDS 的锁视为残留并清除
+    """
+
+    def __init__(self, lock_file: Path):
+        self.lock_file = lock_file
+
+    def acquire(self, timeout: float) -> bool:
+        self.lock_file.parent.mkdir(parents=True, exist_ok=True)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(str(self.lock_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, "w") as f:
+                    f.write(str(os.getpid()))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - self.lock_file.stat().st_mtime > LOCK_STALE_SECONDS:
+                        self.lock_file.unlink()
+                        continue
+                except OSError:
+                    continue
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def release(self) -> None:
+        try:
+            self.lock_file.unlink()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        if not self.acquire(30):
+            raise TimeoutError(f"等待回写锁超时: {self.lock_file}")
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def live_sessions(journal: dict) -> list:
+    """返回日志中仍在运行的本机会话进程"""
+    if journal.get("host") != socket.gethostname():
+        return list(journal.get("sessions", []))
+    return [pid for pid in journal.get("sessions", []) if is_pid_alive(pid)]
+
+
+def recover_mirror(journal: dict, verbose: bool = True) -> dict:
+    """
+    把异常退出遗留的镜像回写到便携盘（只覆盖有差异的文件，不删除任何文件）
+    返回: 回写统计；镜像已不存在时返回 None
+    """
+    mirror_dir = Path(journal["mirror"])
+    config_dir = Path(journal["config_dir"])
+    if not mirror_dir.is_dir():
+        return None
+    stats = sync_trees(mirror_dir, config_dir, scan_tree(mirror_dir), scan_tree(config_dir),
+                       delete=False, durable=True)
+    if verbose:
+        print(f"♻️  已回写异常退出遗留的镜像: {stats['files']} 个文件，{stats['bytes'] / 1024 / 1024:.1f} MB")
+    return stats
+
+
+# ==================== 会话镜像 ====================
+
+class ConfigMirror:
+    """
+    一个会话使用的用户目录镜像
+
+    open() 准备镜像并登记会话，Claude 退出后调用 close() 完成最终回写。
+    同一用户目录的多个会话共用一个镜像，最后一个退出的会话把日志标记为已完整回写。
+    """
+
+    def __init__(self, script_dir: Path, config_dir: Path, env: dict = None):
+        env = os.environ if env is None else env
+        self.config_dir = config_dir.resolve()
+        self.mirror_dir = get_mirror_dir(get_mirror_root(env), self.config_dir)
+        self.journal_file, lock_file = get_journal_paths(script_dir, self.config_dir)
+        self.lock = MirrorLock(lock_file)
+        try:
+            self.interval = max(1.0, float(env.get("CLAUDE_VENV_CONFIG_MIRROR_INTERVAL", DEFAULT_SYNC_INTERVAL)))
+        except ValueError:
+            self.interval = DEFAULT_SYNC_INTERVAL
+        self.synced = {}
+        self.stats = {"syncs": 0, "files": 0, "bytes": 0, "removed": 0}
+        self._stop = threading.Event()
+        self._thread = None
+        self._sync_lock = threading.Lock()
+
+    def new_journal(self) -> dict:
+        return {
+            "config_dir": str(self.config_dir),
+            "mirror": str(self.mirror_dir),
+            "host": socket.gethostname(),
+            "sessions": [],
+            "clean": True,
+            "pending": [],
+            "last_sync": None,
+        }
+
+    def check_space(self, config_entries: dict, mirror_entries: dict) -> None:
+        needed = sum(e[1] for e in config_entries.values() if e[0] == "f")
+        present = sum(e[1] for e in mirror_entries.values() if e[0] == "f")
+        self.mirror_dir.parent.mkdir(parents=True, exist_ok=True)
+        free = shutil.disk_usage(str(self.mirror_dir.parent)).free
+        if needed - present + FREE_SPACE_MARGIN > free:
+            raise OSError(f"内存目录空间不足: 需要 {needed / 1024 / 1024:.0f} MB，"
+                          f"可用 {free / 1024 / 1024:.0f} MB（{self.mirror_dir.parent}）")
+
+    def open(self) -> dict:
+        """
+        准备镜像并登记当前会话
+        返回: {"copied", "bytes", "recovered"}；无法使用镜像时抛出异常，由调用方回退到直接读写便携盘
+        """
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        info = {"copied": 0, "bytes": 0, "recovered": None}
+        with self.lock:
+            journal = read_journal(self.journal_file) or self.new_journal()
+            sessions = live_sessions(journal)
+
+            if journal.get("host") != socket.gethostname():
+                if sessions or not journal.get("clean", True):
+                    raise RuntimeError(
+                        f"用户目录的镜像属于另一台电脑（{journal.get('host')}），"
+                        f"请在那台电脑上运行 python3 config_mirror.py recover，"
+                        f"或确认无需回写后运行 python3 config_mirror.py recover --discard")
+                journal = self.new_journal()
+
+            if not sessions:
+                # 上次会话没有完整回写：先把镜像中的内容补回便携盘
+                if not journal.get("clean", True):
+                    info["recovered"] = recover_mirror(journal)
+                    if info["recovered"] is None:
+                        print(f"⚠️  上次会话的镜像已丢失（可能已重启），"
+                              f"{journal.get('last_sync') or '启动'} 之后的修改未能回写", file=sys.stderr)
+                # 镜像空闲：按便携盘的当前内容增量更新镜像
+                config_entries = scan_tree(self.config_dir)
+                mirror_entries = scan_tree(self.mirror_dir)
+                self.check_space(config_entries, mirror_entries)
+                self.mirror_dir.mkdir(parents=True, exist_ok=True)
+                os.chmod(str(self.mirror_dir), 0o700)
+                result = sync_trees(self.config_dir, self.mirror_dir, config_entries, mirror_entries, delete=True)
+                info["copied"], info["bytes"] = result["files"], result["bytes"]
+            elif not self.mirror_dir.is_dir():
+                raise RuntimeError(f"镜像目录不存在: {self.mirror_dir}")
+
+            # 回写基准：与便携盘一致的条目视为已回写，其余留给下一次回写
+            # （加入已有会话时，其他会话可能还没来得及回写，不能直接以镜像为准）
+            self.synced = {}
+            config_entries = scan_tree(self.config_dir) if sessions else None
+            for rel, entry in scan_tree(self.mirror_dir).items():
+                if config_entries is None or same_entry(entry, config_entries.get(rel)):
+                    self.synced[rel] = entry
+                elif rel in config_entries:
+                    self.synced[rel] = config_entries[rel]
+            journal.update(mirror=str(self.mirror_dir), clean=False, pending=[])
+            journal["sessions"] = sessions + [os.getpid()]
+            write_journal(self.journal_file, journal)
+
+        self._thread = threading.Thread(target=self._run, name="config-mirror", daemon=True)
+        self._thread.start()
+        return info
+
+    def _run(self) -> None:
+        warned = False
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync(timeout=1)
+            except Exception as e:
+                if not warned:
+                    print(f"\nWarning: config mirror write-back failed: {e}", file=sys.stderr)
+                    warned = True
+
+    def sync(self, timeout: float = 30) -> bool:
+        """
+        把镜像中自上次回写以来的变化写回便携盘
+        返回: 是否完成（其他会话正在回写时跳过本轮）
+        """
+        with self._sync_lock:
+            current = scan_tree(self.mirror_dir)
+            changed = [rel for rel, entry in current.items() if self.synced.get(rel) != entry]
+            removed = [rel for rel in self.synced if rel not in current]
+            if not changed and not removed:
+                return True
+            if not self.lock.acquire(timeout):
+                return False
+            try:
+                journal = read_journal(self.journal_file) or self.new_journal()
+                journal["pending"] = sorted(changed + removed)
+                write_journal(self.journal_file, journal)
+
+                synced = dict(self.synced)
+                for rel in sorted(changed):
+                    try:
+                        self.stats["bytes"] += copy_entry(self.mirror_dir, self.config_dir, rel, current[rel],
+                                                          previous=self.synced.get(rel), durable=True)
+                    except FileNotFoundError:
+                        continue
+                    synced[rel] = current[rel]
+                    if current[rel][0] != "d":
+                        self.stats["files"] += 1
+                for rel in sorted(removed, key=lambda r: r.count("/"), reverse=True):
+                    target = self.config_dir / rel
+                    if self.synced[rel][0] == "d":
+                        try:
+                            target.rmdir()
+                        except OSError:
+                            pass
+                    else:
+                        remove_path(target)
+                    synced.pop(rel, None)
+                    self.stats["removed"] += 1
+                self.synced = synced
+                self.stats["syncs"] += 1
+
+                journal["pending"] = []
+                journal["last_sync"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                write_journal(self.journal_file, journal)
+            finally:
+                self.lock.release()
+            return True
+
+    def close(self) -> dict:
+        """
+        停止后台回写并完整回写一次；最后一个会话把日志标记为已完整回写
+        返回: 本次会话的回写统计
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            done = self.sync()
+        except OSError as e:
+            print(f"Warning: config mirror write-back failed: {e}", file=sys.stderr)
+            done = False
+        with self.lock:
+            journal = read_journal(self.journal_file) or self.new_journal()
+            sessions = [pid for pid in live_sessions(journal) if pid != os.getpid()]
+            journal["sessions"] = sessions
+            # 回写未完成时保持未完成标记，下次启动时从镜像补回
+            if not sessions and done:
+                journal["clean"] = True
+            write_journal(self.journal_file, journal)
+        self.stats["complete"] = done
+        return self.stats
+
+
+# ==================== 命令行 ====================
+
+def iter_journals(script_dir: Path):
+    """遍历状态目录中的镜像日志，返回 (日志文件, 内容)"""
+    for journal_file in sorted(get_state_dir(script_dir).glob("config-mirror-*.json")):
+        journal = read_journal(journal_file)
+        if journal:
+            yield journal_file, journal
+
+
+def show_status(script_dir: Path) -> int:
+    found = False
+    for journal_file, journal in iter_journals(script_dir):
+        found = True
+        sessions = live_sessions(journal)
+        mirror_dir = Path(journal["mirror"])
+        local = journal.get("host") == socket.gethostname()
+        if sessions:
+            state = f"使用中（{len(sessions)} 个会话）"
+        elif journal.get("clean", True):
+            state = "已完整回写"
+        else:
+            state = "异常退出，待回写"
+        print(f"🗂️  用户目录: {journal['config_dir']}")
+        print(f"   镜像: {mirror_dir}{'' if not local or mirror_dir.is_dir() else '（已不存在）'}")
+        print(f"   主机: {journal.get('host')}{'（本机）' if local else ''}")
+        print(f"   状态: {state}")
+        print(f"   最近回写: {journal.get('last_sync') or '无'}")
+        if journal.get("pending"):
+            print(f"   回写中断时的文件: {len(journal['pending'])} 个")
+        print()
+    if not found:
+        print("暂无镜像记录（在 .env 中设置 CLAUDE_VENV_CONFIG_MIRROR=1 开启）")
+    return 0
+
+
+def recover_all(script_dir: Path, discard: bool) -> int:
+    exit_code = 0
+    for journal_file, journal in iter_journals(script_dir):
+        if live_sessions(journal):
+            print(f"⏭️  {journal['config_dir']} 的镜像正在使用中")
+            continue
+        if journal.get("clean", True):
+            continue
+        local = journal.get("host") == socket.gethostname()
+        stats = recover_mirror(journal) if local else None
+        if stats is None and not discard:
+            where = "已不存在" if local else f"位于另一台电脑（{journal.get('host')}）"
+            print(f"❌ {journal['config_dir']} 的镜像{where}，确认无需回写后使用 --discard 清除记录")
+            exit_code = 1
+            continue
+        if stats is None:
+            journal_file.unlink()
+            print(f"🗑️  已清除 {journal['config_dir']} 的镜像记录")
+        else:
+            journal.update(clean=True, sessions=[], pending=[])
+            write_journal(journal_file, journal)
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Claude Code 用户目录内存镜像",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python3 config_mirror.py status
+  python3 config_mirror.py recover
+  python3 config_mirror.py recover --discard
+        """
+    )
+    parser.add_argument("command", choices=["status", "recover"], help="status 查看状态 / recover 回写遗留镜像")
+    parser.add_argument("--discard", action="store_true", help="recover 时清除无法回写的镜像记录")
+    args = parser.parse_args()
+
+    script_dir = Path(__file__).parent.absolute()
+    if args.command == "status":
+        return show_status(script_dir)
+    return recover_all(script_dir, args.discard)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
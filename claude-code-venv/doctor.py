@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Claude Code 环境诊断
+
+"Claude 在我的电脑上很慢" 时运行 ./run.sh --doctor（Windows: run.bat --doctor），按 run.py 的启动流程
+（get_platform_info、get_claude_executable、prepare_portable_npm_env）准备环境后测量：
+- 便携目录和 Claude 用户目录所在存储的类型，以及小文件写入 / 读取延迟
+- Node 启动耗时和 claude --version 耗时
+- npm 仓库的往返延迟
+- npm 缓存、编译缓存、字节码缓存、会话记录等目录的大小
+
+最后按影响大小输出优化建议，并把完整结果写入 .venv-state/doctor/<时间>-<主机名>.json，
+多台电脑的报告可以直接收集起来对比。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import subprocess
+import urllib.request
+from pathlib import Path
+
+# 报告格式版本
+REPORT_FORMAT = 1
+# 各项测量的重复次数（取中位数）
+NODE_RUNS = 5
+CLAUDE_RUNS = 3
+REGISTRY_RUNS = 3
+# 读取延迟最多抽样的文件数
+READ_SAMPLE_FILES = 200
+DEFAULT_REGISTRY = "https://registry.npmjs.org"
+
+# 建议阈值
+SLOW_NODE_MS = 300
+SLOW_CLAUDE_MS = 2000
+SLOW_REGISTRY_MS = 500
+SLOW_READ_MS = 1.0
+LARGE_NPM_CACHE_MB = 2048
+LARGE_PYCACHE_MB = 512
+LARGE_PROJECTS_MB = 1024
+
+
+def time_command(cmd: list, env: dict, runs: int, timeout: float = 60) -> dict:
+    """
+    重复运行命令并计时
+    返回: {"ms": 中位数, "runs": [...]}，失败时 {"error": ...}
+    """
+    from update import median
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(cmd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True, timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return {"error": str(e)}
+        if result.returncode != 0:
+            return {"error": (result.stderr or result.stdout).strip()[-500:] or f"退出码 {result.returncode}"}
+        timings.append(round((time.perf_counter() - start) * 1000, 1))
+    return {"ms": median(timings), "runs": timings, "output": result.stdout.strip()[:200]}
+
+
+def measure_read_latency(directory: Path, limit: int = READ_SAMPLE_FILES) -> float:
+    """
+    读取目录中已有的小文件（最多 limit 个），返回每个文件 stat + 读取耗时的中位数（毫秒）
+    没有文件时返回 None
+    """
+    timings = []
+    stack = [str(directory)]
+    while stack and len(timings) < limit:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if len(timings) >= limit:
+                        break
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        start = time.perf_counter()
+                        try:
+                            os.stat(entry.path)
+                            with open(entry.path, "rb") as f:
+                                f.read(65536)
+                        except OSError:
+                            continue
+                        timings.append((time.perf_counter() - start) * 1000)
+        except OSError:
+            continue
+    if not timings:
+        return None
+    timings.sort()
+    return round(timings[len(timings) // 2], 3)
+
+
+def measure_storage(path: Path) -> dict:
+    """存储类型 + 小文件写入（含 fsync）和读取延迟"""
+    from cache_location import classify_storage, measure_small_file_latency
+    result = dict(classify_storage(path), path=str(path))
+    try:
+        result["write_ms"] = round(measure_small_file_latency(path), 3)
+    except OSError as e:
+        result["write_ms"] = None
+        result["write_error"] = str(e)
+    result["read_ms"] = measure_read_latency(path)
+    return result
+
+
+def get_registry_url(npm_userconfig: Path, env: dict) -> str:
+    """便携 .npmrc 中的 registry，其次是 NPM_CONFIG_REGISTRY，默认 npm 官方仓库"""
+    registry = env.get("NPM_CONFIG_REGISTRY") or DEFAULT_REGISTRY
+    try:
+        for line in npm_userconfig.read_text(encoding="utf-8").splitlines():
+            key, sep, value = line.strip().partition("=")
+            if sep and key.strip() == "registry":
+                registry = value.strip()
+    except OSError:
+        pass
+    return registry.rstrip("/")
+
+
+def measure_registry(registry: str, runs: int = REGISTRY_RUNS) -> dict:
+    """请求仓库的 /-/ping，返回往返延迟中位数（每次都是新连接，包含 DNS 和 TLS 握手）"""
+    from update import median
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f"{registry}/-/ping", timeout=10) as response:
+                response.read()
+        except Exception as e:
+            return {"url": registry, "error": str(e)}
+        timings.append(round((time.perf_counter() - start) * 1000, 1))
+    return {"url": registry, "ms": median(timings), "runs": timings}
+
+
+def measure_caches(script_dir: Path, venv_name: str, config_dir: Path) -> dict:
+    from run import get_portable_npm_paths, get_compile_cache_root, get_pycache_root, get_dir_usage
+    caches = {
+        "npm": get_portable_npm_paths(script_dir)[1],
+        "compile": get_compile_cache_root(script_dir, venv_name),
+        "pycache": get_pycache_root(script_dir),
+        "registry": script_dir / ".registry-cache",
+        "projects": config_dir / "projects",
+    }
+    result = {}
+    for name, path in caches.items():
+        files, total = get_dir_usage(path) if path.is_dir() else (0, 0)
+        result[name] = {"path": str(path), "files": files, "mb": round(total / 1024 / 1024, 1)}
+    return result
+
+
+# ==================== 建议 ====================
+
+def build_recommendations(report: dict) -> list:
+    """
+    根据测量结果生成建议，按影响从大到小排序
+    每条建议: {"score": 影响分, "problem": 现象, "action": 建议操作}
+    """
+    from cache_location import SLOW_LATENCY_MS
+    items = []
+
+    def add(score, problem, action):
+        items.append({"score": score, "problem": problem, "action": action})
+
+    launch = report["launch"]
+    if not launch["venv_exists"]:
+        add(100, "虚拟环境不存在", "运行 python3 build_venv.py 创建虚拟环境")
+    elif not launch["claude_exists"]:
+        add(100, "Claude Code 未安装在虚拟环境中", "运行 python3 update.py 安装 Claude Code")
+
+    portable = report["storage"]["portable"]
+    portable_slow = portable["kind"] in ("network", "removable") or (portable.get("write_ms") or 0) > SLOW_LATENCY_MS
+    if portable_slow and report["caches"]["npm"]["path"].startswith(portable["path"]):
+        add(80, f"便携目录在慢速存储上（{portable['kind']}，写入 {portable.get('write_ms')} ms/文件），npm 和编译缓存仍在便携目录",
+            "在 .env 中设置 CLAUDE_VENV_CACHE_TIER=local，或运行 python3 cache_location.py --reset 重新识别")
+    if portable_slow and not launch["toggles"].get("CLAUDE_VENV_IMAGE"):
+        add(60, "Claude Code 的几千个小文件从慢速存储加载",
+            "运行 python3 runtime_image.py pack 并在 .env 中设置 CLAUDE_VENV_IMAGE=1")
+
+    config = report["storage"]["config"]
+    config_slow = config["kind"] in ("network", "removable") \
+        or (config.get("write_ms") or 0) > SLOW_LATENCY_MS or (config.get("read_ms") or 0) > SLOW_READ_MS
+    if config_slow and not launch["toggles"].get("CLAUDE_VENV_CONFIG_MIRROR"):
+        add(70, f"Claude 用户目录在慢速存储上（{config['kind']}，写入 {config.get('write_ms')} ms/文件，"
+                f"读取 {config.get('read_ms')} ms/文件）",
+            "在 .env 中设置 CLAUDE_VENV_CONFIG_MIRROR=1，会话期间在本机内存盘中读写")
+
+    startup = report["startup"]
+    claude_ms = startup["claude"].get("ms")
+    if claude_ms and claude_ms > SLOW_CLAUDE_MS:
+        if launch["toggles"].get("CLAUDE_VENV_COMPILE_CACHE") is False:
+            add(65, f"claude --version 耗时 {claude_ms:.0f} ms，V8 编译缓存已关闭",
+                "删除 .env 中的 CLAUDE_VENV_COMPILE_CACHE=0")
+        if not launch["toggles"].get("CLAUDE_VENV_READAHEAD"):
+            add(55, f"claude --version 耗时 {claude_ms:.0f} ms",
+                "在 .env 中设置 CLAUDE_VENV_READAHEAD=1，在后台预热启动要读取的文件")
+    node_ms = startup["node"].get("ms")
+    if node_ms and node_ms > SLOW_NODE_MS:
+        add(50, f"Node 空启动耗时 {node_ms:.0f} ms（通常低于 100 ms）",
+            "检查杀毒软件是否扫描虚拟环境目录，或把便携目录放到本机磁盘")
+    if not launch["snapshot_valid"] and launch["claude_exists"]:
+        add(20, "启动环境快照未生成或已失效，下次启动需要完整解析",
+            "正常启动一次 ./run.sh；确认 .env 中没有 CLAUDE_VENV_SNAPSHOT=0")
+
+    registry = report["registry"]
+    if registry.get("error"):
+        add(45, f"无法连接 npm 仓库 {registry['url']}：{registry['error']}",
+            "检查网络和代理设置，或用 python3 update.py --registry <地址> 使用局域网缓存仓库")
+    elif registry["ms"] > SLOW_REGISTRY_MS:
+        add(40, f"npm 仓库往返延迟 {registry['ms']:.0f} ms，升级和预取都较慢",
+            "用 python3 update.py --serve-cache 搭建局域网缓存仓库，再用 --registry 指向它")
+
+    caches = report["caches"]
+    if caches["npm"]["mb"] > LARGE_NPM_CACHE_MB:
+        add(30, f"npm 缓存 {caches['npm']['mb']:.0f} MB", f"运行 npm cache clean --force --cache {caches['npm']['path']}")
+    if caches["pycache"]["mb"] > LARGE_PYCACHE_MB:
+        add(25, f"集中字节码缓存 {caches['pycache']['mb']:.0f} MB",
+            "运行 python3 ../2_Scripts/Clear_Python_Cache.py --central")
+    if caches["projects"]["mb"] > LARGE_PROJECTS_MB:
+        add(25, f"会话记录（projects/）{caches['projects']['mb']:.0f} MB，启动和 /resume 时需要扫描",
+            "运行 python3 ../2_Scripts/Clear_Claude_Cache.py 清理旧会话")
+
+    items.sort(key=lambda item: -item["score"])
+    return items
+
+
+# ==================== 入口 ====================
+
+def run_doctor(script_dir: Path) -> int:
+    """run.py --doctor 的入口"""
+    from run import (get_platform_info, get_claude_executable, prepare_portable_npm_env, prepend_venv_to_path,
+                     get_portable_npm_paths, load_env_file, resolve_config_dir, load_launch_snapshot,
+                     is_env_enabled, is_env_disabled, get_state_dir, LAUNCH_TOGGLES)
+
+    venv_name, bin_subdir, _, is_windows = get_platform_info()
+    venv_path = script_dir / venv_name
+    venv_bin_dir = venv_path / bin_subdir
+    claude_bin = get_claude_executable(venv_path, venv_bin_dir, is_windows)
+
+    # 与 run.py 相同的环境：虚拟环境 PATH、便携 npm 配置、.env
+    env = os.environ.copy()
+    env.pop("NODE_OPTIONS", None)
+    prepend_venv_to_path(env, venv_path, venv_bin_dir, is_windows)
+    if venv_path.exists():
+        prepare_portable_npm_env(env, script_dir, venv_path)
+    env.update(load_env_file(script_dir / ".env"))
+    config_dir = resolve_config_dir(env.get("CLAUDE_CONFIG_DIR"), script_dir)
+    config_dir.mkdir(parents=True, exist_ok=True)
+    env["CLAUDE_CONFIG_DIR"] = str(config_dir)
+
+    print("=" * 60)
+    print("🩺 Claude Code 环境诊断")
+    print("=" * 60)
+    toggles = {key: True if is_env_enabled(env, key) else False if is_env_disabled(env, key) else None
+               for key in LAUNCH_TOGGLES}
+    report = {
+        "format": REPORT_FORMAT,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": socket.gethostname(),
+        "platform": f"{platform.system()} {platform.release()} {platform.machine()}",
+        "python": platform.python_version(),
+        "root": str(script_dir),
+        "config_dir": str(config_dir),
+        "launch": {
+            "venv": venv_name,
+            "venv_exists": venv_path.exists(),
+            "claude_exists": claude_bin.exists(),
+            "snapshot_valid": load_launch_snapshot(script_dir, venv_name) is not None,
+            "toggles": toggles,
+        },
+    }
+
+    print("💾 测量存储延迟...")
+    report["storage"] = {
+        "portable": measure_storage(script_dir),
+        "config": measure_storage(config_dir),
+    }
+    for name, label in (("portable", "便携目录"), ("config", "用户目录")):
+        storage = report["storage"][name]
+        print(f"   {label}: {storage['kind']}（{storage['fstype'] or '未知'}）"
+              f"  写入 {storage['write_ms']} ms/文件  读取 {storage['read_ms']} ms/文件")
+
+    print("⏱️  测量启动耗时...")
+    node = shutil.which("node", path=env["PATH"])
+    report["startup"] = {
+        "node": time_command([node, "-e", "0"], env, NODE_RUNS) if node else {"error": "未找到 node"},
+        "claude": time_command([str(claude_bin), "--version"], env, CLAUDE_RUNS)
+        if claude_bin.exists() else {"error": "Claude Code 未安装"},
+    }
+    for name, label in (("node", "Node 空启动"), ("claude", "claude --version")):
+        result = report["startup"][name]
+        print(f"   {label}: {result['ms']:.0f} ms" if "ms" in result else f"   {label}: ❌ {result['error']}")
+
+    print("🌐 测量 npm 仓库延迟...")
+    report["registry"] = measure_registry(get_registry_url(get_portable_npm_paths(script_dir)[0], env))
+    registry = report["registry"]
+    print(f"   {registry['url']}: {registry['ms']:.0f} ms" if "ms" in registry
+          else f"   {registry['url']}: ❌ {registry['error']}")
+
+    print("📦 统计缓存大小...")
+    report["caches"] = measure_caches(script_dir, venv_name, config_dir)
+    for name, cache in report["caches"].items():
+        print(f"   {name}: {cache['mb']} MB（{cache['files']} 个文件）  {cache['path']}")
+
+    report["recommendations"] = build_recommendations(report)
+    print()
+    print("=" * 60)
+    if report["recommendations"]:
+        print("💡 优化建议（按影响排序）")
+        print("=" * 60)
+        for index, item in enumerate(report["recommendations"], 1):
+            print(f"{index}. {item['problem']}")
+            print(f"   → {item['action']}")
+    else:
+        print("✅ 未发现明显问题")
+        print("=" * 60)
+
+    report_dir = get_state_dir(script_dir) / "doctor"
+    report_dir.mkdir(parents=True, exist_ok=True)
+    report_file = report_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{report['host']}.json"
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print()
+    print(f"📄 报告: {report_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_doctor(Path(__file__).parent.absolute()))
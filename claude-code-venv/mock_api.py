@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+本地 Anthropic Messages API 模拟服务
+
+用于离线测试 Claude Code 的无头模式（claude -p）：
+- update.py 升级后的启动性能基准
+- run.py batch 批量任务的本地验证
+
+使用方法：
+    python3 mock_api.py                  # 监听 127.0.0.1 随机端口
+    python3 mock_api.py --port 8787      # 指定端口
+    python3 mock_api.py --delay-ms 200   # 模拟模型响应延迟
+
+然后在 .env 或命令行中设置：
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8787
+    ANTHROPIC_AUTH_TOKEN=mock
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockAnthropicHandler(BaseHTTPRequestHandler):
+    """模拟 /v1/messages 接口，支持流式（SSE）和非流式响应"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 默认不输出访问日志，避免干扰基准测试和批量任务的输出
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def read_json_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def send_json(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_sse(self, events: list) -> None:
+        body = "".join(
+            f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.count("GET")
+        self.send_json({})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        request = self.read_json_body()
+        self.server.count(path)
+
+        if path.endswith("/count_tokens"):
+            self.send_json({"input_tokens": 10})
+            return
+
+        if not path.endswith("/v1/messages"):
+            self.send_json({})
+            return
+
+        if self.server.delay_ms:
+            time.sleep(self.server.delay_ms / 1000.0)
+
+        model = request.get("model", "claude-mock")
+        text = self.server.reply_text
+        message = {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": 10, "output_tokens": 1},
+        }
+
+        if not request.get("stream"):
+            message.update({
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+            })
+            self.send_json(message)
+            return
+
+        self.send_sse([
+            {"type": "message_start", "message": message},
+            {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+            {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}},
+            {"type": "content_block_stop", "index": 0},
+            {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+             "usage": {"output_tokens": 1}},
+            {"type": "message_stop"},
+        ])
+
+
+class MockAnthropicServer(ThreadingHTTPServer):
+    """在后台线程中运行的模拟服务"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, reply_text: str = "ok",
+                 delay_ms: int = 0, verbose: bool = False):
+        super().__init__((host, port), MockAnthropicHandler)
+        self.reply_text = reply_text
+        self.delay_ms = delay_ms
+        self.verbose = verbose
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str) -> None:
+        with self._counts_lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def start(self) -> str:
+        """启动后台线程，返回 base URL"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def client_env(self) -> dict:
+        """让 Claude Code 指向本服务所需的环境变量"""
+        return {
+            "ANTHROPIC_BASE_URL": self.base_url,
+            "ANTHROPIC_AUTH_TOKEN": "mock",
+            "ANTHROPIC_API_KEY": "mock",
+            "CLAUDE_CODE_DISABLE_NONESSENTIAL_TRAFFIC": "1",
+            "DISABLE_TELEMETRY": "1",
+            "DISABLE_ERROR_REPORTING": "1",
+            "DISABLE_AUTOUPDATER": "1",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Anthropic Messages API 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认：127.0.0.1）")
+    parser.add_argument("--port", type=int, default=0, help="监听端口（默认：随机）")
+    parser.add_argument("--reply", default="ok", help="模型回复的文本（默认：ok）")
+    parser.add_argument("--delay-ms", type=int, default=0, help="每次回复前的延迟（毫秒）")
+    parser.add_argument("--verbose", action="store_true", help="输出访问日志")
+    args = parser.parse_args()
+
+    server = MockAnthropicServer(args.host, args.port, args.reply, args.delay_ms, args.verbose)
+    print(f"🧪 模拟 API 已启动: {server.base_url}")
+    print("   按 Ctrl+C 停止")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 请求统计: {json.dumps(server.request_counts, ensure_ascii=False)}")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
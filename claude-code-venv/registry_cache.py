@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+局域网 npm 缓存仓库（轻量级缓存代理）
+
+让同一局域网内的多个便携目录共享一份下载缓存：
+- 包元数据（packument）和 tarball 缓存在共享目录中，命中时直接从本地返回
+- 未命中时从上游仓库拉取并写入缓存（--offline 模式只使用缓存）
+- 多线程处理并发请求，同一个包只会向上游请求一次
+- /-/cache-stats 返回命中率等统计信息
+
+通常通过 update.py 启动：
+    python3 update.py --serve-cache                  # 监听 0.0.0.0:4873
+    python3 update.py --serve-cache --offline        # 只使用已有缓存（离线测试）
+
+其他便携目录指向该服务：
+    python3 update.py --registry http://<服务器IP>:4873
+
+缓存目录结构：
+    packuments/<URL 编码的包名>.json
+    tarballs/<URL 编码的包名>/<文件名>.tgz
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import quote, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_UPSTREAM = "https://registry.npmjs.org"
+DEFAULT_PORT = 4873
+# 包元数据的新鲜期（秒），过期后重新向上游请求；上游不可用时继续使用旧数据
+DEFAULT_PACKUMENT_TTL = 300
+PACKUMENT_ACCEPT = "application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8, */*"
+
+
+class CacheMiss(Exception):
+    """缓存未命中且无法从上游获取"""
+
+
+class RegistryCache:
+    """基于本地目录的 npm 仓库缓存"""
+
+    def __init__(self, cache_dir: Path, upstream: str = DEFAULT_UPSTREAM, offline: bool = False,
+                 packument_ttl: int = DEFAULT_PACKUMENT_TTL):
+        self.cache_dir = Path(cache_dir)
+        self.upstream = upstream.rstrip("/")
+        self.offline = offline
+        self.packument_ttl = packument_ttl
+        self.metrics = {
+            "packument_hits": 0,
+            "packument_misses": 0,
+            "tarball_hits": 0,
+            "tarball_misses": 0,
+            "bytes_served": 0,
+            "bytes_fetched": 0,
+            "upstream_errors": 0,
+        }
+        self._metrics_lock = threading.Lock()
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
+
+    # ---------- 统计与锁 ----------
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._metrics_lock:
+            self.metrics[key] += amount
+
+    def snapshot_metrics(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        for kind in ("packument", "tarball"):
+            total = metrics[f"{kind}_hits"] + metrics[f"{kind}_misses"]
+            metrics[f"{kind}_hit_rate"] = round(metrics[f"{kind}_hits"] / total, 3) if total else None
+        return metrics
+
+    def key_lock(self, key: str) -> threading.Lock:
+        """同一个缓存项使用同一把锁，避免并发请求重复向上游下载"""
+        with self._key_locks_lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    # ---------- 路径 ----------
+
+    def packument_path(self, name: str) -> Path:
+        return self.cache_dir / "packuments" / (quote(name, safe="") + ".json")
+
+    def tarball_path(self, name: str, filename: str) -> Path:
+        return self.cache_dir / "tarballs" / quote(name, safe="") / filename
+
+    # ---------- 上游 ----------
+
+    def fetch_upstream(self, url_path: str, accept: str = "*/*") -> bytes:
+        if self.offline:
+            raise CacheMiss(f"离线模式，缓存中没有: {url_path}")
+        request = urllib.request.Request(f"{self.upstream}/{url_path}", headers={"Accept": accept})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                data = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            self.count("upstream_errors")
+            raise CacheMiss(f"上游请求失败: {url_path}: {e}")
+        self.count("bytes_fetched", len(data))
+        return data
+
+    @staticmethod
+    def write_atomic(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    # ---------- 缓存读取 ----------
+
+    def get_packument(self, name: str) -> bytes:
+        """返回包元数据（原始上游内容），新鲜期内直接使用缓存"""
+        path = self.packument_path(name)
+        with self.key_lock(f"packument:{name}"):
+            try:
+                stat = path.stat()
+                fresh = self.offline or time.time() - stat.st_mtime < self.packument_ttl
+            except OSError:
+                stat = None
+                fresh = False
+
+            if fresh:
+                self.count("packument_hits")
+                return path.read_bytes()
+
+            try:
+                data = self.fetch_upstream(quote(name, safe="@"), accept=PACKUMENT_ACCEPT)
+            except CacheMiss:
+                if stat is None:
+                    self.count("packument_misses")
+                    raise
+                # 上游不可用时继续使用过期的缓存
+                self.count("packument_hits")
+                return path.read_bytes()
+
+            self.count("packument_misses")
+            self.write_atomic(path, data)
+            return data
+
+    def find_integrity(self, name: str, filename: str) -> str:
+        """从已缓存的包元数据中查找 tarball 的 integrity 值"""
+        try:
+            with open(self.packument_path(name), "r", encoding="utf-8") as f:
+                packument = json.load(f)
+        except (OSError, ValueError):
+            return ""
+        for version in packument.get("versions", {}).values():
+            dist = version.get("dist", {})
+            if dist.get("tarball", "").endswith(f"/-/{filename}"):
+                return dist.get("integrity", "")
+        return ""
+
+    @staticmethod
+    def verify_integrity(data: bytes, integrity: str) -> bool:
+        """校验 SRI 格式的 integrity（如 sha512-xxx），未知算法时视为通过"""
+        for entry in integrity.split():
+            algorithm, _, expected = entry.partition("-")
+            if algorithm in ("sha512", "sha384", "sha256", "sha1"):
+                digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+                return digest == expected
+        return True
+
+    def get_tarball(self, name: str, filename: str) -> Path:
+        """返回 tarball 的缓存路径，未命中时从上游下载并校验"""
+        path = self.tarball_path(name, filename)
+        with self.key_lock(f"tarball:{name}/{filename}"):
+            if path.is_file():
+                self.count("tarball_hits")
+                return path
+
+            self.count("tarball_misses")
+            data = self.fetch_upstream(f"{quote(name, safe='@/')}/-/{quote(filename)}")
+            integrity = self.find_integrity(name, filename)
+            if integrity and not self.verify_integrity(data, integrity):
+                raise CacheMiss(f"integrity 校验失败: {name}/{filename}")
+            self.write_atomic(path, data)
+            return path
+
+
+class RegistryCacheHandler(BaseHTTPRequestHandler):
+    """处理 npm 客户端的 packument 和 tarball 请求"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_bytes(self, data: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+            self.server.cache.count("bytes_served", len(data))
+
+    def send_error_json(self, status: int, message: str) -> None:
+        self.send_bytes(json.dumps({"error": message}, ensure_ascii=False).encode("utf-8"), "application/json", status)
+
+    def rewrite_tarball_urls(self, data: bytes) -> bytes:
+        """
+        把元数据中的 tarball 地址改为指向本服务（按客户端访问的 Host 生成）
+        解析 JSON 后逐个改写 versions[*].dist.tarball，不依赖上游 JSON 的排版
+        """
+        host = self.headers.get("Host") or "%s:%s" % self.server.server_address[:2]
+        upstream = self.server.cache.upstream + "/"
+        try:
+            packument = json.loads(data)
+        except ValueError:
+            return data
+        changed = False
+        for version in packument.get("versions", {}).values():
+            dist = version.get("dist", {})
+            tarball = dist.get("tarball", "")
+            if tarball.startswith(upstream):
+                dist["tarball"] = f"http://{host}/{tarball[len(upstream):]}"
+                changed = True
+        if not changed:
+            return data
+        return json.dumps(packument, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def parse_path(self) -> tuple:
+        """
+        解析请求路径
+        返回: ("packument", 包名, None) / ("tarball", 包名, 文件名) / (None, None, None)
+        """
+        path = unquote(self.path.split("?", 1)[0]).strip("/")
+        if not path or path.startswith("-/"):
+            return None, None, None
+        if "/-/" in path:
+            name, _, filename = path.partition("/-/")
+            if "/" in filename or not filename.endswith(".tgz"):
+                return None, None, None
+            return "tarball", name, filename
+        parts = path.split("/")
+        if (parts[0].startswith("@") and len(parts) == 2) or len(parts) == 1:
+            return "packument", path, None
+        return None, None, None
+
+    def do_GET(self):
+        cache = self.server.cache
+        if self.path.rstrip("/") == "/-/cache-stats":
+            self.send_bytes(json.dumps(cache.snapshot_metrics()).encode("utf-8"), "application/json")
+            return
+        if self.path.startswith("/-/ping"):
+            self.send_bytes(b"{}", "application/json")
+            return
+
+        kind, name, filename = self.parse_path()
+        try:
+            if kind == "packument":
+                data = self.rewrite_tarball_urls(cache.get_packument(name))
+                self.send_bytes(data, "application/json")
+            elif kind == "tarball":
+                data = cache.get_tarball(name, filename).read_bytes()
+                self.send_bytes(data, "application/octet-stream")
+            else:
+                self.send_error_json(404, "not found")
+        except CacheMiss as e:
+            self.send_error_json(404 if cache.offline else 502, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    do_HEAD = do_GET
+
+
+class RegistryCacheServer(ThreadingHTTPServer):
+    """多线程缓存仓库服务"""
+
+    daemon_threads = True
+
+    def __init__(self, cache: RegistryCache, host: str = "0.0.0.0", port: int = DEFAULT_PORT, verbose: bool = False):
+        super().__init__((host, port), RegistryCacheHandler)
+        self.cache = cache
+        self.verbose = verbose
+
+
+def serve_cache(cache_dir: Path, host: str = "0.0.0.0", port: int = DEFAULT_PORT, upstream: str = DEFAULT_UPSTREAM,
+                offline: bool = False, verbose: bool = False) -> int:
+    """
+    前台运行缓存仓库服务，Ctrl+C 停止并输出统计
+    返回: 退出码
+    """
+    cache = RegistryCache(cache_dir, upstream=upstream, offline=offline)
+    try:
+        server = RegistryCacheServer(cache, host, port, verbose)
+    except OSError as e:
+        print(f"❌ 无法监听 {host}:{port}: {e}")
+        return 1
+
+    print("=" * 70)
+    print("🗄️  局域网 npm 缓存仓库")
+    print("=" * 70)
+    print(f"📡 监听地址: http://{host}:{server.server_address[1]}")
+    print(f"📂 缓存目录: {cache.cache_dir}")
+    print(f"🌐 上游仓库: {'（离线模式）' if offline else cache.upstream}")
+    print(f"📊 统计接口: http://{host}:{server.server_address[1]}/-/cache-stats")
+    print("=" * 70)
+    print("💡 其他便携目录执行: python update.py --registry http://<本机IP>:%d" % server.server_address[1])
+    print("   按 Ctrl+C 停止")
+    print()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    metrics = cache.snapshot_metrics()
+    print()
+    print("📊 缓存统计:")
+    for key, value in metrics.items():
+        print(f"   {key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="局域网 npm 缓存仓库")
+    parser.add_argument("--cache-dir", default=str(Path(__file__).parent.absolute() / ".registry-cache"), help="缓存目录")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址（默认：0.0.0.0）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口（默认：{DEFAULT_PORT}）")
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM, help=f"上游仓库（默认：{DEFAULT_UPSTREAM}）")
+    parser.add_argument("--offline", action="store_true", help="只使用已有缓存，不访问上游")
+    parser.add_argument("--verbose", action="store_true", help="输出访问日志")
+    args = parser.parse_args()
+    sys.exit(serve_cache(Path(args.cache_dir), args.host, args.port, args.upstream, args.offline, args.verbose))
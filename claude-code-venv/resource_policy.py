@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Claude Code 启动资源策略
+
+run.py 在启动 Claude 之前按 .env 中的配置限制资源（限制作用于启动器自身，由 Claude 及其子进程继承）：
+- CLAUDE_VENV_LIMIT_NOFILE      打开文件数上限（RLIMIT_NOFILE）
+- CLAUDE_VENV_LIMIT_AS_MB       虚拟地址空间上限（RLIMIT_AS，MB）
+- CLAUDE_VENV_NICE              CPU 调度优先级（0-19，越大越低）
+- CLAUDE_VENV_IONICE            磁盘 I/O 优先级（idle / best-effort[:0-7] / realtime[:0-7]，仅 Linux）
+- CLAUDE_VENV_CPU_AFFINITY      CPU 亲和性（如 0-3,6，Linux / Windows）
+- CLAUDE_VENV_MEMORY_MAX        内存上限（如 4G），通过 systemd-run --user --scope 写入用户 cgroup v2 的 memory.max
+- CLAUDE_VENV_CPU_MAX           CPU 上限（如 200% 表示两个核），写入 cgroup v2 的 cpu.max
+- CLAUDE_VENV_NODE_HEAP_MB      Node 堆上限（--max-old-space-size），未设置时取内存上限的 75%
+
+当前系统不支持的项只打印原因并跳过，不影响启动。
+
+使用方法：
+    python3 resource_policy.py        # 查看 .env 中的资源策略在本机能否生效（不启动 Claude）
+"""
+
+import os
+import re
+import sys
+import shutil
+import platform
+import subprocess
+from pathlib import Path
+
+# 由 systemd-run 写入 cgroup 时的属性名
+SYSTEMD_PROPERTIES = {
+    "CLAUDE_VENV_MEMORY_MAX": "MemoryMax",
+    "CLAUDE_VENV_CPU_MAX": "CPUQuota",
+}
+# 按内存上限推算 Node 堆上限的比例（其余留给原生内存、子进程和页缓存）
+NODE_HEAP_RATIO = 0.75
+# ioprio_set 的系统调用号
+IOPRIO_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "riscv64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+}
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+# Windows 进程优先级类
+BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+IDLE_PRIORITY_CLASS = 0x40
+
+
+def parse_size(value: str) -> int:
+    """解析 4G / 512M / 1048576 形式的大小，返回字节数"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", value, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无法解析的大小: {value}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " KMGT".index(unit.upper() or " "))
+
+
+def parse_cpu_list(value: str) -> set:
+    """解析 0-3,6 形式的 CPU 列表"""
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    if not cpus:
+        raise ValueError(f"无法解析的 CPU 列表: {value}")
+    return cpus
+
+
+def parse_cpu_quota(value: str) -> str:
+    """解析 CPU 上限：200% 或 2（核数），返回 systemd 的 CPUQuota 值"""
+    value = value.strip()
+    if value.endswith("%"):
+        percent = float(value[:-1])
+    else:
+        percent = float(value) * 100
+    if percent <= 0:
+        raise ValueError(f"CPU 上限必须大于 0: {value}")
+    return f"{percent:g}%"
+
+
+# ==================== 各项限制 ====================
+
+def apply_rlimit(name: str, value: int) -> str:
+    """设置软限制（不超过硬限制），返回生效的描述"""
+    import resource
+    limit = getattr(resource, name)
+    soft, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY and value > hard:
+        value = hard
+    resource.setrlimit(limit, (value, hard))
+    return str(value)
+
+
+def apply_nice(value: int) -> str:
+    """设置调度优先级；Windows 映射为低于正常 / 空闲优先级类"""
+    if os.name == "nt":
+        import ctypes
+        priority = IDLE_PRIORITY_CLASS if value >= 10 else BELOW_NORMAL_PRIORITY_CLASS
+        if value <= 0 or not ctypes.windll.kernel32.SetPriorityClass(ctypes.windll.kernel32.GetCurrentProcess(), priority):
+            raise OSError("SetPriorityClass 失败")
+        return "空闲" if priority == IDLE_PRIORITY_CLASS else "低于正常"
+    os.setpriority(os.PRIO_PROCESS, 0, value)
+    return str(os.getpriority(os.PRIO_PROCESS, 0))
+
+
+def apply_ionice(value: str) -> str:
+    """通过 ioprio_set 设置磁盘 I/O 优先级（仅 Linux），没有对应系统调用号时调用 ionice 命令"""
+    if platform.system() != "Linux":
+        raise OSError("仅支持 Linux")
+    name, _, level = value.strip().lower().partition(":")
+    if name not in IOPRIO_CLASSES:
+        raise ValueError(f"未知的 I/O 优先级类: {name}（可选 idle / best-effort / realtime）")
+    ioprio_class = IOPRIO_CLASSES[name]
+    # idle 类没有级别；其余默认 4（与内核默认相同）
+    data = 0 if ioprio_class == 3 else int(level or 4)
+
+    syscall_number = IOPRIO_SYSCALLS.get(platform.machine())
+    if syscall_number is not None:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        # ioprio_set(IOPRIO_WHO_PROCESS, 0, class << 13 | data)
+        if libc.syscall(syscall_number, 1, 0, (ioprio_class << 13) | data) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    elif shutil.which("ionice"):
+        subprocess.run(["ionice", "-c", str(ioprio_class), "-n", str(data), "-p", str(os.getpid())],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        raise OSError(f"{platform.machine()} 上没有 ioprio_set，也没有 ionice 命令")
+    return name if ioprio_class == 3 else f"{name}:{data}"
+
+
+def apply_affinity(value: str) -> str:
+    """设置 CPU 亲和性（Linux sched_setaffinity / Windows SetProcessAffinityMask）"""
+    cpus = parse_cpu_list(value)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+        return ",".join(str(cpu) for cpu in sorted(os.sched_getaffinity(0)))
+    if os.name == "nt":
+        import ctypes
+        mask = sum(1 << cpu for cpu in cpus)
+        if not ctypes.windll.kernel32.SetProcessAffinityMask(ctypes.windll.kernel32.GetCurrentProcess(), mask):
+            raise OSError("SetProcessAffinityMask 失败")
+        return value
+    raise OSError("当前系统不支持设置 CPU 亲和性")
+
+
+def get_user_cgroup_controllers() -> set:
+    """返回 systemd 用户实例可以使用的 cgroup v2 控制器（未委派时为空）"""
+    path = Path(f"/sys/fs/cgroup/user.slice/user-{os.getuid()}.slice/user@{os.getuid()}.service/cgroup.controllers")
+    try:
+        return set(path.read_text().split())
+    except OSError:
+        return set()
+
+
+def build_cgroup_wrapper(properties: dict) -> list:
+    """
+    生成 systemd-run --user --scope 前缀，让 Claude 运行在带 memory.max / cpu.max 的临时 scope 中
+    没有 systemd 用户实例或控制器未委派时抛出 OSError
+    """
+    if platform.system() != "Linux":
+        raise OSError("cgroup 限制仅支持 Linux")
+    if not Path("/sys/fs/cgroup/cgroup.controllers").exists():
+        raise OSError("系统未使用 cgroup v2")
+    systemd_run = shutil.which("systemd-run")
+    if not systemd_run:
+        raise OSError("未找到 systemd-run")
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+    if not Path(runtime_dir, "systemd", "private").exists():
+        raise OSError("systemd 用户实例未运行")
+    controllers = get_user_cgroup_controllers()
+    needed = {"MemoryMax": "memory", "CPUQuota": "cpu"}
+    missing = [needed[key] for key in properties if needed[key] not in controllers]
+    if missing:
+        raise OSError(f"用户 cgroup 未委派 {'/'.join(missing)} 控制器")
+    wrapper = [systemd_run, "--user", "--scope", "--quiet", "--collect"]
+    for key, value in properties.items():
+        wrapper += ["-p", f"{key}={value}"]
+    return wrapper + ["--"]
+
+
+def add_node_heap_limit(env: dict, heap_mb: int) -> bool:
+    """把 --max-old-space-size 加入 NODE_OPTIONS（已手动设置时不覆盖）"""
+    options = env.get("NODE_OPTIONS", "")
+    if "--max-old-space-size" in options:
+        return False
+    env["NODE_OPTIONS"] = f"{options} --max-old-space-size={heap_mb}".strip()
+    return True
+
+
+# ==================== 入口 ====================
+
+def apply_resource_policy(env: dict, cmd: list, verbose: bool = True) -> list:
+    """
+    按 env 中的配置限制资源
+    返回: 启动命令（需要 cgroup 限制时带上 systemd-run 前缀）
+    """
+    report = []
+
+    def attempt(label: str, key: str, action) -> None:
+        value = env.get(key, "").strip()
+        if not value:
+            return
+        try:
+            report.append(("✅", label, action(value)))
+        except (OSError, ValueError, ImportError, AttributeError, subprocess.CalledProcessError) as e:
+            report.append(("⚠️ ", label, f"{value} 未生效: {e}"))
+
+    attempt("打开文件数上限", "CLAUDE_VENV_LIMIT_NOFILE", lambda v: apply_rlimit("RLIMIT_NOFILE", int(v)))
+    attempt("虚拟内存上限", "CLAUDE_VENV_LIMIT_AS_MB",
+            lambda v: f"{int(apply_rlimit('RLIMIT_AS', int(v) * 1024 * 1024)) // 1024 // 1024} MB")
+    attempt("CPU 优先级", "CLAUDE_VENV_NICE", lambda v: apply_nice(int(v)))
+    attempt("I/O 优先级", "CLAUDE_VENV_IONICE", apply_ionice)
+    attempt("CPU 亲和性", "CLAUDE_VENV_CPU_AFFINITY", apply_affinity)
+
+    properties = {}
+    memory_max = None
+    for key, prop in SYSTEMD_PROPERTIES.items():
+        value = env.get(key, "").strip()
+        if not value:
+            continue
+        try:
+            if key == "CLAUDE_VENV_MEMORY_MAX":
+                memory_max = parse_size(value)
+                properties[prop] = str(memory_max)
+            else:
+                properties[prop] = parse_cpu_quota(value)
+        except ValueError as e:
+            report.append(("⚠️ ", "cgroup", f"{value} 未生效: {e}"))
+    if properties:
+        try:
+            cmd = build_cgroup_wrapper(properties) + cmd
+            limits = []
+            if "MemoryMax" in properties:
+                limits.append(f"memory.max {memory_max // 1024 // 1024} MB")
+            if "CPUQuota" in properties:
+                limits.append(f"cpu.max {properties['CPUQuota']}")
+            report.append(("✅", "cgroup", "，".join(limits)))
+        except OSError as e:
+            report.append(("⚠️ ", "cgroup", f"未生效: {e}"))
+
+    # Node 堆上限：显式配置优先，否则按内存上限推算（cgroup 未生效时同样有助于避免被 OOM 结束）
+    heap = env.get("CLAUDE_VENV_NODE_HEAP_MB", "").strip()
+    try:
+        heap_mb = int(heap) if heap else (int(memory_max * NODE_HEAP_RATIO) // 1024 // 1024 if memory_max else 0)
+    except ValueError:
+        report.append(("⚠️ ", "Node 堆上限", f"{heap} 未生效: 需要整数"))
+        heap_mb = 0
+    if heap_mb > 0:
+        if add_node_heap_limit(env, heap_mb):
+            report.append(("✅", "Node 堆上限", f"{heap_mb} MB"))
+        else:
+            report.append(("⚠️ ", "Node 堆上限", "NODE_OPTIONS 中已设置 --max-old-space-size，保留原值"))
+
+    if verbose and report:
+        print("🛡️  资源策略:")
+        for mark, label, detail in report:
+            print(f"   {mark} {label}: {detail}")
+    return cmd
+
+
+def main():
+    script_dir = Path(__file__).parent.absolute()
+    sys.path.insert(0, str(script_dir))
+    from run import load_env_file, RESOURCE_POLICY_KEYS
+
+    env = dict(os.environ)
+    env.update(load_env_file(script_dir / ".env"))
+    if not any(env.get(key) for key in RESOURCE_POLICY_KEYS):
+        print("未配置资源策略（在 .env 中设置 CLAUDE_VENV_LIMIT_NOFILE、CLAUDE_VENV_MEMORY_MAX 等）")
+        return 0
+    cmd = apply_resource_policy(env, ["claude"])
+    if len(cmd) > 1:
+        print(f"启动命令: {' '.join(cmd)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,12 @@ Claude Code 虚拟环境启动脚本 (Python)
 """
 
 import os
+import re
 import sys
+import json
+import signal
+import time
+import threading
 import subprocess
 import platform
 from pathlib import Path
@@ -44,8 +49,10 @@ def prepend_venv_to_path(env: dict, venv_path: Path, venv_bin_dir: Path, is_wind
 def get_portable_npm_paths(script_dir: Path) -> tuple[Path, Path]:
     """
     返回项目内专用的 npm 配置文件和缓存目录，避免读写用户全局配置
+    （便携目录在慢速存储上时，缓存目录位于本机，见 cache_location.py）
     """
-    return script_dir / ".npmrc.portable", script_dir / ".npm-cache"
+    from cache_location import get_cache_root
+    return script_dir / ".npmrc.portable", get_cache_root(script_dir) / ".npm-cache"
 
 def prepare_portable_npm_env(env: dict, script_dir: Path, venv_path: Path) -> None:
     """
@@ -62,6 +69,1387 @@ def prepare_portable_npm_env(env: dict, script_dir: Path, venv_path: Path) -> No
     env["NPM_CONFIG_FUND"] = "false"
     env["NPM_CONFIG_AUDIT"] = "false"
 
+def get_state_dir(script_dir: Path) -> Path:
+    """
+    返回便携目录内保存工具状态的目录（与 update.py 共用）
+    """
+    return script_dir / ".venv-state"
+
+def is_env_enabled(env: dict, key: str) -> bool:
+    """
+    判断开关类环境变量是否开启
+    """
+    return env.get(key, "").strip().lower() in ("1", "true", "yes", "on")
+
+def start_update_prefetch(env: dict, script_dir: Path) -> None:
+    """
+    按需启动分离的后台进程预取新版本（.env 中设置 CLAUDE_VENV_PREFETCH=1 开启）
+    通过 prefetch.json 的修改时间限频，启动路径上只有一次 stat 开销
+    """
+    if not is_env_enabled(env, "CLAUDE_VENV_PREFETCH"):
+        return
+
+    try:
+        interval_hours = float(env.get("CLAUDE_VENV_PREFETCH_INTERVAL_HOURS", "24"))
+    except ValueError:
+        interval_hours = 24.0
+
+    state_dir = get_state_dir(script_dir)
+    stamp_file = state_dir / "prefetch.json"
+    try:
+        if time.time() - stamp_file.stat().st_mtime < interval_hours * 3600:
+            return
+    except OSError:
+        pass
+
+    update_script = script_dir / "update.py"
+    if not update_script.exists():
+        return
+
+    try:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        # 先刷新时间戳，避免短时间内多次启动重复拉起预取进程
+        stamp_file.touch()
+        log_file = open(state_dir / "prefetch.log", "a", encoding="utf-8")
+        kwargs = {}
+        if platform.system() == "Windows":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        subprocess.Popen(
+            [sys.executable, str(update_script), "--prefetch"],
+            env=env,
+            cwd=str(script_dir),
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            **kwargs
+        )
+        log_file.close()
+    except Exception as e:
+        print(f"Warning: Failed to start update prefetch: {e}", file=sys.stderr)
+
+def can_exec(env: dict, is_windows: bool) -> bool:
+    """
+    判断是否使用 exec 模式启动（.env 中设置 CLAUDE_VENV_EXEC=1 开启，仅 POSIX）
+    """
+    return is_env_enabled(env, "CLAUDE_VENV_EXEC") and not is_windows and hasattr(os, "execve")
+
+def exec_claude(cmd: list, env: dict, current_dir: Path) -> None:
+    """
+    用 Claude 替换当前 Python 进程，会话期间不再常驻 Python 解释器，
+    信号和终端作业控制直接到达 Claude
+    成功时不返回；exec 失败时返回，由调用方回退到子进程模式
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.chdir(str(current_dir))
+        os.execve(cmd[0], cmd, env)
+    except OSError as e:
+        print(f"Warning: exec failed, falling back to subprocess: {e}", file=sys.stderr)
+
+def is_env_disabled(env: dict, key: str) -> bool:
+    """
+    判断默认开启的开关类环境变量是否被关闭
+    """
+    return env.get(key, "").strip().lower() in ("0", "false", "no", "off")
+
+# ==================== 启动环境快照 ====================
+
+# 快照格式版本，启动环境的解析规则变化时递增
+LAUNCH_SNAPSHOT_FORMAT = 4
+
+# 影响快照内容的启动器开关：除 .env / settings.json 外也可以在命令行临时设置
+# （如 CLAUDE_VENV_COMPILE_CACHE=0 ./run.sh），快照记录它们的继承值，变化时重新解析
+LAUNCH_TOGGLES = (
+    "CLAUDE_VENV_IMAGE",
+    "CLAUDE_VENV_COMPILE_CACHE",
+    "CLAUDE_VENV_COMPILE_CACHE_MB",
+    "CLAUDE_VENV_PREFETCH",
+    "CLAUDE_VENV_PREFETCH_INTERVAL_HOURS",
+    "CLAUDE_VENV_READAHEAD",
+    "CLAUDE_VENV_LAUNCH_TRACE",
+    "CLAUDE_VENV_CONFIG_MIRROR",
+    "CLAUDE_VENV_MONITOR",
+    "CLAUDE_VENV_PYCACHE",
+    "CLAUDE_VENV_CACHE_TIER",
+)
+
+# 资源策略（resource_policy.py）：任一项设置后由 run.py 在启动 Claude 前应用
+RESOURCE_POLICY_KEYS = (
+    "CLAUDE_VENV_LIMIT_NOFILE",
+    "CLAUDE_VENV_LIMIT_AS_MB",
+    "CLAUDE_VENV_NICE",
+    "CLAUDE_VENV_IONICE",
+    "CLAUDE_VENV_CPU_AFFINITY",
+    "CLAUDE_VENV_MEMORY_MAX",
+    "CLAUDE_VENV_CPU_MAX",
+    "CLAUDE_VENV_NODE_HEAP_MB",
+)
+
+# 需要 run.py 常驻或记录的开关：开启时 shell 快照不直接启动 Claude
+PYTHON_LAUNCH_TOGGLES = (
+    "CLAUDE_VENV_LAUNCH_TRACE",
+    "CLAUDE_VENV_CONFIG_MIRROR",
+    "CLAUDE_VENV_MONITOR",
+)
+
+# 可以写入 shell 快照的变量名
+SHELL_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def load_env_file(env_file: Path) -> dict:
+    """
+    解析 .env 文件（KEY=VALUE，忽略注释和空行），文件不存在时返回空字典
+    """
+    values = {}
+    if not env_file.exists():
+        return values
+    try:
+        with open(env_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                # 跳过注释和空行
+                if line and not line.startswith('#'):
+                    # 解析 KEY=VALUE 格式
+                    if '=' in line:
+                        key, value = line.split('=', 1)
+                        values[key.strip()] = value.strip()
+    except Exception as e:
+        print(f"Warning: Failed to load .env file: {e}", file=sys.stderr)
+    return values
+
+def resolve_config_dir(value: str, script_dir: Path) -> Path:
+    """
+    解析 CLAUDE_CONFIG_DIR：未设置时使用 claude-code-venv/.claude，相对路径相对于脚本目录
+    """
+    if not value:
+        return script_dir / ".claude"
+    config_dir_path = Path(value)
+    if not config_dir_path.is_absolute():
+        config_dir_path = script_dir / config_dir_path
+    return config_dir_path.absolute()
+
+def load_settings_env(settings_file: Path) -> dict:
+    """
+    读取 settings.json 中的 env 配置（作为 .env 的备用）
+    """
+    if not settings_file.exists():
+        return {}
+    try:
+        with open(settings_file, 'r') as f:
+            settings = json.load(f)
+        return {key: str(value) for key, value in settings.get('env', {}).items()}
+    except Exception as e:
+        print(f"Warning: Failed to load settings.json: {e}", file=sys.stderr)
+        return {}
+
+def get_launch_inputs(script_dir: Path, venv_path: Path, config_dir: Path) -> list:
+    """
+    影响启动环境的文件，任一文件的修改时间或大小变化都会使快照失效
+    """
+    return [
+        script_dir / ".env",
+        config_dir / "settings.json",
+        script_dir / "VERSION",
+        script_dir / "run.py",
+        venv_path / "lib" / "node_modules" / "@anthropic-ai" / "claude-code" / "package.json",
+        venv_path / "include" / "node" / "node_version.h",
+        venv_path / "claude-code.img.json",
+        script_dir / ".cache-location.json",
+    ]
+
+def stat_inputs(paths: list) -> dict:
+    """
+    记录文件的 (mtime_ns, size)，不存在的文件记为 None
+    """
+    result = {}
+    for path in paths:
+        try:
+            st = path.stat()
+            result[str(path)] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            result[str(path)] = None
+    return result
+
+def get_inherited_env() -> dict:
+    """
+    快照依赖的继承环境变量（未设置时为 None）
+    """
+    return {key: os.environ.get(key) for key in ("CLAUDE_CONFIG_DIR",) + LAUNCH_TOGGLES + RESOURCE_POLICY_KEYS}
+
+def merge_launch_env(defaults: dict, inherited: dict, overrides: dict) -> dict:
+    """
+    按与 build_launch_env 相同的优先级合并：.env > 继承的环境变量 > settings.json
+    """
+    merged = dict(defaults)
+    merged.update({key: value for key, value in inherited.items() if value})
+    merged.update(overrides)
+    return merged
+
+def resolve_launch_env(script_dir: Path, venv_path: Path, claude_bin: Path, trace: "LaunchTrace" = None) -> dict:
+    """
+    完整解析启动环境，返回快照：
+    - set: 覆盖继承环境的变量（VIRTUAL_ENV、npm 配置、.env、CLAUDE_CONFIG_DIR）
+    - defaults: settings.json 中的变量（以及集中的 PYTHONPYCACHEPREFIX），只在继承环境和 .env 都未设置（或为空）时生效
+    """
+    trace = trace or LaunchTrace(False)
+    overrides = {"VIRTUAL_ENV": str(venv_path)}
+
+    # 设置仅对当前进程生效的 npm 环境（不写用户全局配置）
+    prepare_portable_npm_env(overrides, script_dir, venv_path)
+    trace.mark("npm_env")
+
+    # 🔑 从 .env 文件读取环境变量（优先级最高）
+    overrides.update(load_env_file(script_dir / ".env"))
+    trace.mark("env_file")
+
+    # 设置独立的 Claude 用户目录（.env 优先，其次是继承的环境变量）
+    inherited = get_inherited_env()
+    config_dir = resolve_config_dir(overrides.get("CLAUDE_CONFIG_DIR", inherited["CLAUDE_CONFIG_DIR"]), script_dir)
+    overrides["CLAUDE_CONFIG_DIR"] = str(config_dir)
+
+    # 🔑 从 settings.json 读取 API 配置环境变量（作为备用，.env 中已设置的不覆盖）
+    defaults = {
+        key: value
+        for key, value in load_settings_env(config_dir / "settings.json").items()
+        if not overrides.get(key)
+    }
+    trace.mark("settings")
+
+    # V8 编译缓存（已设置 NODE_COMPILE_CACHE 时不覆盖）
+    compile_cache = None
+    if not overrides.get("NODE_COMPILE_CACHE"):
+        compile_cache = resolve_compile_cache(script_dir, venv_path, merge_launch_env(defaults, inherited, overrides))
+    trace.mark("compile_cache")
+
+    # 集中的 Python 字节码缓存：作为默认值，继承环境中已设置 PYTHONPYCACHEPREFIX 时不覆盖
+    if is_env_enabled(merge_launch_env(defaults, inherited, overrides), "CLAUDE_VENV_PYCACHE") \
+            and not overrides.get("PYTHONPYCACHEPREFIX"):
+        defaults["PYTHONPYCACHEPREFIX"] = str(get_pycache_root(script_dir) / PYCACHE_CURRENT)
+
+    # 单文件运行镜像：解压到本机缓存（已解压时只检查标记文件）
+    image = None
+    if is_env_enabled(merge_launch_env(defaults, inherited, overrides), "CLAUDE_VENV_IMAGE"):
+        image = resolve_runtime_image(venv_path)
+        trace.mark("image")
+
+    # 创建独立的配置目录
+    config_dir.mkdir(parents=True, exist_ok=True)
+
+    # 读取版本号
+    version_file = script_dir / "VERSION"
+    version = "unknown"
+    if version_file.exists():
+        version = version_file.read_text(encoding='utf-8').strip()
+
+    return {
+        "format": LAUNCH_SNAPSHOT_FORMAT,
+        "root": str(script_dir),
+        "python": sys.executable,
+        "claude_bin": str(claude_bin),
+        "version": version,
+        "inherited": inherited,
+        "inputs": stat_inputs(get_launch_inputs(script_dir, venv_path, config_dir)),
+        "required": [str(config_dir), overrides["NPM_CONFIG_CACHE"], overrides["NPM_CONFIG_USERCONFIG"]]
+                    + ([image["marker"]] if image else [])
+                    + ([compile_cache["preload"]] if compile_cache else []),
+        "set": overrides,
+        "defaults": defaults,
+        "compile_cache": compile_cache,
+        "image": image,
+    }
+
+def get_snapshot_paths(script_dir: Path, venv_name: str) -> tuple:
+    """
+    返回 (JSON 快照, shell 快照) 路径，按虚拟环境区分（共享盘上多个系统互不干扰）
+    """
+    state_dir = get_state_dir(script_dir)
+    return state_dir / f"launch-env-{venv_name}.json", state_dir / f"launch-env-{venv_name}.sh"
+
+def load_launch_snapshot(script_dir: Path, venv_name: str) -> dict:
+    """
+    读取启动环境快照，输入文件、目录位置或继承环境变化时返回 None
+    """
+    json_path, _ = get_snapshot_paths(script_dir, venv_name)
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (snapshot.get("format") != LAUNCH_SNAPSHOT_FORMAT
+            or snapshot.get("root") != str(script_dir)
+            or snapshot.get("inherited") != get_inherited_env()):
+        return None
+    if stat_inputs([Path(p) for p in snapshot.get("inputs", {})]) != snapshot.get("inputs"):
+        return None
+    if not all(os.path.exists(p) for p in snapshot.get("required", [])):
+        return None
+    return snapshot
+
+def shell_quote(value: str) -> str:
+    return "'" + value.replace("'", "'\\''") + "'"
+
+def render_shell_snapshot(snapshot: dict, bin_dir: Path) -> str:
+    """
+    生成供 run.sh 直接 source 的 shell 快照
+    定义 claude_venv_snapshot_valid（校验）和 claude_venv_launch（导出环境并 exec Claude）
+    """
+    script_dir = Path(snapshot["root"])
+    state_dir = get_state_dir(script_dir)
+    lines = [
+        "# 由 run.py 自动生成的启动环境快照，请勿手动修改",
+        "# 删除此文件或修改 .env / settings.json / VERSION 后会在下次启动时重新生成",
+        "",
+        "claude_venv_snapshot_valid() {",
+        f"    [ \"$SCRIPT_DIR\" = {shell_quote(snapshot['root'])} ] || return 1",
+    ]
+
+    # 开启了启动追踪、用户目录内存镜像、资源监控或资源策略时始终走 run.py
+    merged = merge_launch_env(snapshot["defaults"], snapshot["inherited"], snapshot["set"])
+    if any(is_env_enabled(merged, key) for key in PYTHON_LAUNCH_TOGGLES) \
+            or any(merged.get(key) for key in RESOURCE_POLICY_KEYS):
+        lines.append("    return 1")
+
+    for key, value in snapshot["inherited"].items():
+        if value is None:
+            lines.append(f"    [ -z \"${{{key}+x}}\" ] || return 1")
+        else:
+            lines.append(f"    [ \"${{{key}-}}\" = {shell_quote(value)} ] || return 1")
+
+    # 输入文件：一次 stat 比较大小和修改时间（秒），再用 -nt 补上同一秒内的修改
+    existing = [(path, stat) for path, stat in snapshot["inputs"].items() if stat is not None]
+    for path, stat in snapshot["inputs"].items():
+        if stat is None:
+            lines.append(f"    [ ! -e {shell_quote(path)} ] || return 1")
+    if existing:
+        stat_cmd = "stat -f '%z %m'" if platform.system() in ("Darwin", "FreeBSD") else "stat -c '%s %Y'"
+        paths = " ".join(shell_quote(path) for path, _ in existing)
+        expected = "\n".join(f"{size} {mtime_ns // 1000000000}" for _, (mtime_ns, size) in existing)
+        lines.append(f"    [ \"$({stat_cmd} -- {paths} 2>/dev/null)\" = {shell_quote(expected)} ] || return 1")
+        for path, _ in existing:
+            lines.append(f"    [ ! {shell_quote(path)} -nt \"$SNAPSHOT_FILE\" ] || return 1")
+    for path in snapshot["required"] + [snapshot["claude_bin"]]:
+        lines.append(f"    [ -e {shell_quote(path)} ] || return 1")
+    lines += ["    return 0", "}", "", "claude_venv_launch() {"]
+
+    for key, value in snapshot["set"].items():
+        lines.append(f"    export {key}={shell_quote(value)}")
+    for key, value in snapshot["defaults"].items():
+        lines.append(f"    [ -n \"${{{key}-}}\" ] || export {key}={shell_quote(value)}")
+    lines.append(f"    export PATH={shell_quote(str(bin_dir))}\"${{PATH:+:$PATH}}\"")
+
+    # 编译缓存只对 Claude 自己的 node 进程生效（预加载脚本清除变量，子进程不继承）
+    compile_cache = snapshot.get("compile_cache")
+    if compile_cache:
+        stamp = shell_quote(str(Path(compile_cache["dir"]).parent / COMPILE_CACHE_PRUNE_STAMP))
+        lines += [
+            "    if [ -z \"${NODE_COMPILE_CACHE-}\" ]; then",
+            f"        export NODE_COMPILE_CACHE={shell_quote(compile_cache['dir'])}",
+            f"        export NODE_OPTIONS=\"${{NODE_OPTIONS:+$NODE_OPTIONS }}\"{shell_quote(node_require_option(compile_cache['preload']))}",
+            f"        if [ ! -e {stamp} ] || [ -n \"$(find {stamp} -mmin +{COMPILE_CACHE_PRUNE_HOURS * 60} 2>/dev/null)\" ]; then",
+            f"            touch {stamp}",
+            f"            ( {shell_quote(snapshot['python'])} {shell_quote(str(script_dir / 'run.py'))} --compile-cache-prune"
+            " > /dev/null 2>&1 < /dev/null & )",
+            "        fi",
+            "    fi",
+        ]
+
+    # 与 run.py 相同的页缓存预热（后台进程，与 Claude 启动并行）
+    if is_env_enabled(merged, "CLAUDE_VENV_READAHEAD"):
+        lines.append(f"    ( {shell_quote(snapshot['python'])} {shell_quote(str(script_dir / 'run.py'))} --readahead-warm"
+                     " > /dev/null 2>&1 < /dev/null & )")
+
+    # 与 run.py 相同的后台预取（按 prefetch.json 的修改时间限频）
+    if is_env_enabled(merged, "CLAUDE_VENV_PREFETCH") and (script_dir / "update.py").exists():
+        try:
+            interval_minutes = int(float(merged.get("CLAUDE_VENV_PREFETCH_INTERVAL_HOURS", "24")) * 60)
+        except ValueError:
+            interval_minutes = 24 * 60
+        stamp = shell_quote(str(state_dir / "prefetch.json"))
+        lines += [
+            f"    if [ ! -e {stamp} ] || [ -n \"$(find {stamp} -mmin +{interval_minutes} 2>/dev/null)\" ]; then",
+            f"        touch {stamp}",
+            f"        ( cd {shell_quote(snapshot['root'])} && nohup {shell_quote(snapshot['python'])} update.py --prefetch"
+            f" >> {shell_quote(str(state_dir / 'prefetch.log'))} 2>&1 < /dev/null & )",
+            "    fi",
+        ]
+
+    banner = [
+        "=" * 60,
+        f"🚀 启动 Claude Code 虚拟环境 v{snapshot['version']}",
+        "=" * 60,
+    ]
+    lines.append("    printf '%s\\n' " + " ".join(shell_quote(line) for line in banner))
+    lines.append("    printf '📂 终端目录: %s\\n' \"$PWD\"")
+    info = [
+        f"📍 脚本目录: {snapshot['root']}",
+        f"📦 虚拟环境: {bin_dir.parent}",
+        f"🗂️  用户目录: {snapshot['set']['CLAUDE_CONFIG_DIR']}",
+        f"🔧 Claude 路径: {snapshot['image']['entry'] if snapshot.get('image') else snapshot['claude_bin']}",
+        "=" * 60,
+        "",
+    ]
+    lines.append("    printf '%s\\n' " + " ".join(shell_quote(line) for line in info))
+    image = snapshot.get("image")
+    if image:
+        lines.append(f"    export NODE_PATH={shell_quote(image['node_path'])}\"${{NODE_PATH:+:$NODE_PATH}}\"")
+        lines.append(f"    exec {shell_quote(image['node'])} {shell_quote(image['entry'])} \"$@\"")
+    else:
+        lines.append(f"    exec {shell_quote(snapshot['claude_bin'])} \"$@\"")
+    lines += ["}", ""]
+    return "\n".join(lines)
+
+def write_text_atomic(path: Path, content: str) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(content, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+def save_launch_snapshot(script_dir: Path, venv_name: str, snapshot: dict, bin_dir: Path, is_windows: bool) -> None:
+    """
+    保存启动环境快照（JSON 供 run.py 使用，shell 版本供 run.sh 跳过 Python 直接启动）
+    变量名不能在 shell 中使用时不生成 shell 快照
+    """
+    json_path, sh_path = get_snapshot_paths(script_dir, venv_name)
+    try:
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(json_path, json.dumps(snapshot, ensure_ascii=False, indent=2))
+        keys = list(snapshot["set"]) + list(snapshot["defaults"])
+        if not is_windows and all(SHELL_NAME_PATTERN.match(key) for key in keys):
+            write_text_atomic(sh_path, render_shell_snapshot(snapshot, bin_dir))
+        elif sh_path.exists():
+            sh_path.unlink()
+    except OSError as e:
+        print(f"Warning: Failed to save launch snapshot: {e}", file=sys.stderr)
+
+def remove_launch_snapshot(script_dir: Path, venv_name: str) -> None:
+    for path in get_snapshot_paths(script_dir, venv_name):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+def build_launch_env(snapshot: dict, venv_path: Path, venv_bin_dir: Path, is_windows: bool) -> dict:
+    """
+    在继承的环境变量上应用快照，得到 Claude 的最终运行环境
+    """
+    env = os.environ.copy()
+    env.update(snapshot["set"])
+    for key, value in snapshot["defaults"].items():
+        if not env.get(key):
+            env[key] = value
+
+    compile_cache = snapshot.get("compile_cache")
+    if compile_cache and not env.get("NODE_COMPILE_CACHE"):
+        env["NODE_COMPILE_CACHE"] = compile_cache["dir"]
+        add_node_require(env, compile_cache["preload"])
+
+    # 更新 PATH，将虚拟环境路径放在最前面
+    prepend_venv_to_path(env, venv_path, venv_bin_dir, is_windows)
+    return env
+
+def node_require_option(preload: str) -> str:
+    return f'--require "{preload}"'
+
+def add_node_require(env: dict, preload) -> None:
+    """
+    通过 NODE_OPTIONS 为 Claude 的 node 进程追加预加载脚本
+    """
+    require = node_require_option(str(preload))
+    env["NODE_OPTIONS"] = f"{env['NODE_OPTIONS']} {require}" if env.get("NODE_OPTIONS") else require
+
+# ==================== 启动参数 ====================
+
+# run.py 自己处理的参数（其余参数原样传给 Claude），"--" 之后的参数不再识别
+LAUNCHER_FLAGS = {
+    "--launch-trace": "launch_trace",
+    "--launch-trace-report": "launch_trace_report",
+    "--readahead-learn": "readahead_learn",
+    "--readahead-warm": "readahead_warm",
+    "--compile-cache-prune": "compile_cache_prune",
+    "--monitor": "monitor",
+    "--doctor": "doctor",
+}
+
+# 带值的启动器参数（--name value 或 --name=value）
+LAUNCHER_OPTIONS = {
+    "--sessions": "sessions",
+    "--session-id": "session_id",
+    "--session-parallel": "session_parallel",
+}
+
+def split_launcher_args(argv: list) -> tuple:
+    """
+    拆分启动器参数和 Claude 参数
+    返回: (launcher_options, claude_args)
+    """
+    options = {name: False for name in LAUNCHER_FLAGS.values()}
+    options.update({name: None for name in LAUNCHER_OPTIONS.values()})
+    claude_args = []
+    args = iter(enumerate(argv))
+    for index, arg in args:
+        if arg == "--":
+            claude_args.extend(argv[index:])
+            break
+        name, has_value, value = arg.partition("=")
+        if arg in LAUNCHER_FLAGS:
+            options[LAUNCHER_FLAGS[arg]] = True
+        elif name in LAUNCHER_OPTIONS:
+            if not has_value:
+                value = next(args, (None, None))[1]
+            if value is None:
+                print(f"❌ 错误：{name} 需要一个值")
+                sys.exit(2)
+            options[LAUNCHER_OPTIONS[name]] = value
+        else:
+            claude_args.append(arg)
+    return options, claude_args
+
+# ==================== 启动耗时追踪 ====================
+
+# 由 NODE_OPTIONS --require 加载，记录 Node 自身的启动耗时（只在第一个 node 进程中记录一次）；
+# 加载后清除自身的 --require 和追踪变量，Claude 启动的 node 子进程不再加载本脚本
+TRACE_PRELOAD_SOURCE = """\
+'use strict';
+const file = process.env.CLAUDE_VENV_TRACE_FILE;
+const id = process.env.CLAUDE_VENV_TRACE_ID;
+delete process.env.CLAUDE_VENV_TRACE_FILE;
+delete process.env.CLAUDE_VENV_TRACE_ID;
+if (process.env.NODE_OPTIONS) {
+  const options = process.env.NODE_OPTIONS.replace(/--require\\s+"[^"]*launch-trace-preload\\.cjs"/g, '').trim();
+  if (options) process.env.NODE_OPTIONS = options;
+  else delete process.env.NODE_OPTIONS;
+}
+if (file && id && !process.env.CLAUDE_VENV_TRACE_DONE) {
+  process.env.CLAUDE_VENV_TRACE_DONE = '1';
+  const fs = require('fs');
+  const { performance } = require('perf_hooks');
+  const origin = performance.timeOrigin;
+  const preload = origin + performance.now();
+  setImmediate(() => {
+    const t = performance.nodeTiming;
+    const record = {
+      id, kind: 'node', pid: process.pid, node_version: process.version,
+      process_start: origin,
+      node_start: origin + t.nodeStart,
+      v8_start: origin + t.v8Start,
+      environment: origin + t.environment,
+      bootstrap_complete: origin + t.bootstrapComplete,
+      preload,
+      main_evaluated: origin + performance.now(),
+      compile_cache_dir: (require('module').getCompileCacheDir || (() => null))() || null,
+    };
+    try { fs.appendFileSync(file, JSON.stringify(record) + '\\n'); } catch (e) {}
+  });
+}
+"""
+
+class LaunchTrace:
+    """记录启动各阶段耗时（毫秒），未开启时所有操作都是空操作"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.phases = {}
+        self.started_at = time.time() * 1000
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """结束从上一个标记到现在的阶段"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self._last) * 1000, 3)
+        self._last = now
+
+def get_trace_file(script_dir: Path) -> Path:
+    return get_state_dir(script_dir) / "launch-trace.jsonl"
+
+def get_storage_info(path: Path) -> dict:
+    """
+    返回路径所在的挂载点和文件系统类型（仅 Linux 可用，用于按存储介质区分追踪结果）
+    """
+    info = {"mount": None, "fstype": None}
+    try:
+        target = str(path.resolve())
+        with open("/proc/mounts", 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount = parts[1].replace("\\040", " ")
+                if (target == mount or target.startswith(mount.rstrip("/") + "/")) and len(mount) >= len(info["mount"] or ""):
+                    info = {"mount": mount, "fstype": parts[2]}
+    except OSError:
+        pass
+    return info
+
+def read_claude_version(venv_path: Path) -> str:
+    for modules_dir in ["lib/node_modules", "node_modules", "Lib/node_modules"]:
+        try:
+            with open(venv_path / modules_dir / "@anthropic-ai" / "claude-code" / "package.json", 'r', encoding='utf-8') as f:
+                return json.load(f).get("version") or "unknown"
+        except (OSError, ValueError):
+            continue
+    return "unknown"
+
+def prepare_trace_env(env: dict, script_dir: Path, trace_id: str) -> None:
+    """
+    通过 NODE_OPTIONS 注入预加载脚本，让 Claude 的 node 进程把自身的启动耗时写入追踪文件
+    """
+    state_dir = get_state_dir(script_dir)
+    preload = state_dir / "launch-trace-preload.cjs"
+    try:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        if not preload.exists() or preload.read_text(encoding='utf-8') != TRACE_PRELOAD_SOURCE:
+            write_text_atomic(preload, TRACE_PRELOAD_SOURCE)
+    except OSError as e:
+        print(f"Warning: Failed to write trace preload: {e}", file=sys.stderr)
+        return
+
+    env["CLAUDE_VENV_TRACE_FILE"] = str(get_trace_file(script_dir))
+    env["CLAUDE_VENV_TRACE_ID"] = trace_id
+    env.pop("CLAUDE_VENV_TRACE_DONE", None)
+    add_node_require(env, preload)
+
+def write_launch_trace(script_dir: Path, trace: LaunchTrace, record: dict) -> None:
+    """
+    追加启动器一侧的追踪记录（Node 一侧的记录由预加载脚本按相同 id 追加）
+    """
+    record = dict(record)
+    record.update({
+        "kind": "launcher",
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python_main": trace.started_at,
+        "phases": trace.phases,
+    })
+    shell_start = os.environ.get("CLAUDE_VENV_TRACE_T0", "")
+    if shell_start.isdigit() and len(shell_start) > 12:
+        # run.sh 记录的纳秒时间戳（date +%s%N，不支持 %N 时用 perl / python3）
+        record["shell_start"] = int(shell_start) / 1e6
+    try:
+        trace_file = get_trace_file(script_dir)
+        trace_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(trace_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Warning: Failed to write launch trace: {e}", file=sys.stderr)
+
+def summarize_launch_traces(script_dir: Path) -> int:
+    """
+    汇总追踪文件：按 Claude 版本和文件系统分组，显示各阶段耗时的中位数和 P90
+    """
+    trace_file = get_trace_file(script_dir)
+    launchers, nodes = [], {}
+    try:
+        with open(trace_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("kind") == "node":
+                    nodes.setdefault(record.get("id"), record)
+                elif record.get("kind") == "launcher":
+                    launchers.append(record)
+    except OSError:
+        pass
+
+    print("=" * 60)
+    print("⏱️  启动耗时追踪汇总")
+    print("=" * 60)
+    print(f"📄 追踪文件: {trace_file}")
+    if not launchers:
+        print("暂无记录（使用 --launch-trace 或 CLAUDE_VENV_LAUNCH_TRACE=1 启动以记录）")
+        return 0
+
+    groups = {}
+    for launcher in launchers:
+        metrics = {}
+        if "shell_start" in launcher:
+            metrics["shell+interpreter"] = launcher["python_main"] - launcher["shell_start"]
+        for phase, value in launcher.get("phases", {}).items():
+            metrics[phase] = value
+        node = nodes.get(launcher.get("id"))
+        if node and launcher.get("spawn_at"):
+            metrics["node_process_start"] = node["process_start"] - launcher["spawn_at"]
+            # 预加载脚本在 Node 自身初始化完成、主模块加载之前执行
+            metrics["node_bootstrap"] = node["preload"] - node["process_start"]
+            metrics["main_module"] = node["main_evaluated"] - node["preload"]
+            start = launcher.get("shell_start", launcher["python_main"])
+            metrics["total_to_main"] = node["main_evaluated"] - start
+        # 编译缓存：启动前缓存目录已有文件且 Node 确认启用即视为命中
+        cache = launcher.get("compile_cache")
+        if cache:
+            metrics["compile_cache_hit"] = 1.0 if cache.get("files") and node and node.get("compile_cache_dir") else 0.0
+        readahead = "预热" if launcher.get("readahead", {}).get("files") else "未预热"
+        if launcher.get("image"):
+            readahead += "/镜像"
+        key = (launcher.get("claude_version", "unknown"), launcher.get("storage", {}).get("fstype") or "-", readahead)
+        groups.setdefault(key, []).append(metrics)
+
+    for (version, fstype, readahead), items in sorted(groups.items()):
+        print()
+        print(f"🔹 Claude {version} / 文件系统 {fstype} / {readahead}: {len(items)} 次启动")
+        names = []
+        for metrics in items:
+            names.extend(name for name in metrics if name not in names)
+        for name in names:
+            values = sorted(m[name] for m in items if name in m)
+            if name == "compile_cache_hit":
+                print(f"   {'编译缓存命中':<16} {sum(values):.0f}/{len(values)} 次（{sum(values) / len(values) * 100:.0f}%）")
+                continue
+            median = values[len(values) // 2]
+            p90 = values[min(len(values) - 1, int(len(values) * 0.9))]
+            print(f"   {name:<20} 中位数 {median:8.1f} ms   P90 {p90:8.1f} ms   ({len(values)} 次)")
+    print("=" * 60)
+    return 0
+
+# ==================== V8 编译缓存 ====================
+
+# Node.js 22.1 起支持 NODE_COMPILE_CACHE（模块编译缓存）
+COMPILE_CACHE_MIN_NODE = (22, 1)
+DEFAULT_COMPILE_CACHE_MB = 256
+# 定期按预算清理编译缓存（记录上次清理时间的文件位于缓存根目录）
+COMPILE_CACHE_PRUNE_HOURS = 24
+COMPILE_CACHE_PRUNE_STAMP = ".last-prune"
+
+# 由 NODE_OPTIONS --require 加载：Node 启动时已读取 NODE_COMPILE_CACHE，
+# 这里清除变量和自身的 --require，Claude 启动的子进程（Bash 工具中的构建和测试、MCP 服务器）不再写入便携盘上的缓存
+COMPILE_CACHE_PRELOAD_SOURCE = """\
+'use strict';
+delete process.env.NODE_COMPILE_CACHE;
+if (process.env.NODE_OPTIONS) {
+  const options = process.env.NODE_OPTIONS.replace(/--require\\s+"[^"]*compile-cache-preload\\.cjs"/g, '').trim();
+  if (options) process.env.NODE_OPTIONS = options;
+  else delete process.env.NODE_OPTIONS;
+}
+"""
+
+def read_node_version(venv_path: Path) -> tuple:
+    """
+    从 nodeenv 安装的头文件读取 Node.js 版本（无需启动 node），读取失败时返回 None
+    """
+    for include_dir in ["include", "Include"]:
+        header = venv_path / include_dir / "node" / "node_version.h"
+        try:
+            text = header.read_text(encoding='utf-8', errors='ignore')
+        except OSError:
+            continue
+        parts = []
+        for name in ["NODE_MAJOR_VERSION", "NODE_MINOR_VERSION", "NODE_PATCH_VERSION"]:
+            match = re.search(rf"#define\s+{name}\s+(\d+)", text)
+            if not match:
+                return None
+            parts.append(int(match.group(1)))
+        return tuple(parts)
+    return None
+
+def get_compile_cache_root(script_dir: Path, venv_name: str) -> Path:
+    from cache_location import get_cache_root
+    return get_state_dir(get_cache_root(script_dir)) / "compile-cache" / venv_name
+
+def get_dir_usage(path: Path) -> tuple:
+    """
+    返回目录下的 (文件数, 总字节数)
+    """
+    files = total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        files += 1
+                        total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return files, total
+
+def prune_compile_cache(cache_root: Path, keep: str, budget_bytes: int) -> None:
+    """
+    把编译缓存控制在预算内：先按修改时间从旧到新删除其他版本的缓存，
+    当前版本单独超出预算时清空重建
+    """
+    import shutil
+    try:
+        entries = [p for p in cache_root.iterdir() if p.is_dir()]
+    except OSError:
+        return
+    usage = {p: get_dir_usage(p)[1] for p in entries}
+    total = sum(usage.values())
+    others = sorted((p for p in entries if p.name != keep), key=lambda p: p.stat().st_mtime)
+    for path in others:
+        if total <= budget_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= usage[path]
+    current = cache_root / keep
+    if total > budget_bytes and current in usage:
+        shutil.rmtree(current, ignore_errors=True)
+
+def get_compile_cache_budget(env: dict) -> int:
+    """
+    编译缓存的总大小上限（字节）
+    """
+    try:
+        budget_mb = float(env.get("CLAUDE_VENV_COMPILE_CACHE_MB", DEFAULT_COMPILE_CACHE_MB))
+    except ValueError:
+        budget_mb = DEFAULT_COMPILE_CACHE_MB
+    return int(budget_mb * 1024 * 1024)
+
+def resolve_compile_cache(script_dir: Path, venv_path: Path, env: dict) -> dict:
+    """
+    返回当前虚拟环境、当前 Claude Code 版本使用的编译缓存 {"dir", "preload"}，不支持或已关闭时返回 None
+    Claude Code 升级后版本号变化即使用新目录（旧目录按预算清理）
+    只在重新生成启动环境快照时调用，不增加快速启动的开销
+    """
+    if is_env_disabled(env, "CLAUDE_VENV_COMPILE_CACHE"):
+        return None
+    node_version = read_node_version(venv_path)
+    if node_version is None or node_version[:2] < COMPILE_CACHE_MIN_NODE:
+        return None
+
+    claude_version = read_claude_version(venv_path)
+    cache_root = get_compile_cache_root(script_dir, venv_path.name)
+    cache_dir = cache_root / claude_version
+    preload = get_state_dir(script_dir) / "compile-cache-preload.cjs"
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        prune_compile_cache(cache_root, claude_version, get_compile_cache_budget(env))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if not preload.exists() or preload.read_text(encoding='utf-8') != COMPILE_CACHE_PRELOAD_SOURCE:
+            write_text_atomic(preload, COMPILE_CACHE_PRELOAD_SOURCE)
+    except OSError:
+        return None
+    return {"dir": str(cache_dir), "preload": str(preload)}
+
+def start_compile_cache_prune(env: dict, script_dir: Path, compile_cache: dict) -> None:
+    """
+    缓存一直在增长（同一版本也会不断写入新的编译结果），每隔 COMPILE_CACHE_PRUNE_HOURS
+    在分离的后台进程中按预算清理一次；快速启动路径在 shell 快照中做同样的检查
+    """
+    if not compile_cache or env.get("NODE_COMPILE_CACHE") != compile_cache["dir"]:
+        return
+    stamp_file = Path(compile_cache["dir"]).parent / COMPILE_CACHE_PRUNE_STAMP
+    try:
+        if time.time() - stamp_file.stat().st_mtime < COMPILE_CACHE_PRUNE_HOURS * 3600:
+            return
+    except OSError:
+        pass
+    try:
+        stamp_file.touch()
+        kwargs = {}
+        if platform.system() == "Windows":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        subprocess.Popen(
+            [sys.executable, str(script_dir / "run.py"), "--compile-cache-prune"],
+            env=env,
+            cwd=str(script_dir),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            **kwargs
+        )
+    except Exception as e:
+        print(f"Warning: Failed to start compile cache prune: {e}", file=sys.stderr)
+
+# ==================== Python 字节码缓存 ====================
+
+# Claude 在项目中运行的 Python 把 __pycache__ 写到集中目录，而不是散落在各个项目里
+# 目录按代管理：current 为当前代，2_Scripts/Clear_Python_Cache.py --central 把它封存为 gen-<时间>，
+# 再按年龄和大小上限整代删除
+PYCACHE_CURRENT = "current"
+
+def get_pycache_root(script_dir: Path) -> Path:
+    """
+    返回集中的 Python 字节码缓存目录（CLAUDE_VENV_PYCACHE=1 开启）
+    """
+    return get_state_dir(script_dir) / "pycache"
+
+# ==================== 页缓存预热 ====================
+
+# 学习模式的预加载脚本：记录 Claude 启动后一段时间内读取的文件
+READAHEAD_LEARN_SOURCE = """\
+'use strict';
+const out = process.env.CLAUDE_VENV_READAHEAD_LEARN_FILE;
+if (out && !process.env.CLAUDE_VENV_READAHEAD_LEARN_DONE) {
+  process.env.CLAUDE_VENV_READAHEAD_LEARN_DONE = '1';
+  const fs = require('fs');
+  const path = require('path');
+  const { fileURLToPath } = require('url');
+  const seen = new Set();
+  const add = (p) => {
+    try {
+      if (p instanceof URL) p = fileURLToPath(p);
+      if (typeof p === 'string') seen.add(path.resolve(p));
+    } catch (e) {}
+  };
+  add(process.execPath);
+  if (process.argv[1]) add(process.argv[1]);
+  const wrap = (target, names) => {
+    for (const name of names) {
+      const original = target[name];
+      if (typeof original !== 'function') continue;
+      target[name] = function (p, ...rest) { add(p); return original.call(this, p, ...rest); };
+    }
+  };
+  wrap(fs, ['openSync', 'open', 'readFileSync', 'readFile', 'createReadStream']);
+  wrap(fs.promises, ['open', 'readFile']);
+  let written = false;
+  const write = () => {
+    if (written) return;
+    written = true;
+    for (const key of Object.keys(require.cache)) add(key);
+    try { fs.writeFileSync(out, JSON.stringify([...seen])); } catch (e) {}
+  };
+  setTimeout(write, Number(process.env.CLAUDE_VENV_READAHEAD_LEARN_SECONDS || 10) * 1000).unref();
+  process.on('exit', write);
+}
+"""
+
+def get_readahead_paths(script_dir: Path, venv_name: str) -> tuple:
+    """
+    返回 (文件列表, 学习模式原始记录) 路径
+    """
+    state_dir = get_state_dir(script_dir)
+    return state_dir / f"readahead-{venv_name}.json", state_dir / f"readahead-{venv_name}.raw.json"
+
+def prepare_readahead_learn(env: dict, script_dir: Path, venv_name: str) -> None:
+    """
+    学习模式：通过 NODE_OPTIONS 注入预加载脚本，记录启动时读取的文件
+    """
+    state_dir = get_state_dir(script_dir)
+    preload = state_dir / "readahead-learn.cjs"
+    _, raw_file = get_readahead_paths(script_dir, venv_name)
+    try:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        if not preload.exists() or preload.read_text(encoding='utf-8') != READAHEAD_LEARN_SOURCE:
+            write_text_atomic(preload, READAHEAD_LEARN_SOURCE)
+        if raw_file.exists():
+            raw_file.unlink()
+    except OSError as e:
+        print(f"Warning: Failed to prepare readahead learning: {e}", file=sys.stderr)
+        return
+
+    env["CLAUDE_VENV_READAHEAD_LEARN_FILE"] = str(raw_file)
+    env.pop("CLAUDE_VENV_READAHEAD_LEARN_DONE", None)
+    add_node_require(env, preload)
+
+def finish_readahead_learn(script_dir: Path, venv_name: str, venv_path: Path) -> None:
+    """
+    整理学习结果：只保留便携目录内的普通文件，按首次读取顺序保存为相对路径
+    """
+    list_file, raw_file = get_readahead_paths(script_dir, venv_name)
+    try:
+        with open(raw_file, 'r', encoding='utf-8') as f:
+            raw_paths = json.load(f)
+    except (OSError, ValueError):
+        print("⚠️  没有记录到启动时读取的文件（Claude 可能不是通过 node 启动）")
+        return
+
+    files = []
+    root = str(script_dir) + os.sep
+    state_dir = str(get_state_dir(script_dir)) + os.sep
+    for path in raw_paths:
+        if not path.startswith(root) or path.startswith(state_dir) or not os.path.isfile(path):
+            continue
+        files.append([os.path.relpath(path, script_dir), os.path.getsize(path)])
+
+    data = {
+        "claude_version": read_claude_version(venv_path),
+        "learned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": files,
+    }
+    write_text_atomic(list_file, json.dumps(data, ensure_ascii=False, indent=2))
+    raw_file.unlink()
+    total = sum(size for _, size in files)
+    print(f"📚 已记录启动文件列表: {len(files)} 个文件，{total / 1024 / 1024:.1f} MB -> {list_file}")
+
+def load_readahead_list(script_dir: Path, venv_name: str, venv_path: Path) -> list:
+    """
+    读取学习到的文件列表，Claude Code 版本变化后列表失效（返回空列表）
+    """
+    list_file, _ = get_readahead_paths(script_dir, venv_name)
+    try:
+        with open(list_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if data.get("claude_version") != read_claude_version(venv_path):
+        return []
+    return [script_dir / rel for rel, _ in data.get("files", [])]
+
+def warm_file(path: Path) -> int:
+    """
+    让内核提前把文件读入页缓存：支持 posix_fadvise 时发起异步预读，否则直接顺序读一遍
+    返回: 文件大小
+    """
+    try:
+        fd = os.open(str(path), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError:
+        return 0
+    try:
+        size = os.fstat(fd).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while os.read(fd, 1024 * 1024):
+                pass
+        return size
+    except OSError:
+        return 0
+    finally:
+        os.close(fd)
+
+def warm_page_cache(paths: list, threads: int) -> int:
+    """
+    多线程预热文件列表（网络盘和 U 盘上并发请求能掩盖单次读取的延迟）
+    返回: 预热的总字节数
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        return sum(executor.map(warm_file, paths))
+
+def get_readahead_threads(env: dict) -> int:
+    """
+    预热线程数（CLAUDE_VENV_READAHEAD_THREADS，无效值时使用默认的 8）
+    """
+    try:
+        return max(1, int(env.get("CLAUDE_VENV_READAHEAD_THREADS", "8")))
+    except ValueError:
+        return 8
+
+def start_readahead(env: dict, script_dir: Path, venv_name: str, venv_path: Path, detach: bool) -> dict:
+    """
+    按需预热页缓存（.env 中设置 CLAUDE_VENV_READAHEAD=1 开启，需要先用 --readahead-learn 学习一次）
+    detach 为 True 时（exec 模式）在分离的子进程中预热，否则在后台线程中与 Claude 启动并行
+    返回: 追踪信息，未开启时返回空字典
+    """
+    if not is_env_enabled(env, "CLAUDE_VENV_READAHEAD"):
+        return {}
+    paths = load_readahead_list(script_dir, venv_name, venv_path)
+    if not paths:
+        return {"files": 0}
+    threads = get_readahead_threads(env)
+
+    if detach and hasattr(os, "fork"):
+        # 两次 fork，预热进程由 init 接管，不会成为 Claude 的僵尸子进程
+        pid = os.fork()
+        if pid == 0:
+            try:
+                if os.fork() == 0:
+                    warm_page_cache(paths, threads)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+    else:
+        import threading
+        threading.Thread(target=warm_page_cache, args=(paths, threads), daemon=True).start()
+    return {"files": len(paths), "mode": "fadvise" if hasattr(os, "posix_fadvise") else "read"}
+
+# ==================== 单文件运行镜像 ====================
+
+def resolve_runtime_image(venv_path: Path) -> dict:
+    """
+    使用 runtime_image.py 打包的镜像启动（.env 中设置 CLAUDE_VENV_IMAGE=1 开启）
+    返回: {"node", "entry", "marker", "node_path"}，镜像不存在或与已安装版本不一致时返回 None
+    """
+    try:
+        from runtime_image import resolve_image_launch, COMPLETE_MARKER
+        launch = resolve_image_launch(venv_path)
+    except Exception as e:
+        print(f"Warning: Failed to prepare runtime image: {e}", file=sys.stderr)
+        return None
+    if launch is None:
+        print("Warning: runtime image missing or outdated, run: python3 runtime_image.py pack", file=sys.stderr)
+        return None
+    node, entry = launch
+    package_dir = Path(entry).parent
+    return {
+        "node": str(node),
+        "entry": str(entry),
+        "marker": str(package_dir / COMPLETE_MARKER),
+        # 包的依赖仍在虚拟环境的 node_modules 中
+        "node_path": str(venv_path / "lib" / "node_modules"),
+    }
+
+# ==================== 用户目录内存镜像 ====================
+
+def open_config_mirror(env: dict, script_dir: Path):
+    """
+    把用户目录镜像到内存文件系统（.env 中设置 CLAUDE_VENV_CONFIG_MIRROR=1 开启）
+    返回: config_mirror.ConfigMirror，无法使用时返回 None（直接读写便携盘上的用户目录）
+    """
+    try:
+        from config_mirror import ConfigMirror
+        mirror = ConfigMirror(script_dir, Path(env["CLAUDE_CONFIG_DIR"]), env)
+        info = mirror.open()
+    except Exception as e:
+        print(f"Warning: config mirror disabled: {e}", file=sys.stderr)
+        return None
+    if info["copied"]:
+        print(f"🧠 已复制到内存镜像: {info['copied']} 个文件，{info['bytes'] / 1024 / 1024:.1f} MB")
+    return mirror
+
+def close_config_mirror(mirror, process) -> None:
+    """
+    等待 Claude 退出后完整回写内存镜像
+    """
+    if process is not None and process.poll() is None:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    stats = mirror.close()
+    if not stats.get("complete"):
+        print("⚠️  用户目录未能完整回写，下次启动时会自动补回（或运行 python3 config_mirror.py recover）")
+    elif stats["files"] or stats["removed"]:
+        print(f"💾 用户目录已回写: {stats['files']} 个文件，{stats['bytes'] / 1024 / 1024:.1f} MB")
+
+def exit_on_signal(signum, frame) -> None:
+    """
+    终端关闭或收到终止信号时正常退出，保证内存镜像完成回写、会话分片完成合并
+    """
+    sys.exit(128 + signum)
+
+# ==================== 进程资源监控 ====================
+
+# 时间序列的列（资源为整个 Claude 进程树的合计，CPU 时间和磁盘读写为累计值）
+MONITOR_COLUMNS = ("elapsed_s", "processes", "rss_bytes", "cpu_seconds", "fds", "read_bytes", "write_bytes")
+
+def get_monitor_interval(env: dict) -> float:
+    """
+    资源监控的采样间隔（秒，CLAUDE_VENV_MONITOR_INTERVAL，默认 1）
+    """
+    try:
+        return max(0.1, float(env.get("CLAUDE_VENV_MONITOR_INTERVAL") or 1))
+    except ValueError:
+        return 1.0
+
+def read_proc_stat(pid: str) -> tuple:
+    """
+    读取 /proc/<pid>/stat
+    返回: (ppid, starttime, cpu_ticks, rss_pages)，进程已退出时返回 None
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # 进程名可能包含空格和括号，从最后一个 ')' 之后开始解析
+    fields = data[data.rfind(b")") + 2:].split()
+    return int(fields[1]), int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21])
+
+def read_proc_io(pid: int) -> tuple:
+    """
+    读取 /proc/<pid>/io 中实际落到存储设备的读写字节
+    返回: (read_bytes, write_bytes)，无权限时为 (0, 0)
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return values.get("read_bytes", 0), values.get("write_bytes", 0)
+
+class ProcessMonitor(threading.Thread):
+    """
+    后台线程按间隔采样 Claude 进程树（Linux /proc）：内存 RSS、CPU 时间、打开的文件数、磁盘读写
+    每次采样写入一行 CSV；已退出子进程的 CPU 时间和读写量计入累计值
+    """
+
+    def __init__(self, root_pid: int, output_file: Path, interval: float):
+        super().__init__(daemon=True)
+        self.root_pid = root_pid
+        self.output_file = output_file
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.start_time = time.monotonic()
+        # (pid, starttime) -> (ppid, cpu_ticks, read_bytes, write_bytes)
+        self.live = {}
+        self.finished = [0, 0, 0]
+        self.peak = {"processes": 0, "rss_bytes": 0, "fds": 0}
+        self.last_row = None
+
+    def sample(self) -> list:
+        tree = {}
+        children = {}
+        for name in os.listdir("/proc"):
+            if name.isdigit():
+                stat = read_proc_stat(name)
+                if stat:
+                    tree[int(name)] = stat
+                    children.setdefault(stat[0], []).append(int(name))
+
+        pids = [self.root_pid] if self.root_pid in tree else []
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+
+        live = {}
+        rss = fds = 0
+        for pid in pids:
+            ppid, starttime, cpu, rss_pages = tree[pid]
+            rss += rss_pages * self.page_size
+            try:
+                fds += len(os.listdir(f"/proc/{pid}/fd"))
+            except OSError:
+                pass
+            live[(pid, starttime)] = (ppid, cpu) + read_proc_io(pid)
+        live_pids = {pid for pid, _ in live}
+        exited = {key[0]: values for key, values in self.live.items() if key not in live}
+        for ppid, cpu, read_bytes, write_bytes in exited.values():
+            # 子进程的 CPU 时间不计入父进程的 utime/stime，退出后由这里累计
+            self.finished[0] += cpu
+            # 读写量在父进程回收子进程时并入父进程的 /proc/<pid>/io：
+            # 沿着同时退出的祖先向上找，最终由仍在运行的进程回收的不再重复累计
+            while ppid in exited:
+                ppid = exited[ppid][0]
+            if ppid not in live_pids:
+                self.finished[1] += read_bytes
+                self.finished[2] += write_bytes
+        self.live = live
+        totals = list(self.finished)
+        for _, cpu, read_bytes, write_bytes in live.values():
+            totals[0] += cpu
+            totals[1] += read_bytes
+            totals[2] += write_bytes
+
+        row = [round(time.monotonic() - self.start_time, 2), len(pids), rss,
+               round(totals[0] / self.ticks, 2), fds, totals[1], totals[2]]
+        self.peak["processes"] = max(self.peak["processes"], len(pids))
+        self.peak["rss_bytes"] = max(self.peak["rss_bytes"], rss)
+        self.peak["fds"] = max(self.peak["fds"], fds)
+        self.last_row = row
+        return row
+
+    def run(self) -> None:
+        with open(self.output_file, "w", encoding="utf-8") as f:
+            f.write(",".join(MONITOR_COLUMNS) + "\n")
+            while True:
+                f.write(",".join(str(value) for value in self.sample()) + "\n")
+                f.flush()
+                if self.stopped.wait(self.interval):
+                    break
+            # Claude 退出后再采样一次，计入最后一段的 CPU 时间和读写量
+            f.write(",".join(str(value) for value in self.sample()) + "\n")
+
+    def stop(self) -> dict:
+        """
+        停止采样，返回会话汇总
+        """
+        self.stopped.set()
+        self.join(timeout=5)
+        row = dict(zip(MONITOR_COLUMNS, self.last_row or [0] * len(MONITOR_COLUMNS)))
+        elapsed = time.monotonic() - self.start_time
+        return {
+            "seconds": round(elapsed, 1),
+            "peak_rss_bytes": self.peak["rss_bytes"],
+            "peak_fds": self.peak["fds"],
+            "peak_processes": self.peak["processes"],
+            "cpu_seconds": row["cpu_seconds"],
+            "avg_cpu_percent": round(row["cpu_seconds"] / elapsed * 100, 1) if elapsed else 0,
+            "read_bytes": row["read_bytes"],
+            "write_bytes": row["write_bytes"],
+            "series": str(self.output_file),
+        }
+
+def start_process_monitor(env: dict, config_dir: Path, pid: int):
+    """
+    开始监控 Claude 进程树，时间序列保存在用户目录旁边的 <用户目录>-monitor/
+    返回: ProcessMonitor，不支持时返回 None
+    """
+    if not Path("/proc/self/stat").exists():
+        print("⚠️  资源监控需要 /proc（仅支持 Linux），本次不记录", file=sys.stderr)
+        return None
+    monitor_dir = config_dir.parent / f"{config_dir.name}-monitor"
+    try:
+        monitor_dir.mkdir(parents=True, exist_ok=True)
+        monitor = ProcessMonitor(pid, monitor_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{pid}.csv",
+                                 get_monitor_interval(env))
+        monitor.start()
+    except OSError as e:
+        print(f"Warning: process monitor disabled: {e}", file=sys.stderr)
+        return None
+    return monitor
+
+def finish_process_monitor(monitor) -> None:
+    """
+    停止监控，打印汇总并追加到 summary.jsonl
+    """
+    summary = monitor.stop()
+    summary["finished_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        with open(monitor.output_file.parent / "summary.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+    mb = 1024 * 1024
+    print(f"📈 资源监控: 峰值内存 {summary['peak_rss_bytes'] / mb:.1f} MB，"
+          f"平均 CPU {summary['avg_cpu_percent']}%，"
+          f"磁盘读 {summary['read_bytes'] / mb:.1f} MB / 写 {summary['write_bytes'] / mb:.1f} MB，"
+          f"峰值文件数 {summary['peak_fds']}，峰值进程数 {summary['peak_processes']}")
+    print(f"   时间序列: {summary['series']}")
+
+# ==================== 多会话分片 ====================
+
+def open_session_shard(env: dict, session_id: str) -> Path:
+    """
+    准备 --session-id 指定的用户目录分片（共享配置只读叠加，状态文件独立）
+    返回: 分片目录
+    """
+    from session_shards import prepare_shard
+    try:
+        return prepare_shard(Path(env["CLAUDE_CONFIG_DIR"]), session_id)
+    except (OSError, ValueError, TimeoutError) as e:
+        print(f"❌ 错误：无法创建会话分片: {e}")
+        sys.exit(1)
+
+def close_session_shard(config_dir: Path, shard_dir: Path, process) -> None:
+    """
+    等待 Claude 退出后把分片中的历史记录和状态合并回共享用户目录
+    """
+    from session_shards import merge_shard, describe_merge
+    if process is not None and process.poll() is None:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    try:
+        print(describe_merge(shard_dir.name, merge_shard(config_dir, shard_dir)))
+    except (OSError, TimeoutError) as e:
+        print(f"⚠️  会话分片未能合并（稍后运行 python3 session_shards.py merge）: {e}")
+
+def run_parallel_sessions(env: dict, cmd: list, current_dir: Path, options: dict) -> int:
+    """
+    --sessions N：每个会话一个一次性分片，按 --session-parallel 限制并发
+    """
+    from session_shards import run_sessions
+    if not any(arg in ("-p", "--print") for arg in cmd):
+        print("❌ 错误：--sessions 只能用于非交互会话，请同时传入 -p/--print")
+        return 2
+    try:
+        count = int(options["sessions"])
+        parallel = int(options["session_parallel"] or min(count, os.cpu_count() or 1))
+    except ValueError:
+        print("❌ 错误：--sessions 和 --session-parallel 需要整数")
+        return 2
+    if count < 1 or parallel < 1:
+        print("❌ 错误：--sessions 和 --session-parallel 需要大于 0")
+        return 2
+    return run_sessions(env, cmd, current_dir, count, parallel)
+
 def get_claude_executable(venv_path: Path, bin_dir: Path, is_windows: bool) -> Path:
     """
     查找 Claude 可执行文件
@@ -81,8 +1469,19 @@ def get_claude_executable(venv_path: Path, bin_dir: Path, is_windows: bool) -> P
         return bin_dir / "claude"
 
 def main():
+    # 启动耗时追踪从这里开始计时（写入与否在解析完 .env 后决定）
+    trace = LaunchTrace(True)
+
     # 获取脚本所在目录（虚拟环境目录）
     script_dir = Path(__file__).parent.absolute()
+
+    # 拆分启动器参数，其余参数传给 Claude Code
+    launcher_options, claude_args = split_launcher_args(sys.argv[1:])
+    if launcher_options["launch_trace_report"]:
+        sys.exit(summarize_launch_traces(script_dir))
+    if launcher_options["doctor"]:
+        from doctor import run_doctor
+        sys.exit(run_doctor(script_dir))
     
     # 根据平台选择虚拟环境目录
     venv_name, bin_subdir, path_separator, is_windows = get_platform_info()
@@ -119,70 +1518,112 @@ def main():
             print("   npm install -g @anthropic-ai/claude-code")
         sys.exit(1)
     
-    # 设置环境变量
-    env = os.environ.copy()
-    
-    # 设置虚拟环境路径
-    env["VIRTUAL_ENV"] = str(venv_path)
+    trace.mark("checks")
 
-    # 设置仅对当前进程生效的 npm 环境（不写用户全局配置）
-    prepare_portable_npm_env(env, script_dir, venv_path)
-    
-    # 🔑 从 .env 文件读取环境变量（优先级最高）
-    env_file = script_dir / ".env"
-    if env_file.exists():
-        try:
-            with open(env_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    # 跳过注释和空行
-                    if line and not line.startswith('#'):
-                        # 解析 KEY=VALUE 格式
-                        if '=' in line:
-                            key, value = line.split('=', 1)
-                            env[key.strip()] = value.strip()
-        except Exception as e:
-            print(f"Warning: Failed to load .env file: {e}", file=sys.stderr)
-    
-    # 设置独立的 Claude 用户目录
-    # 如果 .env 中设置了 CLAUDE_CONFIG_DIR，判断是相对还是绝对路径
-    if "CLAUDE_CONFIG_DIR" in env:
-        config_dir_path = Path(env["CLAUDE_CONFIG_DIR"])
-        if not config_dir_path.is_absolute():
-            # 相对路径，相对于脚本目录
-            config_dir_path = script_dir / config_dir_path
-        env["CLAUDE_CONFIG_DIR"] = str(config_dir_path.absolute())
+    # 解析启动环境：输入文件未变化时直接使用上次保存的快照
+    snapshot = None
+    if not is_env_disabled(os.environ, "CLAUDE_VENV_SNAPSHOT"):
+        snapshot = load_launch_snapshot(script_dir, venv_name)
+    snapshot_hit = snapshot is not None
+    trace.mark("snapshot_load")
+    # 后台预热 / 清理进程由快照启动时拉起，继承了快照导出的变量，解析结果不能覆盖快照
+    background = launcher_options["readahead_warm"] or launcher_options["compile_cache_prune"]
+    if snapshot is None:
+        snapshot = resolve_launch_env(script_dir, venv_path, claude_bin, trace)
+        if background:
+            pass
+        elif is_env_disabled(os.environ, "CLAUDE_VENV_SNAPSHOT") or is_env_disabled(snapshot["set"], "CLAUDE_VENV_SNAPSHOT"):
+            remove_launch_snapshot(script_dir, venv_name)
+        else:
+            save_launch_snapshot(script_dir, venv_name, snapshot, venv_bin_dir, is_windows)
+        trace.mark("snapshot_save")
+
+    env = build_launch_env(snapshot, venv_path, venv_bin_dir, is_windows)
+    version = snapshot["version"]
+    env.pop("CLAUDE_VENV_TRACE_T0", None)
+
+    # 启动命令：镜像模式下用 node 直接运行解压后的入口脚本
+    image = snapshot.get("image")
+    if image:
+        launch_cmd = [image["node"], image["entry"]]
+        env["NODE_PATH"] = os.pathsep.join(filter(None, [image["node_path"], env.get("NODE_PATH")]))
     else:
-        # 默认值：claude-code-venv/.claude
-        claude_config_dir = script_dir / ".claude"
-        env["CLAUDE_CONFIG_DIR"] = str(claude_config_dir)
-    
-    # 🔑 从 settings.json 读取并导出 API 配置环境变量（作为备用）
-    settings_file = Path(env["CLAUDE_CONFIG_DIR"]) / "settings.json"
-    if settings_file.exists():
-        try:
-            import json
-            with open(settings_file, 'r') as f:
-                settings = json.load(f)
-                env_vars = settings.get('env', {})
-                for key, value in env_vars.items():
-                    # 如果 .env 中已经设置，则不覆盖
-                    if key not in env or not env[key]:
-                        env[key] = value
-        except Exception as e:
-            print(f"Warning: Failed to load settings.json: {e}", file=sys.stderr)
-    
-    # 更新 PATH，将虚拟环境路径放在最前面
-    prepend_venv_to_path(env, venv_path, venv_bin_dir, is_windows)
-    
-    # 创建独立的配置目录
-    Path(env["CLAUDE_CONFIG_DIR"]).mkdir(parents=True, exist_ok=True)
-    
-    # 读取版本号
-    version_file = script_dir / "VERSION"
-    version = "unknown"
-    if version_file.exists():
-        version = version_file.read_text(encoding='utf-8').strip()
+        launch_cmd = [str(claude_bin)]
+
+    # 只预热页缓存（由 run.sh 快速启动时在后台调用）
+    if launcher_options["readahead_warm"]:
+        paths = load_readahead_list(script_dir, venv_name, venv_path)
+        warm_page_cache(paths, get_readahead_threads(env))
+        sys.exit(0)
+
+    # 按预算清理编译缓存（由启动路径定期在后台调用）
+    if launcher_options["compile_cache_prune"]:
+        cache_root = get_compile_cache_root(script_dir, venv_name)
+        prune_compile_cache(cache_root, read_claude_version(venv_path), get_compile_cache_budget(env))
+        sys.exit(0)
+
+    # 资源策略：限制作用于启动器自身，Claude 及其子进程继承（cgroup 限制通过 systemd-run 包装启动命令）
+    if any(env.get(key) for key in RESOURCE_POLICY_KEYS):
+        from resource_policy import apply_resource_policy
+        launch_cmd = apply_resource_policy(env, launch_cmd)
+
+    # 学习模式需要等 Claude 退出后整理记录，不使用 exec 模式
+    learning = launcher_options["readahead_learn"]
+    if learning:
+        prepare_readahead_learn(env, script_dir, venv_name)
+
+    # 批量任务：所有任务共用这里解析好的启动环境
+    if claude_args[:1] == ["batch"]:
+        from batch_runner import run_batch
+        sys.exit(run_batch(env, launch_cmd, claude_args[1:], current_dir))
+
+    # 并发运行多个非交互会话，每个会话使用独立的用户目录分片
+    if launcher_options["sessions"]:
+        sys.exit(run_parallel_sessions(env, launch_cmd + claude_args, current_dir, launcher_options))
+
+    # 会话分片：run.py 常驻，Claude 退出后合并回共享用户目录，不使用 exec 模式
+    config_dir = Path(env["CLAUDE_CONFIG_DIR"])
+    shard_dir = None
+    if launcher_options["session_id"]:
+        shard_dir = open_session_shard(env, launcher_options["session_id"])
+        env["CLAUDE_CONFIG_DIR"] = str(shard_dir)
+
+    # 用户目录内存镜像：Claude 读写内存中的副本，run.py 常驻负责回写，不使用 exec 模式
+    # （会话分片只镜像共享目录会让链接失效，两者不同时使用）
+    mirror = None
+    if is_env_enabled(env, "CLAUDE_VENV_CONFIG_MIRROR") and not shard_dir:
+        mirror = open_config_mirror(env, script_dir)
+        if mirror:
+            env["CLAUDE_CONFIG_DIR"] = str(mirror.mirror_dir)
+        trace.mark("config_mirror")
+    if mirror or shard_dir:
+        for signum in ("SIGTERM", "SIGHUP"):
+            if hasattr(signal, signum):
+                signal.signal(getattr(signal, signum), exit_on_signal)
+
+    # 资源监控（--monitor 或 CLAUDE_VENV_MONITOR=1）：run.py 常驻采样，不使用 exec 模式
+    monitoring = launcher_options["monitor"] or is_env_enabled(env, "CLAUDE_VENV_MONITOR")
+    monitor = None
+
+    # 启动耗时追踪（--launch-trace 或 CLAUDE_VENV_LAUNCH_TRACE=1）
+    tracing = launcher_options["launch_trace"] or is_env_enabled(env, "CLAUDE_VENV_LAUNCH_TRACE")
+    trace_record = {}
+    if tracing:
+        trace_record = {
+            "id": f"{int(time.time() * 1000)}-{os.getpid()}",
+            "venv": venv_name,
+            "claude_version": read_claude_version(venv_path),
+            "snapshot_hit": snapshot_hit,
+            "storage": get_storage_info(script_dir),
+            "image": bool(image),
+            "config_mirror": bool(mirror),
+            "session_shard": bool(shard_dir),
+        }
+        if env.get("NODE_COMPILE_CACHE"):
+            files, size = get_dir_usage(Path(env["NODE_COMPILE_CACHE"]))
+            trace_record["compile_cache"] = {"dir": env["NODE_COMPILE_CACHE"], "files": files, "bytes": size}
+        prepare_trace_env(env, script_dir, trace_record["id"])
+    trace.mark("path")
     
     # 打印启动信息
     print("=" * 60)
@@ -191,24 +1632,70 @@ def main():
     print(f"📂 终端目录: {current_dir}")
     print(f"📍 脚本目录: {script_dir}")
     print(f"📦 虚拟环境: {venv_path}")
-    print(f"🗂️  用户目录: {env['CLAUDE_CONFIG_DIR']}")
-    print(f"🔧 Claude 路径: {claude_bin}")
+    if mirror:
+        print(f"🗂️  用户目录: {mirror.config_dir}（内存镜像 {mirror.mirror_dir}）")
+    elif shard_dir:
+        print(f"🗂️  用户目录: {config_dir}（会话分片 {shard_dir}）")
+    else:
+        print(f"🗂️  用户目录: {env['CLAUDE_CONFIG_DIR']}")
+    print(f"🔧 Claude 路径: {image['entry'] if image else claude_bin}")
     print("=" * 60)
     print()
+    trace.mark("banner")
     
     # 启动 Claude Code
+    process = None
     try:
-        # 传递命令行参数给 Claude Code
-        claude_args = sys.argv[1:] if len(sys.argv) > 1 else []
+        # exec 模式：Python 进程直接被 Claude 替换（失败时继续走下面的子进程模式）
+        # 后台预取是分离进程，需要在 exec 之前拉起，exec 之后仍会继续运行
+        prefetch_started = False
+        if can_exec(env, is_windows) and not (learning or mirror or shard_dir or monitoring):
+            start_update_prefetch(env, script_dir)
+            start_compile_cache_prune(env, script_dir, snapshot.get("compile_cache"))
+            prefetch_started = True
+            readahead = start_readahead(env, script_dir, venv_name, venv_path, detach=True)
+            if readahead:
+                trace_record["readahead"] = readahead
+            if tracing:
+                trace.mark("prefetch")
+                write_launch_trace(script_dir, trace, dict(trace_record, exec=True, spawn_at=time.time() * 1000))
+            exec_claude(launch_cmd + claude_args, env, current_dir)
         
+        # 页缓存预热与 Claude 启动并行
+        if not prefetch_started and not learning:
+            readahead = start_readahead(env, script_dir, venv_name, venv_path, detach=False)
+            if readahead:
+                trace_record["readahead"] = readahead
+            trace.mark("readahead")
+
         # 执行 Claude Code（工作目录为终端当前目录）
-        result = subprocess.run(
-            [str(claude_bin)] + claude_args,
+        spawn_at = time.time() * 1000
+        process = subprocess.Popen(
+            launch_cmd + claude_args,
             env=env,
             cwd=str(current_dir)
         )
+        trace.mark("spawn")
+        if monitoring:
+            monitor = start_process_monitor(env, config_dir, process.pid)
+        if tracing:
+            write_launch_trace(script_dir, trace, dict(trace_record, exec=False, spawn_at=spawn_at))
+
+        # Claude 已启动后再拉起后台预取，不增加启动延迟
+        if not prefetch_started:
+            start_update_prefetch(env, script_dir)
+            start_compile_cache_prune(env, script_dir, snapshot.get("compile_cache"))
+
+        try:
+            returncode = process.wait()
+        except KeyboardInterrupt:
+            process.kill()
+            raise
+
+        if learning:
+            finish_readahead_learn(script_dir, venv_name, venv_path)
         
-        sys.exit(result.returncode)
+        sys.exit(returncode)
         
     except KeyboardInterrupt:
         print("\n\n👋 Claude Code 已退出")
@@ -216,6 +1703,13 @@ def main():
     except Exception as e:
         print(f"\n❌ 错误：{e}")
         sys.exit(1)
+    finally:
+        if monitor:
+            finish_process_monitor(monitor)
+        if mirror:
+            close_config_mirror(mirror, process)
+        if shard_dir:
+            close_session_shard(config_dir, shard_dir, process)
 
 if __name__ == "__main__":
     main()
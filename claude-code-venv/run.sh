@@ -7,10 +7,10 @@ SYSTEM_NAME="$(uname -s)"
 
 case "$SYSTEM_NAME" in
     Darwin*)
-        PYTHON_EXE="$SCRIPT_DIR/venv_mac/bin/python"
+        VENV_NAME="venv_mac"
         ;;
     Linux*)
-        PYTHON_EXE="$SCRIPT_DIR/venv_linux/bin/python"
+        VENV_NAME="venv_linux"
         ;;
     *)
         echo "❌ 不支持的系统：$SYSTEM_NAME"
@@ -18,6 +18,8 @@ case "$SYSTEM_NAME" in
         ;;
 esac
 
+PYTHON_EXE="$SCRIPT_DIR/$VENV_NAME/bin/python"
+
 if [ ! -x "$PYTHON_EXE" ]; then
     echo "❌ 未找到对应虚拟环境：$PYTHON_EXE"
     echo
@@ -26,4 +28,47 @@ if [ ! -x "$PYTHON_EXE" ]; then
     exit 1
 fi
 
-exec "$PYTHON_EXE" "$SCRIPT_DIR/run.py" "$@"
\ No newline at end of file
+# 启动追踪的纳秒时间戳：BSD date（macOS）不支持 %N，改用 perl / python3
+trace_now() {
+    NOW="$(date +%s%N 2>/dev/null)"
+    case "$NOW" in
+        ""|*[!0-9]*)
+            NOW="$(perl -MTime::HiRes=time -e 'printf "%.0f", time() * 1e9' 2>/dev/null \
+                || python3 -c 'import time; print(time.time_ns())' 2>/dev/null)"
+            ;;
+    esac
+    echo "$NOW"
+}
+
+# run.py 自己处理的参数（启动追踪等）需要经过 Python，不走快速启动
+USE_SNAPSHOT=1
+[ "${CLAUDE_VENV_SNAPSHOT:-1}" = "0" ] && USE_SNAPSHOT=0
+case "${CLAUDE_VENV_LAUNCH_TRACE:-0}" in
+    1|true|yes|on) USE_SNAPSHOT=0; CLAUDE_VENV_TRACE_T0="$(trace_now)" ;;
+esac
+[ "${1-}" = "batch" ] && USE_SNAPSHOT=0
+for ARG in "$@"; do
+    case "$ARG" in
+        --) break ;;
+        --readahead-learn|--readahead-warm|--compile-cache-prune|--monitor|--doctor|\
+        --sessions|--sessions=*|--session-id|--session-id=*|--session-parallel|--session-parallel=*)
+            USE_SNAPSHOT=0
+            ;;
+        --launch-trace|--launch-trace-report)
+            USE_SNAPSHOT=0
+            CLAUDE_VENV_TRACE_T0="$(trace_now)"
+            ;;
+    esac
+done
+[ -n "${CLAUDE_VENV_TRACE_T0:-}" ] && export CLAUDE_VENV_TRACE_T0
+
+# 快速启动：run.py 保存的启动环境快照仍然有效时，直接 exec Claude，不启动 Python
+SNAPSHOT_FILE="$SCRIPT_DIR/.venv-state/launch-env-$VENV_NAME.sh"
+if [ "$USE_SNAPSHOT" = "1" ] && [ -f "$SNAPSHOT_FILE" ]; then
+    . "$SNAPSHOT_FILE"
+    if claude_venv_snapshot_valid; then
+        claude_venv_launch "$@"
+    fi
+fi
+
+exec "$PYTHON_EXE" "$SCRIPT_DIR/run.py" "$@"
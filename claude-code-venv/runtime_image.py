@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Claude Code 单文件运行镜像
+
+把虚拟环境中的 lib/node_modules/@anthropic-ai/claude-code 打包成一个不压缩、带索引的 zip 文件：
+- 便携盘（网络共享、FAT/exFAT U 盘）上只需顺序读取一个大文件，而不是打开上万个小文件
+- run.py 启动时把镜像解压到本机临时目录（按镜像 ID 缓存，只解压一次），再用 node 直接运行入口脚本
+- Claude Code 升级后 update.py 会自动重新打包
+
+使用方法：
+    python3 runtime_image.py pack                    # 为当前系统的虚拟环境打包镜像
+    python3 runtime_image.py pack --venv venv_win    # 指定虚拟环境
+    python3 runtime_image.py extract                 # 解压到本机缓存并输出入口路径
+    python3 runtime_image.py bench --runs 5          # 对比目录模式和镜像模式的冷启动耗时
+
+然后在 .env 中设置 CLAUDE_VENV_IMAGE=1 启用镜像启动。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+
+PACKAGE_NAME = "@anthropic-ai/claude-code"
+IMAGE_NAME = "claude-code.img"
+# 本机缓存中保留的已解压镜像数量
+KEEP_EXTRACTED = 3
+# 解压完成的标记文件（内容为镜像 ID）
+COMPLETE_MARKER = ".image-complete"
+
+
+def get_default_venv_name() -> str:
+    """根据当前系统返回默认虚拟环境目录名"""
+    system = platform.system()
+    if system == "Windows":
+        return "venv_win"
+    elif system == "Linux":
+        return "venv_linux"
+    return "venv_mac"
+
+
+def get_package_dir(venv_path: Path) -> Path:
+    """返回虚拟环境中 claude-code 包的目录（Unix 为 lib/node_modules，Windows 为 node_modules）"""
+    for modules_dir in ["lib/node_modules", "node_modules", "Lib/node_modules"]:
+        package_dir = venv_path / modules_dir / PACKAGE_NAME
+        if (package_dir / "package.json").exists():
+            return package_dir
+    return venv_path / "lib" / "node_modules" / PACKAGE_NAME
+
+
+def get_node_executable(venv_path: Path) -> Path:
+    """返回虚拟环境中的 node 可执行文件"""
+    if (venv_path / "Scripts" / "node.exe").exists():
+        return venv_path / "Scripts" / "node.exe"
+    return venv_path / "bin" / "node"
+
+
+def get_image_paths(venv_path: Path) -> tuple:
+    """返回 (镜像文件, 镜像清单) 路径"""
+    image = venv_path / IMAGE_NAME
+    return image, image.with_name(IMAGE_NAME + ".json")
+
+
+def get_image_cache_root() -> Path:
+    """
+    返回本机的镜像解压缓存目录（CLAUDE_VENV_IMAGE_CACHE 可覆盖）
+    默认在系统临时目录下，按用户区分
+    """
+    override = os.environ.get("CLAUDE_VENV_IMAGE_CACHE")
+    if override:
+        return Path(override).expanduser()
+    user = os.environ.get("USER") or os.environ.get("USERNAME") or "user"
+    return Path(tempfile.gettempdir()) / f"claude-code-venv-images-{user}"
+
+
+def read_package_entry(package_dir: Path) -> tuple:
+    """
+    读取包版本和 claude 命令的入口脚本（相对包目录）
+    返回: (version, entry)，入口不是 JS 文件时 entry 为 None
+    """
+    with open(package_dir / "package.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+    bin_field = data.get("bin")
+    entry = bin_field.get("claude") if isinstance(bin_field, dict) else bin_field
+    if not entry or not entry.endswith((".js", ".mjs", ".cjs")):
+        entry = None
+    return data.get("version", "unknown"), entry
+
+
+def read_manifest(venv_path: Path) -> dict:
+    """读取镜像清单，不存在或损坏时返回空字典"""
+    _, manifest_path = get_image_paths(venv_path)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def pack_image(venv_path: Path) -> dict:
+    """
+    把 claude-code 包打包成不压缩的 zip 镜像（按路径排序，内容顺序存放，解压时顺序读取）
+    返回: 镜像清单
+    """
+    package_dir = get_package_dir(venv_path)
+    version, entry = read_package_entry(package_dir)
+    if entry is None:
+        raise RuntimeError("当前版本的 claude 入口不是 JS 文件，无法使用镜像模式")
+
+    image_path, manifest_path = get_image_paths(venv_path)
+    tmp_path = image_path.with_name(image_path.name + ".tmp")
+    digest = hashlib.sha256()
+    files = 0
+    total = 0
+
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for current, dirs, names in os.walk(package_dir):
+            dirs.sort()
+            for name in sorted(names):
+                path = Path(current) / name
+                if path.is_symlink() or not path.is_file():
+                    continue
+                arcname = path.relative_to(package_dir).as_posix()
+                data = path.read_bytes()
+                info = zipfile.ZipInfo(arcname, date_time=(1980, 1, 1, 0, 0, 0))
+                info.external_attr = (path.stat().st_mode & 0o777) << 16
+                info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(info, data)
+                digest.update(arcname.encode("utf-8"))
+                digest.update(data)
+                files += 1
+                total += len(data)
+
+    os.replace(tmp_path, image_path)
+    manifest = {
+        "package": PACKAGE_NAME,
+        "version": version,
+        "entry": entry,
+        "image_id": f"{version}-{digest.hexdigest()[:16]}",
+        "files": files,
+        "bytes": total,
+        "packed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def prune_extracted(cache_root: Path, keep: str) -> None:
+    """只保留最近使用的几个已解压镜像"""
+    try:
+        entries = [p for p in cache_root.iterdir() if p.is_dir() and p.name != keep and not p.name.startswith(".")]
+    except OSError:
+        return
+    entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in entries[KEEP_EXTRACTED - 1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def extract_image(venv_path: Path, manifest: dict = None) -> Path:
+    """
+    确保镜像已解压到本机缓存，返回解压后的包目录
+    已解压时只需检查一次标记文件；首次解压顺序读取整个镜像，先写临时目录再重命名
+    """
+    manifest = manifest or read_manifest(venv_path)
+    image_id = manifest["image_id"]
+    cache_root = get_image_cache_root()
+    target = cache_root / image_id
+    marker = target / COMPLETE_MARKER
+    if marker.exists():
+        return target
+
+    image_path, _ = get_image_paths(venv_path)
+    cache_root.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{image_id}.", dir=str(cache_root)))
+    try:
+        # 一次性顺序读入镜像，避免在慢速介质上随机读取
+        with open(image_path, "rb", buffering=8 * 1024 * 1024) as f:
+            with zipfile.ZipFile(f) as zf:
+                for info in zf.infolist():
+                    dest = staging / info.filename
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    with zf.open(info) as src, open(dest, "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                    mode = (info.external_attr >> 16) & 0o777
+                    if mode:
+                        os.chmod(dest, mode)
+        (staging / COMPLETE_MARKER).write_text(image_id, encoding="utf-8")
+        try:
+            os.replace(staging, target)
+        except OSError:
+            # 其他进程已同时解压完成
+            if not marker.exists():
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    prune_extracted(cache_root, image_id)
+    return target
+
+
+def resolve_image_launch(venv_path: Path) -> tuple:
+    """
+    返回镜像模式的启动命令前缀 (node, 入口脚本)，镜像不可用或与已安装版本不一致时返回 None
+    """
+    manifest = read_manifest(venv_path)
+    image_path, _ = get_image_paths(venv_path)
+    if not manifest or not image_path.exists():
+        return None
+    try:
+        installed_version, _ = read_package_entry(get_package_dir(venv_path))
+    except (OSError, ValueError):
+        installed_version = None
+    if installed_version and installed_version != manifest.get("version"):
+        return None
+    package_dir = extract_image(venv_path, manifest)
+    return get_node_executable(venv_path), package_dir / manifest["entry"]
+
+
+# ==================== 冷启动对比 ====================
+
+def time_launch(cmd: list) -> float:
+    """运行命令并返回耗时（毫秒），失败时抛出异常"""
+    start = time.perf_counter()
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=120)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", errors="replace")[-300:])
+    return elapsed
+
+
+def bench_image(venv_path: Path, runs: int) -> dict:
+    """
+    对比三种情况下 claude --version 的耗时：
+    - directory: 从虚拟环境目录直接启动（冷缓存）
+    - image_cold: 从镜像启动，包括把镜像解压到本机（冷缓存、本机无解压副本）
+    - image_warm: 从镜像启动，本机已有解压副本（冷缓存）
+    """
+    # 与 update.py 的启动基准共用页缓存清除和统计方法（只在基准测试时导入，不影响启动）
+    from update import evict_page_cache, median
+
+    manifest = read_manifest(venv_path)
+    if not manifest:
+        manifest = pack_image(venv_path)
+    package_dir = get_package_dir(venv_path)
+    node = get_node_executable(venv_path)
+    image_path, _ = get_image_paths(venv_path)
+    extracted = get_image_cache_root() / manifest["image_id"]
+
+    can_evict = evict_page_cache([])
+    if not can_evict:
+        print("⚠️  当前平台不支持 posix_fadvise，无法清除页缓存，结果为热启动耗时")
+
+    results = {"directory": [], "image_cold": [], "image_warm": []}
+    for i in range(runs):
+        evict_page_cache([package_dir, node])
+        results["directory"].append(time_launch([str(node), str(package_dir / manifest["entry"]), "--version"]))
+
+        shutil.rmtree(extracted, ignore_errors=True)
+        evict_page_cache([image_path, node])
+        start = time.perf_counter()
+        _, entry = resolve_image_launch(venv_path)
+        extract_ms = (time.perf_counter() - start) * 1000
+        results["image_cold"].append(extract_ms + time_launch([str(node), str(entry), "--version"]))
+
+        evict_page_cache([extracted, node])
+        start = time.perf_counter()
+        _, entry = resolve_image_launch(venv_path)
+        check_ms = (time.perf_counter() - start) * 1000
+        results["image_warm"].append(check_ms + time_launch([str(node), str(entry), "--version"]))
+        print(f"   第 {i + 1}/{runs} 轮: 目录 {results['directory'][-1]:.0f} ms, "
+              f"镜像首次 {results['image_cold'][-1]:.0f} ms, 镜像 {results['image_warm'][-1]:.0f} ms")
+
+    return {name: round(median(values), 1) for name, values in results.items() if values}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Claude Code 单文件运行镜像",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python3 runtime_image.py pack
+  python3 runtime_image.py pack --venv venv_win
+  python3 runtime_image.py extract
+  python3 runtime_image.py bench --runs 5
+        """
+    )
+    parser.add_argument("command", choices=["pack", "extract", "bench"], help="pack 打包 / extract 解压 / bench 冷启动对比")
+    parser.add_argument("--venv", default=get_default_venv_name(), help="虚拟环境目录（默认当前系统）")
+    parser.add_argument("--runs", type=int, default=3, help="bench 的测量轮数（默认：3）")
+    args = parser.parse_args()
+
+    script_dir = Path(__file__).parent.absolute()
+    venv_path = script_dir / args.venv
+    if not get_package_dir(venv_path).exists():
+        print(f"❌ 错误：{venv_path} 中未安装 {PACKAGE_NAME}")
+        sys.exit(1)
+
+    try:
+        if args.command == "pack":
+            print(f"📦 打包 {get_package_dir(venv_path)} ...")
+            manifest = pack_image(venv_path)
+            print(f"✅ 镜像已生成: {get_image_paths(venv_path)[0]}")
+            print(f"   版本 {manifest['version']}，{manifest['files']} 个文件，{manifest['bytes'] / 1024 / 1024:.1f} MB")
+        elif args.command == "extract":
+            launch = resolve_image_launch(venv_path)
+            if launch is None:
+                print("❌ 镜像不存在或与已安装版本不一致，请先运行: python3 runtime_image.py pack")
+                sys.exit(1)
+            print(f"✅ 入口: {launch[1]}")
+        else:
+            print("=" * 60)
+            print(f"⏱️  冷启动对比（{args.runs} 轮）")
+            print("=" * 60)
+            result = bench_image(venv_path, max(1, args.runs))
+            print()
+            print(f"📂 目录模式:           {result['directory']:.1f} ms")
+            print(f"📦 镜像模式（首次解压）: {result['image_cold']:.1f} ms")
+            print(f"📦 镜像模式:           {result['image_warm']:.1f} ms")
+            print("=" * 60)
+    except Exception as e:
+        print(f"❌ 错误：{e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+Claude Code 多会话配置分片
+
+多个 Claude 会话共用一个 .claude 用户目录时，每个会话都会反复重写 .claude.json、
+追加 history.jsonl、刷新 stats-cache.json，在便携盘上互相等待文件锁。
+分片模式给每个会话一个独立的用户目录（分片）：
+- settings.json、CLAUDE.md、commands/、agents/、plugins/ 等共享配置以链接方式只读叠加
+- projects/、todos/ 中按会话 ID 命名的文件互不冲突，同样直接链接到共享目录
+- .claude.json、history.jsonl、stats-cache.json 每个分片各有一份副本，会话结束后合并回共享目录：
+  history.jsonl 只追加分片中新增的行，JSON 文件按三方合并（只写回分片中改过的键）
+
+分片位于用户目录旁边的 <用户目录>-sessions/<会话 ID>/。
+
+使用方法（通常通过 run.py 调用）：
+    ./run.sh --session-id work                      # 在名为 work 的分片中启动交互会话
+    ./run.sh --sessions 4 -p "总结 README"           # 并发运行 4 个非交互会话
+    ./run.sh --sessions 8 --session-parallel 2 -p "..."
+
+    python3 session_shards.py list                  # 查看分片
+    python3 session_shards.py merge                 # 手动合并所有分片（会话异常退出后）
+    python3 session_shards.py bench --writers 4     # 对比共享目录与分片目录的写入争用
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 以链接方式叠加到分片中的共享配置（不存在的跳过）
+SHARED_ENTRIES = (
+    "settings.json",
+    "CLAUDE.md",
+    ".credentials.json",
+    "commands",
+    "agents",
+    "skills",
+    "plugins",
+    "output-styles",
+    "projects",
+    "todos",
+)
+# 每个分片各有一份、结束后三方合并的 JSON 文件
+MERGED_JSON_FILES = (".claude.json", "stats-cache.json")
+# 每个分片各有一份、结束后追加合并的历史记录
+HISTORY_FILE = "history.jsonl"
+# 分片元数据（合并基线）
+SHARD_META = ".shard.json"
+SHARD_BASE_DIR = ".shard-base"
+# 大于此值的整数视为时间戳（秒或毫秒），合并时取较大值而不是累加
+TIMESTAMP_MIN = 10 ** 9
+# 合并锁超过此时间视为残留
+LOCK_STALE_SECONDS = 120
+# 会话 ID 只允许用作目录名的字符
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def get_shards_root(config_dir: Path) -> Path:
+    """返回用户目录对应的分片根目录"""
+    return config_dir.parent / f"{config_dir.name}-sessions"
+
+
+def read_json(path: Path, default=None):
+    """读取 JSON 文件，不存在或损坏时返回 default"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """原子写入 JSON 文件"""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(str(tmp), str(path))
+
+
+def copy_or_remove(src: Path, dst: Path) -> None:
+    """把 src 复制到 dst（src 不存在时删除 dst）"""
+    if src.is_file():
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(str(src), str(dst))
+    elif dst.exists():
+        dst.unlink()
+
+
+def link_entry(target: Path, link: Path) -> None:
+    """
+    创建指向共享配置的链接
+    Windows 没有创建符号链接的权限时，目录改用 junction、文件改用硬链接
+    """
+    try:
+        os.symlink(str(target), str(link), target_is_directory=target.is_dir())
+        return
+    except OSError:
+        if os.name != "nt":
+            raise
+    if target.is_dir():
+        import _winapi
+        _winapi.CreateJunction(str(target), str(link))
+    else:
+        os.link(str(target), str(link))
+
+
+# ==================== 合并 ====================
+
+def merge_json(base, shared, shard):
+    """
+    三方合并：只把分片相对基线改过的部分写回共享版本
+    - 字典逐键递归合并，分片删除且共享未改的键一并删除
+    - 两边都改过的列表取并集（共享的顺序在前）
+    - 两边都改过的整数：计数（如 numStartups）累加两边的增量，时间戳取较大值
+    - 其余值以分片为准
+    """
+    if shard == base:
+        return shared
+    if isinstance(shard, dict) and isinstance(shared, dict):
+        base = base if isinstance(base, dict) else {}
+        result = dict(shared)
+        for key in set(base) | set(shard):
+            if key not in shard:
+                if key in result and result[key] == base[key]:
+                    del result[key]
+            elif key not in base or shard[key] != base[key]:
+                result[key] = merge_json(base.get(key), shared.get(key), shard[key])
+        return result
+    if isinstance(shard, list) and isinstance(shared, list) and shared != base:
+        return shared + [item for item in shard if item not in shared]
+    # 两边都新增的整数键以 0 为基线
+    if base is None and shared is not None:
+        base = 0
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in (base, shared, shard)) \
+            and shared != base:
+        if shard > TIMESTAMP_MIN:
+            return max(shared, shard)
+        return shared + shard - base
+    return shard
+
+
+class MergeLock:
+    """
+    基于 O_EXCL 的合并锁，多个分片轮流写回共享目录
+    超过 LOCK_STALE_SECONDS 的锁视为残留并清除
+    """
+
+    def __init__(self, lock_file: Path):
+        self.lock_file = lock_file
+
+    def __enter__(self):
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                fd = os.open(str(self.lock_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, "w") as f:
+                    f.write(str(os.getpid()))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - self.lock_file.stat().st_mtime > LOCK_STALE_SECONDS:
+                        self.lock_file.unlink()
+                        continue
+                except OSError:
+                    continue
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"等待合并锁超时: {self.lock_file}")
+            time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        try:
+            self.lock_file.unlink()
+        except OSError:
+            pass
+
+
+def merge_history(shared_file: Path, shard_file: Path, offset: int) -> tuple:
+    """
+    把分片 history.jsonl 中 offset 之后的完整行追加到共享历史
+    返回: (新的 offset, 追加的行数)
+    """
+    try:
+        with open(shard_file, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return offset, 0
+    # 只合并完整的行，未写完的部分留到下次
+    end = data.rfind(b"\n") + 1
+    if end == 0:
+        return offset, 0
+    with open(shared_file, "ab") as f:
+        f.write(data[:end])
+    return offset + end, data[:end].count(b"\n")
+
+
+def merge_shard(config_dir: Path, shard_dir: Path) -> dict:
+    """
+    把分片中的历史记录和状态合并回共享用户目录，并把合并结果设为分片的新基线
+    返回: 合并统计
+    """
+    meta = read_json(shard_dir / SHARD_META, {})
+    base_dir = shard_dir / SHARD_BASE_DIR
+    stats = {"history": 0, "files": []}
+    with MergeLock(config_dir / ".shard-merge.lock"):
+        offset, stats["history"] = merge_history(config_dir / HISTORY_FILE, shard_dir / HISTORY_FILE,
+                                                 meta.get("history_offset", 0))
+        meta["history_offset"] = offset
+        for name in MERGED_JSON_FILES:
+            shard = read_json(shard_dir / name)
+            base = read_json(base_dir / name)
+            if shard is None or shard == base:
+                continue
+            merged = merge_json(base, read_json(config_dir / name), shard)
+            write_json_atomic(config_dir / name, merged)
+            shutil.copy2(str(shard_dir / name), str(base_dir / name))
+            stats["files"].append(name)
+    meta["merged_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    write_json_atomic(shard_dir / SHARD_META, meta)
+    return stats
+
+
+# ==================== 分片 ====================
+
+def prepare_shard(config_dir: Path, session_id: str) -> Path:
+    """
+    创建或刷新会话分片：链接共享配置，复制需要合并的文件并记录基线
+    已有分片会先合并上次遗留的改动，再从共享目录刷新副本
+    """
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError(f"会话 ID 只能包含字母、数字和 ._-: {session_id}")
+    config_dir.mkdir(parents=True, exist_ok=True)
+    shard_dir = get_shards_root(config_dir) / session_id
+    if (shard_dir / SHARD_META).exists():
+        merge_shard(config_dir, shard_dir)
+    base_dir = shard_dir / SHARD_BASE_DIR
+    base_dir.mkdir(parents=True, exist_ok=True)
+
+    for name in SHARED_ENTRIES:
+        target = config_dir / name
+        link = shard_dir / name
+        if name in ("projects", "todos"):
+            target.mkdir(exist_ok=True)
+        if not target.exists() or os.path.lexists(str(link)):
+            continue
+        link_entry(target, link)
+
+    with MergeLock(config_dir / ".shard-merge.lock"):
+        for name in MERGED_JSON_FILES:
+            copy_or_remove(config_dir / name, shard_dir / name)
+            copy_or_remove(config_dir / name, base_dir / name)
+        copy_or_remove(config_dir / HISTORY_FILE, shard_dir / HISTORY_FILE)
+    history = shard_dir / HISTORY_FILE
+    write_json_atomic(shard_dir / SHARD_META, {
+        "id": session_id,
+        "config_dir": str(config_dir),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "history_offset": history.stat().st_size if history.exists() else 0,
+    })
+    return shard_dir
+
+
+def is_link(path: Path) -> bool:
+    """判断是否为链接（符号链接或 Windows junction）"""
+    if path.is_symlink():
+        return True
+    # junction 是重解析点（FILE_ATTRIBUTE_REPARSE_POINT）
+    return bool(getattr(os.lstat(str(path)), "st_file_attributes", 0) & 0x400)
+
+
+def remove_shard(shard_dir: Path) -> None:
+    """删除分片（只删除链接本身，不影响共享目录）"""
+    for entry in shard_dir.iterdir():
+        if is_link(entry):
+            if entry.is_dir() and not entry.is_symlink():
+                os.rmdir(str(entry))
+            else:
+                entry.unlink()
+        elif entry.is_dir():
+            shutil.rmtree(str(entry))
+        else:
+            entry.unlink()
+    shard_dir.rmdir()
+
+
+def describe_merge(session_id: str, stats: dict) -> str:
+    parts = []
+    if stats["history"]:
+        parts.append(f"{stats['history']} 条历史记录")
+    if stats["files"]:
+        parts.append("、".join(stats["files"]))
+    return f"🔀 分片 {session_id} 已合并: {'，'.join(parts) if parts else '无改动'}"
+
+
+def run_sessions(env: dict, cmd: list, cwd: Path, count: int, parallel: int) -> int:
+    """
+    并发运行 count 个非交互会话，同时运行的数量不超过 parallel
+    每个会话使用一次性分片，输出写入分片的 session.log，结束后合并并删除分片
+    返回: 最大的退出码
+    """
+    config_dir = Path(env["CLAUDE_CONFIG_DIR"])
+    batch = time.strftime("%Y%m%d-%H%M%S")
+    log_dir = get_shards_root(config_dir) / f"run-{batch}-logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    def run_one(index: int) -> tuple:
+        session_id = f"run-{batch}-{index}"
+        shard_dir = prepare_shard(config_dir, session_id)
+        log_file = log_dir / f"{index}.log"
+        start = time.monotonic()
+        try:
+            with open(log_file, "wb") as log:
+                returncode = subprocess.call(cmd, env=dict(env, CLAUDE_CONFIG_DIR=str(shard_dir)),
+                                             cwd=str(cwd), stdin=subprocess.DEVNULL,
+                                             stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            stats = merge_shard(config_dir, shard_dir)
+            remove_shard(shard_dir)
+        return index, returncode, time.monotonic() - start, log_file, stats
+
+    print(f"🧩 并发运行 {count} 个会话（同时最多 {parallel} 个），日志目录: {log_dir}")
+    worst = 0
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [pool.submit(run_one, index) for index in range(1, count + 1)]
+        for future in as_completed(futures):
+            index, returncode, seconds, log_file, stats = future.result()
+            mark = "✅" if returncode == 0 else "❌"
+            print(f"{mark} 会话 {index}: 退出码 {returncode}，{seconds:.1f}s，"
+                  f"{stats['history']} 条历史记录 → {log_file.name}")
+            worst = max(worst, returncode)
+    return worst
+
+
+# ==================== 争用基准 ====================
+
+def bench_writer(directory: str, ops: int, queue) -> None:
+    """
+    模拟 Claude 的写入模式：加锁重写 .claude.json、刷新 stats-cache.json、追加 history.jsonl
+    锁与 Claude 使用的 proper-lockfile 一致，以 mkdir 原子创建
+    """
+    root = Path(directory)
+    lock_dir = root / ".claude.json.lock"
+    latencies = []
+    waited = 0.0
+    for index in range(ops):
+        start = time.perf_counter()
+        while True:
+            try:
+                os.mkdir(str(lock_dir))
+                break
+            except FileExistsError:
+                time.sleep(0.001)
+        locked = time.perf_counter()
+        waited += locked - start
+        try:
+            for name in MERGED_JSON_FILES:
+                data = read_json(root / name, {})
+                data[f"pid-{os.getpid()}"] = index
+                data["lastUpdate"] = time.time()
+                write_json_atomic(root / name, data)
+        finally:
+            os.rmdir(str(lock_dir))
+        with open(root / HISTORY_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"display": f"prompt {index}", "timestamp": time.time()}) + "\n")
+        latencies.append(time.perf_counter() - start)
+    queue.put((latencies, waited))
+
+
+def run_bench_case(dirs: list, ops: int) -> dict:
+    """让每个写入进程写各自的目录（dirs 中可以重复，表示共享），返回吞吐和延迟"""
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=bench_writer, args=(str(d), ops, queue)) for d in dirs]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(value for result, _ in results for value in result)
+    return {
+        "ops": len(latencies),
+        "seconds": elapsed,
+        "latencies": latencies,
+        "lock_wait": sum(waited for _, waited in results),
+    }
+
+
+def run_contention_bench(config_dir: Path, writers: int, ops: int) -> int:
+    """在用户目录所在的磁盘上对比共享目录与分片目录的写入争用"""
+    from update import percentile
+
+    parent = config_dir.parent
+    parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=".shard-bench-", dir=str(parent)) as tmp:
+        shared = Path(tmp) / "shared"
+        shared.mkdir()
+        shards = [Path(tmp) / f"shard-{index}" for index in range(writers)]
+        for shard in shards:
+            shard.mkdir()
+
+        print("=" * 60)
+        print(f"⏱️  写入争用基准: {writers} 个会话 × {ops} 次写入（{parent}）")
+        print("=" * 60)
+        results = {}
+        for label, dirs in (("共享目录", [shared] * writers), ("分片目录", shards)):
+            result = run_bench_case(dirs, ops)
+            results[label] = result
+            latencies = result["latencies"]
+            print(f"📊 {label}: {result['ops'] / result['seconds']:.0f} 次/秒，"
+                  f"p50 {percentile(latencies, 50) * 1000:.1f}ms，"
+                  f"p95 {percentile(latencies, 95) * 1000:.1f}ms，"
+                  f"锁等待 {result['lock_wait']:.2f}s")
+    shared_rate = results["共享目录"]["ops"] / results["共享目录"]["seconds"]
+    sharded_rate = results["分片目录"]["ops"] / results["分片目录"]["seconds"]
+    print(f"📈 分片后吞吐为共享目录的 {sharded_rate / shared_rate:.1f} 倍")
+    return 0
+
+
+# ==================== 命令行 ====================
+
+def get_default_config_dir(script_dir: Path) -> Path:
+    """按 run.py 的规则解析用户目录（.env > 环境变量 > 默认 .claude）"""
+    from run import load_env_file, resolve_config_dir
+    value = load_env_file(script_dir / ".env").get("CLAUDE_CONFIG_DIR") or os.environ.get("CLAUDE_CONFIG_DIR")
+    return resolve_config_dir(value, script_dir)
+
+
+def iter_shards(config_dir: Path):
+    root = get_shards_root(config_dir)
+    if not root.is_dir():
+        return
+    for shard_dir in sorted(root.iterdir()):
+        if (shard_dir / SHARD_META).exists():
+            yield shard_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Claude Code 多会话配置分片",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python3 session_shards.py list
+  python3 session_shards.py merge
+  python3 session_shards.py bench --writers 8 --ops 200
+        """
+    )
+    parser.add_argument("command", choices=["list", "merge", "bench"],
+                        help="list 查看分片 / merge 合并所有分片 / bench 写入争用基准")
+    parser.add_argument("--config-dir", help="用户目录（默认按 .env 中的 CLAUDE_CONFIG_DIR）")
+    parser.add_argument("--writers", type=int, default=4, help="bench 的并发会话数（默认 4）")
+    parser.add_argument("--ops", type=int, default=100, help="bench 中每个会话的写入次数（默认 100）")
+    args = parser.parse_args()
+
+    script_dir = Path(__file__).parent.absolute()
+    config_dir = Path(args.config_dir).absolute() if args.config_dir else get_default_config_dir(script_dir)
+
+    if args.command == "bench":
+        return run_contention_bench(config_dir, max(1, args.writers), max(1, args.ops))
+
+    found = False
+    for shard_dir in iter_shards(config_dir):
+        found = True
+        meta = read_json(shard_dir / SHARD_META, {})
+        if args.command == "merge":
+            print(describe_merge(shard_dir.name, merge_shard(config_dir, shard_dir)))
+        else:
+            print(f"🧩 {shard_dir.name}: 创建于 {meta.get('created_at')}，"
+                  f"最近合并 {meta.get('merged_at') or '无'}")
+    if not found:
+        print(f"暂无会话分片（{get_shards_root(config_dir)}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
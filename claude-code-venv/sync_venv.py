@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+便携虚拟环境增量同步脚本
+
+把一个已升级的便携目录同步到其他副本，只传输真正变化的内容：
+- 比较源和目标虚拟环境中每个文件的内容哈希（持久化索引，未变化的文件不重复计算）
+- 只写入新增或变化的文件（整文件复制：两端都是本地路径或挂载的共享盘，
+  块级增量需要先读旧文件再写完整的新文件，I/O 反而比直接复制多，与 rsync 对本地路径的处理一致）
+- 所有文件先写入临时文件，再统一原子替换；中途中断时下次运行会继续完成
+- 同步完成后修复绝对路径（与 build_venv.py 相同的可移植性修复）
+
+使用方法：
+    python3 sync_venv.py /path/to/source/claude-code-venv /mnt/share/claude-code-venv
+    python3 sync_venv.py SOURCE TARGET --venv venv_win      # 指定虚拟环境（默认当前系统）
+    python3 sync_venv.py SOURCE TARGET --dry-run            # 只显示将要写入的内容
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+from pathlib import Path
+
+# 同步时跳过的目录和文件后缀（可再生的缓存）
+SKIP_DIRS = {"__pycache__"}
+SKIP_SUFFIXES = (".pyc",)
+# 暂存文件后缀
+TEMP_SUFFIX = ".sync-tmp"
+# 虚拟环境目录与 build_venv.py 平台标识的对应关系
+VENV_PLATFORM_KEYS = {"venv_mac": "mac", "venv_linux": "linux", "venv_win": "win"}
+
+
+def get_default_venv_name() -> str:
+    """根据当前系统返回默认虚拟环境目录名"""
+    system = platform.system()
+    if system == "Windows":
+        return "venv_win"
+    elif system == "Linux":
+        return "venv_linux"
+    return "venv_mac"
+
+
+def get_state_dir(root: Path) -> Path:
+    """返回便携目录内保存工具状态的目录"""
+    return root / ".venv-state"
+
+
+def hash_file(path: Path) -> str:
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ==================== 清单与索引 ====================
+
+def load_index(index_file: Path) -> dict:
+    """读取持久化索引: {相对路径: 条目}"""
+    try:
+        with open(index_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(index_file: Path, manifest: dict) -> None:
+    """原子写入索引"""
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = index_file.with_suffix(".tmp")
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_file, index_file)
+
+
+def build_manifest(venv_dir: Path, index: dict, hash_files: bool = True, leftovers: list = None) -> dict:
+    """
+    扫描虚拟环境，生成 {相对路径: 条目} 清单
+    条目: {"type": "file", "size", "mtime_ns", "mode", "hash"} 或 {"type": "link", "target"}
+    索引中 size 和 mtime_ns 未变化的文件直接复用旧哈希
+    hash_files 为 False 时只在索引命中时填写哈希（其余为 None，按需再计算）
+    leftovers 不为 None 时收集上次中断残留的临时文件
+    """
+    manifest = {}
+    stack = [venv_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            rel = Path(entry.path).relative_to(venv_dir).as_posix()
+            if entry.is_symlink():
+                manifest[rel] = {"type": "link", "target": os.readlink(entry.path)}
+            elif entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    stack.append(Path(entry.path))
+            elif entry.name.endswith(TEMP_SUFFIX):
+                if leftovers is not None:
+                    leftovers.append(Path(entry.path))
+            elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(SKIP_SUFFIXES):
+                st = entry.stat(follow_symlinks=False)
+                item = {
+                    "type": "file",
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "mode": stat.S_IMODE(st.st_mode),
+                    "hash": None,
+                }
+                cached = index.get(rel)
+                if cached and cached.get("size") == st.st_size and cached.get("mtime_ns") == st.st_mtime_ns:
+                    item["hash"] = cached.get("hash")
+                elif hash_files:
+                    item["hash"] = hash_file(Path(entry.path))
+                manifest[rel] = item
+    return manifest
+
+
+def diff_manifests(source: dict, target: dict, target_dir: Path) -> tuple:
+    """
+    比较源和目标清单
+    返回: (新增列表, 变化列表, 删除列表)
+    目标索引中有哈希时直接比较哈希（记录的是同步时源文件的哈希，路径修复后的文件不会被误判为变化）；
+    没有哈希时大小不同即视为变化，大小相同才读取目标文件计算
+    """
+    added, changed, removed = [], [], []
+    for rel, item in source.items():
+        other = target.get(rel)
+        if other is None:
+            added.append(rel)
+        elif item["type"] != other["type"]:
+            changed.append(rel)
+        elif item["type"] == "link":
+            if item["target"] != other["target"]:
+                changed.append(rel)
+        elif other["hash"] is None and item["size"] != other["size"]:
+            changed.append(rel)
+        else:
+            if other["hash"] is None:
+                other["hash"] = hash_file(target_dir / rel)
+            if item["hash"] != other["hash"]:
+                changed.append(rel)
+    for rel in target:
+        if rel not in source:
+            removed.append(rel)
+    return added, changed, sorted(removed, reverse=True)
+
+
+# ==================== 暂存与原子提交 ====================
+
+def temp_path_for(path: Path) -> Path:
+    return path.with_name(f".{path.name}{TEMP_SUFFIX}")
+
+
+def stage_file(source_file: Path, target_file: Path) -> tuple:
+    """
+    把源文件暂存到目标目录中的临时文件
+    返回: (临时文件路径, 写入字节数)
+    """
+    target_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = temp_path_for(target_file)
+    shutil.copyfile(source_file, temp_file)
+    shutil.copystat(source_file, temp_file)
+    return temp_file, temp_file.stat().st_size
+
+
+def write_journal(journal_file: Path, renames: list, removals: list) -> None:
+    journal_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(journal_file, "w", encoding="utf-8") as f:
+        json.dump({"renames": renames, "removals": removals}, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def commit_journal(journal_file: Path) -> int:
+    """
+    按日志完成替换和删除（可重复执行，用于中断后的恢复）
+    返回: 完成的替换数量
+    """
+    with open(journal_file, "r", encoding="utf-8") as f:
+        journal = json.load(f)
+
+    committed = 0
+    for temp_file, final_file, link_target in journal["renames"]:
+        final_path = Path(final_file)
+        if link_target is not None:
+            if final_path.is_symlink() or final_path.exists():
+                if final_path.is_dir() and not final_path.is_symlink():
+                    shutil.rmtree(final_path)
+                else:
+                    final_path.unlink()
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+            os.symlink(link_target, final_path)
+            committed += 1
+        elif Path(temp_file).exists():
+            if final_path.is_dir() and not final_path.is_symlink():
+                shutil.rmtree(final_path)
+            os.replace(temp_file, final_path)
+            committed += 1
+
+    for removal in journal["removals"]:
+        path = Path(removal)
+        if path.is_symlink() or path.is_file():
+            path.unlink()
+        # 删除因此变空的目录
+        parent = path.parent
+        try:
+            while parent.exists() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        except OSError:
+            pass
+
+    journal_file.unlink()
+    return committed
+
+
+# ==================== 路径修复 ====================
+
+def fix_relocated_paths(files: list, source_root: Path, target_root: Path) -> int:
+    """
+    把传输的文本文件中残留的源目录绝对路径替换为目标目录
+    返回: 修复的文件数量
+    """
+    old = str(source_root).encode()
+    new = str(target_root).encode()
+    fixed = 0
+    for path in files:
+        try:
+            content = path.read_bytes()
+        except OSError:
+            continue
+        # 含 NUL 的视为二进制文件，跳过
+        if b"\0" in content[:8192] or old not in content:
+            continue
+        path.write_bytes(content.replace(old, new))
+        fixed += 1
+    return fixed
+
+
+def run_builder_fixups(target_root: Path, venv_name: str) -> None:
+    """复用 build_venv.py 的可移植性修复（activate 脚本、shebang）"""
+    platform_key = VENV_PLATFORM_KEYS.get(venv_name)
+    if platform_key is None:
+        return
+    sys.path.insert(0, str(Path(__file__).parent.absolute()))
+    from build_venv import VenvBuilder
+    VenvBuilder(target_root).fix_absolute_paths(platform_key)
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} TB"
+
+
+# ==================== 主流程 ====================
+
+def sync_venv(source_root: Path, target_root: Path, venv_name: str, dry_run: bool = False) -> bool:
+    """
+    把源便携目录的虚拟环境增量同步到目标便携目录
+    返回: 是否成功
+    """
+    source_dir = source_root / venv_name
+    target_dir = target_root / venv_name
+    source_index_file = get_state_dir(source_root) / f"sync-index-{venv_name}.json"
+    target_index_file = get_state_dir(target_root) / f"sync-index-{venv_name}.json"
+    journal_file = get_state_dir(target_root) / f"sync-journal-{venv_name}.json"
+
+    print("=" * 70)
+    print("🔁 便携虚拟环境增量同步")
+    print("=" * 70)
+    print(f"📤 源: {source_dir}")
+    print(f"📥 目标: {target_dir}")
+    print("=" * 70)
+
+    if not source_dir.is_dir():
+        print(f"❌ 源虚拟环境不存在: {source_dir}")
+        return False
+
+    # 上次同步中断时，先完成未提交的替换
+    if journal_file.exists() and not dry_run:
+        print("⚠️  发现未完成的同步，正在恢复...")
+        commit_journal(journal_file)
+
+    start = time.perf_counter()
+    print("🔍 扫描源虚拟环境...")
+    source_manifest = build_manifest(source_dir, load_index(source_index_file))
+    print("🔍 扫描目标虚拟环境...")
+    leftovers = []
+    target_manifest = build_manifest(target_dir, load_index(target_index_file), hash_files=False,
+                                     leftovers=leftovers) if target_dir.exists() else {}
+    # 日志写入前中断的同步会留下未提交的临时文件
+    if leftovers and not dry_run:
+        for temp_file in leftovers:
+            try:
+                temp_file.unlink()
+            except OSError:
+                pass
+        print(f"🧹 清理上次中断残留的临时文件: {len(leftovers)} 个")
+    added, changed, removed = diff_manifests(source_manifest, target_manifest, target_dir)
+    scan_seconds = time.perf_counter() - start
+
+    changed_bytes = sum(source_manifest[rel].get("size", 0) for rel in added + changed)
+    print(f"📊 新增 {len(added)}，变化 {len(changed)}，删除 {len(removed)}（扫描耗时 {scan_seconds:.1f}s）")
+    print(f"📦 变化文件总大小: {format_size(changed_bytes)}")
+
+    if dry_run:
+        for label, items in (("+", added), ("~", changed), ("-", removed)):
+            for rel in items[:50]:
+                print(f"   {label} {rel}")
+            if len(items) > 50:
+                print(f"   ... 还有 {len(items) - 50} 项")
+        return True
+
+    if not (added or changed or removed):
+        save_index(source_index_file, source_manifest)
+        print("✅ 目标已是最新，无需同步")
+        return True
+
+    # 1. 暂存所有文件
+    renames = []
+    written = 0
+    staged_files = []
+    for rel in added + changed:
+        item = source_manifest[rel]
+        final_path = target_dir / rel
+        if item["type"] == "link":
+            renames.append([None, str(final_path), item["target"]])
+            continue
+        temp_file, size = stage_file(source_dir / rel, final_path)
+        renames.append([str(temp_file), str(final_path), None])
+        staged_files.append(temp_file)
+        written += size
+
+    # 2. 在提交前修复临时文件中的源目录路径（避免目标出现中间状态）
+    fixed = fix_relocated_paths(staged_files, source_root, target_root)
+
+    # 3. 写日志并原子提交
+    write_journal(journal_file, renames, [str(target_dir / rel) for rel in removed])
+    commit_journal(journal_file)
+
+    # 4. 可移植性修复并更新索引
+    run_builder_fixups(target_root, venv_name)
+    for name in ("VERSION",):
+        if (source_root / name).is_file():
+            shutil.copy2(source_root / name, target_root / name)
+
+    # 目标索引记录源文件的哈希和目标文件当前的 size/mtime，下次扫描时无需读取目标内容
+    target_index = {
+        rel: item for rel, item in target_manifest.items()
+        if rel not in removed and (item["type"] == "link" or item["hash"])
+    }
+    for rel in added + changed:
+        item = dict(source_manifest[rel])
+        if item["type"] == "file":
+            st = (target_dir / rel).stat()
+            item["size"], item["mtime_ns"] = st.st_size, st.st_mtime_ns
+        target_index[rel] = item
+    save_index(source_index_file, source_manifest)
+    save_index(target_index_file, target_index)
+
+    total_seconds = time.perf_counter() - start
+    print()
+    print("=" * 70)
+    print("✅ 同步完成")
+    print("=" * 70)
+    print(f"📦 实际写入: {format_size(written)}（{len(staged_files)} 个文件）")
+    print(f"🔧 路径修复: {fixed} 个文件")
+    print(f"⏱️  总耗时: {total_seconds:.1f}s")
+    print("=" * 70)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="便携虚拟环境增量同步",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python3 sync_venv.py ./claude-code-venv /mnt/share/claude-code-venv
+  python3 sync_venv.py SOURCE TARGET --venv venv_win
+  python3 sync_venv.py SOURCE TARGET --dry-run
+        """
+    )
+    parser.add_argument("source", help="已升级的源便携目录")
+    parser.add_argument("target", help="要更新的目标便携目录")
+    parser.add_argument("--venv", default=get_default_venv_name(), help="要同步的虚拟环境目录（默认当前系统）")
+    parser.add_argument("--dry-run", action="store_true", help="只显示变化，不写入目标")
+    args = parser.parse_args()
+
+    source_root = Path(args.source).expanduser().absolute()
+    target_root = Path(args.target).expanduser().absolute()
+    if source_root == target_root:
+        print("❌ 源和目标不能相同")
+        sys.exit(1)
+
+    success = sync_venv(source_root, target_root, args.venv, args.dry_run)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,8 +15,18 @@ import sys
 import subprocess
 import platform
 import json
+import math
+import time
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 def get_platform_info() -> tuple:
     """
@@ -86,13 +96,17 @@ def get_portable_npm_paths(script_dir: Path) -> tuple[Path, Path]:
     """
     返回项目内专用 npm 配置路径，避免读写用户全局配置
     """
-    return script_dir / ".npmrc.portable", script_dir / ".npm-cache"
+    from cache_location import get_cache_root
+    return script_dir / ".npmrc.portable", get_cache_root(script_dir) / ".npm-cache"
 
-def prepare_portable_npm_env(env: dict, script_dir: Path, venv_path: Path) -> None:
+def prepare_portable_npm_env(env: dict, script_dir: Path, venv_path: Path, npm_cache_dir: Path = None) -> None:
     """
     设置仅对当前进程生效的 npm 环境变量
+    npm_cache_dir: 可选，覆盖默认缓存目录（批量升级时多个副本共享同一个下载缓存）
     """
-    npm_userconfig, npm_cache_dir = get_portable_npm_paths(script_dir)
+    npm_userconfig, default_cache_dir = get_portable_npm_paths(script_dir)
+    if npm_cache_dir is None:
+        npm_cache_dir = default_cache_dir
     npm_cache_dir.mkdir(parents=True, exist_ok=True)
     npm_userconfig.touch(exist_ok=True)
 
@@ -103,6 +117,22 @@ def prepare_portable_npm_env(env: dict, script_dir: Path, venv_path: Path) -> No
     env["NPM_CONFIG_FUND"] = "false"
     env["NPM_CONFIG_AUDIT"] = "false"
 
+def get_state_dir(script_dir: Path) -> Path:
+    """
+    返回便携目录内保存工具状态（预取记录、锁文件等）的目录
+    """
+    return script_dir / ".venv-state"
+
+def read_prefetch_state(script_dir: Path) -> dict:
+    """
+    读取后台预取记录，不存在或损坏时返回空字典
+    """
+    try:
+        with open(get_state_dir(script_dir) / "prefetch.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
 def run_command(cmd: list, env: dict, cwd: Path = None, timeout: int = None, show_output: bool = False) -> tuple:
     """
     执行命令并返回结果
@@ -167,11 +197,430 @@ def get_npm_package_version(package_name: str, env: dict) -> str:
     
     return "未安装"
 
-def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name: str, package_name: str) -> bool:
+def build_venv_env(script_dir: Path, venv_name: str, bin_subdir: str, npm_cache_dir: Path = None) -> dict:
+    """
+    构建指定虚拟环境的 npm 运行环境变量
+    """
+    venv_path = script_dir / venv_name
+    venv_bin_dir = venv_path / bin_subdir
+    is_windows = (venv_name == "venv_win")
+
+    env = os.environ.copy()
+    env["VIRTUAL_ENV"] = str(venv_path)
+    prepare_portable_npm_env(env, script_dir, venv_path, npm_cache_dir)
+    update_env_path(env, venv_path, venv_bin_dir, is_windows)
+    return env
+
+def read_installed_version(venv_path: Path, package_name: str) -> str:
+    """
+    直接读取全局 node_modules 中的 package.json 获取已安装版本
+    比 `npm list -g` 快得多（无需启动 node），读取失败时返回 None
+    """
+    # Unix 下位于 lib/node_modules，Windows 下 npm prefix 模式位于 node_modules 或 Lib/node_modules
+    for modules_dir in ["lib/node_modules", "node_modules", "Lib/node_modules"]:
+        package_json = venv_path / modules_dir / package_name / "package.json"
+        try:
+            with open(package_json, 'r', encoding='utf-8') as f:
+                return json.load(f).get("version") or None
+        except (OSError, ValueError):
+            continue
+    return None
+
+def get_latest_version(package_name: str, env: dict) -> str:
+    """
+    查询 npm 仓库中的最新版本，优先 npm view，失败时回退到 npm outdated
+    """
+    returncode, stdout, stderr = run_command(
+        ["npm", "view", package_name, "version"],
+        env,
+        timeout=60
+    )
+
+    if returncode == 0 and stdout:
+        return stdout.strip()
+
+    returncode, stdout, stderr = run_command(
+        ["npm", "outdated", "-g", package_name, "--json"],
+        env,
+        timeout=60
+    )
+
+    if stdout:
+        try:
+            data = json.loads(stdout)
+            if package_name in data:
+                return data[package_name].get("latest", "unknown")
+        except:
+            pass
+
+    return "unknown"
+
+# ==================== 升级历史记录 ====================
+
+# 历史记录中统计的阶段（按流程顺序）
+HISTORY_PHASES = ["probe", "registry", "install", "verify", "bench"]
+
+def new_history_record(kind: str, venv_name: str) -> dict:
+    """
+    创建一条历史记录
+    kind: check / upgrade / fleet-upgrade / prefetch
+    """
+    return {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "kind": kind,
+        "venv": venv_name,
+        "host": platform.node(),
+        "before": None,
+        "after": None,
+        "latest": None,
+        "phases": {},
+        "bytes_downloaded": None,
+        "status": "unknown",
+    }
+
+def append_history(script_dir: Path, record: dict) -> None:
+    """
+    追加一条历史记录到 .venv-state/update-history.jsonl（只追加，不改写）
+    写入失败不影响升级流程
+    """
+    try:
+        state_dir = get_state_dir(script_dir)
+        state_dir.mkdir(parents=True, exist_ok=True)
+        with open(state_dir / "update-history.jsonl", 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"⚠️  写入升级历史失败: {e}")
+
+def load_history(script_dir: Path) -> List[dict]:
+    """
+    读取全部历史记录，跳过损坏的行
+    """
+    records = []
+    try:
+        with open(get_state_dir(script_dir) / "update-history.jsonl", 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return records
+
+def get_cache_content_size(npm_cache_dir: Path) -> int:
+    """
+    统计 npm 缓存中已下载内容的总大小（_cacache/content-v2），用于估算下载字节数
+    需要遍历整个缓存目录，缓存较大或在慢速介质上时耗时明显，只在 --measure-download 时使用
+    """
+    total = 0
+    stack = [str(npm_cache_dir / "_cacache" / "content-v2")]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return total
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    计算百分位数（最近秩法）
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+def show_history(script_dir: Path, limit: int = 0) -> None:
+    """
+    汇总显示历史记录：各类操作的成功率、各阶段耗时中位数/P90、下载量及按月趋势
+    """
+    records = load_history(script_dir)
+    if limit:
+        records = records[-limit:]
+
+    print("=" * 70)
+    print("📈 升级历史")
+    print("=" * 70)
+    print(f"📄 记录文件: {get_state_dir(script_dir) / 'update-history.jsonl'}")
+    if not records:
+        print("暂无记录")
+        return
+    print(f"📊 共 {len(records)} 条记录（{records[0]['ts']} ~ {records[-1]['ts']}）")
+
+    kinds = {}
+    for record in records:
+        kinds.setdefault(record.get("kind", "unknown"), []).append(record)
+
+    for kind, items in kinds.items():
+        success = sum(1 for r in items if r.get("status") in ("success", "up-to-date", "outdated", "prefetched", "upgraded"))
+        print()
+        print(f"🔹 {kind}: {len(items)} 次，成功 {success} 次")
+
+        medians = {}
+        for phase in HISTORY_PHASES:
+            values = [r.get("phases", {}).get(phase) for r in items]
+            if any(v is not None for v in values):
+                medians[phase] = percentile(values, 50)
+                print(f"   {phase:<9} 中位数 {medians[phase]:.2f}s  P90 {percentile(values, 90):.2f}s")
+
+        total = sum(medians.values())
+        if total:
+            dominant = max(medians, key=medians.get)
+            print(f"   耗时占比最高的阶段: {dominant}（{medians[dominant] / total * 100:.0f}%）")
+
+        downloaded = [r.get("bytes_downloaded") for r in items if r.get("bytes_downloaded")]
+        if downloaded:
+            print(f"   下载量中位数: {percentile(downloaded, 50) / 1024 / 1024:.2f} MB")
+
+        # 按月趋势
+        months = {}
+        for r in items:
+            months.setdefault(r["ts"][:7], []).append(r)
+        if len(months) > 1:
+            print("   按月趋势（registry / install 中位数）:")
+            for month, month_items in sorted(months.items()):
+                registry = percentile([r.get("phases", {}).get("registry") for r in month_items], 50)
+                install = percentile([r.get("phases", {}).get("install") for r in month_items], 50)
+                registry_text = f"{registry:.2f}s" if registry is not None else "-"
+                install_text = f"{install:.2f}s" if install is not None else "-"
+                print(f"     {month}: {len(month_items)} 次  registry {registry_text}  install {install_text}")
+    print("=" * 70)
+
+# ==================== V8 编译缓存 ====================
+
+def clear_compile_cache(script_dir: Path, venv_name: str, keep_version: str = None, verbose: bool = True) -> int:
+    """
+    删除 run.py 为其他 Claude Code 版本创建的编译缓存（.venv-state/compile-cache/<venv>/<版本>）
+    keep_version 为 None 时全部删除；verbose 为 False 时不输出（批量升级并发执行时）
+    返回: 释放的字节数
+    """
+    from cache_location import get_cache_root
+    cache_root = get_state_dir(get_cache_root(script_dir)) / "compile-cache" / venv_name
+    freed = 0
+    try:
+        entries = [p for p in cache_root.iterdir() if p.is_dir() and p.name != keep_version]
+    except OSError:
+        return 0
+    for path in entries:
+        for current, _, files in os.walk(path):
+            for name in files:
+                try:
+                    freed += os.path.getsize(os.path.join(current, name))
+                except OSError:
+                    pass
+        shutil.rmtree(path, ignore_errors=True)
+    if freed and verbose:
+        print(f"🧹 已清理旧的编译缓存: {freed / 1024 / 1024:.1f} MB")
+    return freed
+
+# ==================== 单文件运行镜像 ====================
+
+def repack_runtime_image(venv_path: Path, verbose: bool = True) -> None:
+    """
+    虚拟环境中已有单文件运行镜像时，升级后重新打包（runtime_image.py）
+    """
+    if not (venv_path / "claude-code.img").exists():
+        return
+    try:
+        from runtime_image import pack_image
+        manifest = pack_image(venv_path)
+        if verbose:
+            print(f"📦 已重新打包运行镜像: {manifest['version']}")
+    except Exception as e:
+        if verbose:
+            print(f"⚠️  重新打包运行镜像失败: {e}")
+
+# ==================== 启动性能基准 ====================
+
+# 默认基准参数：每项运行次数、回退判定阈值（百分比）
+DEFAULT_BENCH_RUNS = 3
+DEFAULT_BENCH_THRESHOLD = 20.0
+
+def evict_page_cache(paths: List[Path]) -> bool:
     """
-    升级指定的虚拟环境
+    通过 posix_fadvise(DONTNEED) 将文件移出页缓存，用于模拟冷启动（无需 root）
+    返回: 当前平台是否支持
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+
+    for root in paths:
+        if root.is_file():
+            files = [root]
+        elif root.is_dir():
+            files = [Path(dirpath) / name for dirpath, _, names in os.walk(root) for name in names]
+        else:
+            continue
+        for file_path in files:
+            try:
+                fd = os.open(str(file_path), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+    return True
+
+def time_command(cmd: list, env: dict, cwd: Path = None, timeout: int = 60) -> Optional[float]:
+    """
+    执行一次命令并返回耗时（毫秒），失败时返回 None
+    """
+    start = time.perf_counter()
+    returncode, _, _ = run_command(cmd, env, cwd=cwd, timeout=timeout)
+    elapsed = (time.perf_counter() - start) * 1000
+    return round(elapsed, 1) if returncode == 0 else None
+
+def median(values: List[float]) -> Optional[float]:
+    """
+    计算中位数，忽略失败的样本
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return round((values[mid - 1] + values[mid]) / 2, 1)
+
+def benchmark_startup(venv_path: Path, claude_executable: Path, env: dict, runs: int) -> dict:
+    """
+    启动性能基准：
+    - version_cold: 每次运行前驱逐页缓存后执行 claude --version
+    - version_warm: 预热后重复执行 claude --version
+    - print_mock: 对本地模拟 API 执行一次无头 claude -p 调用
+    返回: {指标名: 中位数毫秒, "samples": {指标名: [样本]}}
+    """
+    import tempfile
+    from mock_api import MockAnthropicServer
+
+    samples = {"version_cold": [], "version_warm": [], "print_mock": []}
+    version_cmd = [str(claude_executable), "--version"]
+
+    # 冷启动：驱逐 claude-code 包和 node 可执行文件的页缓存
+    evict_targets = [
+        venv_path / "lib" / "node_modules" / "@anthropic-ai" / "claude-code",
+        venv_path / "bin" / "node",
+    ]
+    for _ in range(runs):
+        if not evict_page_cache(evict_targets) and samples["version_cold"]:
+            # 不支持驱逐时只有第一次运行可视为冷启动
+            break
+        samples["version_cold"].append(time_command(version_cmd, env))
+
+    # 热启动
+    run_command(version_cmd, env, timeout=60)
+    for _ in range(runs):
+        samples["version_warm"].append(time_command(version_cmd, env))
+
+    # 无头模式：使用临时配置目录，避免污染便携目录中的会话记录
+    server = MockAnthropicServer()
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="claude-bench-") as temp_dir:
+            print_env = dict(env)
+            print_env.update(server.client_env())
+            print_env["CLAUDE_CONFIG_DIR"] = temp_dir
+            print_cmd = [str(claude_executable), "-p", "ping", "--max-turns", "1"]
+            for _ in range(runs):
+                samples["print_mock"].append(time_command(print_cmd, print_env, cwd=Path(temp_dir), timeout=120))
+    finally:
+        server.stop()
+
+    result = {name: median(values) for name, values in samples.items()}
+    result["samples"] = samples
+    result["measured_at"] = datetime.now().isoformat(timespec="seconds")
+    return result
+
+def load_bench_baselines(script_dir: Path) -> dict:
+    """
+    读取已保存的基准结果: {venv_name: {version: result}}
+    """
+    try:
+        with open(get_state_dir(script_dir) / "startup-bench.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_bench_baseline(script_dir: Path, venv_name: str, version: str, result: dict) -> None:
+    """
+    保存某个版本的基准结果
+    """
+    baselines = load_bench_baselines(script_dir)
+    baselines.setdefault(venv_name, {})[version] = result
+    state_dir = get_state_dir(script_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    with open(state_dir / "startup-bench.json", 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2)
+
+def find_bench_regressions(baseline: dict, current: dict, threshold: float) -> List[Tuple[str, float, float, float]]:
+    """
+    对比两次基准结果，返回超过阈值的回退: [(指标名, 旧值, 新值, 变化百分比), ...]
+    """
+    regressions = []
+    for name in ("version_cold", "version_warm", "print_mock"):
+        before, after = baseline.get(name), current.get(name)
+        if not before or not after:
+            continue
+        change = (after - before) / before * 100
+        if change > threshold:
+            regressions.append((name, before, after, round(change, 1)))
+    return regressions
+
+def print_bench_result(result: dict) -> None:
+    """
+    打印基准结果
+    """
+    labels = {
+        "version_cold": "冷启动 --version",
+        "version_warm": "热启动 --version",
+        "print_mock": "无头模式 -p（模拟 API）",
+    }
+    for name, label in labels.items():
+        value = result.get(name)
+        print(f"   {label}: {f'{value:.1f} ms' if value is not None else '失败'}")
+
+def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name: str, package_name: str,
+                 bench_options: dict = None) -> bool:
+    """
+    升级指定的虚拟环境，并把本次升级写入历史记录
+    bench_options: 启动性能基准参数 {"runs": N, "threshold": 百分比, "auto_rollback": bool}，runs 为 0 时不测试；
+                   "measure_download" 为 True 时统计本次下载量
     返回: 是否成功
     """
+    record = new_history_record("upgrade", venv_name)
+    start = time.perf_counter()
+    try:
+        success = perform_upgrade(script_dir, venv_name, bin_subdir, display_name, package_name, bench_options, record)
+        if record["status"] == "unknown":
+            record["status"] = "success" if success else "failed"
+        return success
+    except KeyboardInterrupt:
+        record["status"] = "interrupted"
+        raise
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        raise
+    finally:
+        record["total_seconds"] = round(time.perf_counter() - start, 3)
+        append_history(script_dir, record)
+
+def perform_upgrade(script_dir: Path, venv_name: str, bin_subdir: str, display_name: str, package_name: str,
+                    bench_options: dict, record: dict) -> bool:
+    """
+    执行升级流程，各阶段耗时写入 record["phases"]
+    返回: 是否成功
+    """
+    phases = record["phases"]
     venv_path = script_dir / venv_name
     venv_bin_dir = venv_path / bin_subdir
     is_windows = (venv_name == "venv_win")
@@ -185,20 +634,17 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
     print()
     
     # 设置环境变量
-    env = os.environ.copy()
-    env["VIRTUAL_ENV"] = str(venv_path)
-    prepare_portable_npm_env(env, script_dir, venv_path)
-
-    # 更新 PATH
-    update_env_path(env, venv_path, venv_bin_dir, is_windows)
+    env = build_venv_env(script_dir, venv_name, bin_subdir)
     
     # 检查 npm 是否可用
+    phase_start = time.perf_counter()
     print("🔍 检查 npm 是否可用...")
     returncode, stdout, stderr = run_command(["npm", "--version"], env, timeout=10)
     
     if returncode != 0:
         print("❌ 错误：npm 不可用")
         print(f"错误信息: {stderr}")
+        record["error"] = "npm 不可用"
         return False
     
     npm_version = stdout.strip()
@@ -210,8 +656,11 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
     current_version = get_npm_package_version(package_name, env)
     print(f"📦 当前版本: {current_version}")
     print()
+    phases["probe"] = round(time.perf_counter() - phase_start, 3)
+    record["before"] = current_version
     
     # 检查是否有可用更新
+    phase_start = time.perf_counter()
     print("🔍 检查是否有可用更新...")
     print("⏳ 正在连接 npm 仓库...")
     returncode, stdout, stderr = run_command(
@@ -219,6 +668,7 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
         env,
         timeout=60
     )
+    phases["registry"] = round(time.perf_counter() - phase_start, 3)
     
     has_update = False
     latest_version = "unknown"
@@ -232,11 +682,24 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
         except:
             pass
     
+    record["latest"] = latest_version
     if has_update:
         print(f"✨ 发现新版本: {latest_version}")
     else:
         print("✅ 已是最新版本")
     print()
+
+    bench_options = bench_options or {}
+    bench_runs = bench_options.get("runs", 0)
+    claude_executable = get_claude_executable(venv_path, venv_bin_dir, is_windows)
+
+    # 有新版本且当前版本还没有基准记录时，先在升级前测一次，作为对比基线
+    if bench_runs and has_update and current_version != "未安装" and current_version not in load_bench_baselines(script_dir).get(venv_name, {}):
+        print(f"⏱️  记录 {current_version} 的启动基准（{bench_runs} 次）...")
+        baseline_result = benchmark_startup(venv_path, claude_executable, env, bench_runs)
+        print_bench_result(baseline_result)
+        save_bench_baseline(script_dir, venv_name, current_version, baseline_result)
+        print()
     
     # 执行升级
     print("=" * 70)
@@ -250,13 +713,26 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
     print()
     print("--- npm 输出 ---")
     
+    # 后台预取过目标版本时，优先使用本地缓存，跳过仓库的重复校验
+    install_cmd = ["npm", "install", "-g", package_name]
+    if has_update and read_prefetch_state(script_dir).get("prefetched") == latest_version:
+        print(f"💡 检测到已预取 {latest_version}，将优先使用本地缓存")
+        install_cmd = ["npm", "install", "-g", f"{package_name}@{latest_version}", "--prefer-offline"]
+
     # 使用实时输出模式，设置较长的超时时间（10分钟）
+    npm_cache_dir = Path(env["NPM_CONFIG_CACHE"])
+    measure_download = bench_options.get("measure_download", False)
+    cache_bytes_before = get_cache_content_size(npm_cache_dir) if measure_download else 0
+    phase_start = time.perf_counter()
     returncode, stdout, stderr = run_command(
-        ["npm", "install", "-g", package_name],
+        install_cmd,
         env,
         timeout=600,
         show_output=True
     )
+    phases["install"] = round(time.perf_counter() - phase_start, 3)
+    if measure_download:
+        record["bytes_downloaded"] = max(0, get_cache_content_size(npm_cache_dir) - cache_bytes_before)
     
     print("--- npm 输出结束 ---")
     print()
@@ -273,14 +749,17 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
         print("   1. 检查网络连接")
         print("   2. 使用 VPN 或更换网络")
         print("   3. 手动执行升级命令")
+        record["error"] = (stderr or stdout).strip()[-500:]
         return False
     
     print("✅ 升级完成")
     print()
     
     # 获取升级后的版本
+    phase_start = time.perf_counter()
     print("🔍 验证升级结果...")
     new_version = get_npm_package_version(package_name, env)
+    record["after"] = new_version
     print(f"📦 新版本: {new_version}")
     print()
     
@@ -296,7 +775,6 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
     
     # 测试 claude 命令是否可用
     print("🔍 测试 claude 命令...")
-    claude_executable = get_claude_executable(venv_path, venv_bin_dir, is_windows)
     returncode, stdout, stderr = run_command([str(claude_executable), "--version"], env, timeout=10)
     
     if returncode == 0:
@@ -306,7 +784,75 @@ def upgrade_venv(script_dir: Path, venv_name: str, bin_subdir: str, display_name
         print(f"错误信息: {stderr}")
     
     print()
-    return True
+    phases["verify"] = round(time.perf_counter() - phase_start, 3)
+
+    # 启动性能回归检查
+    rolled_back = False
+    if bench_runs and returncode == 0 and new_version != current_version:
+        phase_start = time.perf_counter()
+        record["bench_ok"], installed_version = check_startup_regression(
+            script_dir, venv_name, venv_path, claude_executable, env, package_name,
+            current_version, new_version, bench_options)
+        phases["bench"] = round(time.perf_counter() - phase_start, 3)
+
+        # 自动回滚后以实际安装的版本为准
+        if installed_version != new_version:
+            rolled_back = True
+            record["after"] = installed_version
+            record["status"] = "rolled-back"
+            print(f"📊 当前版本: {installed_version}（{new_version} 已回滚）")
+            print()
+
+    # 旧版本的 V8 编译缓存已失效（自动回滚时保留回滚后版本的缓存）
+    if new_version != current_version:
+        clear_compile_cache(script_dir, venv_name, read_installed_version(venv_path, package_name))
+        repack_runtime_image(venv_path)
+    return not rolled_back
+
+def check_startup_regression(script_dir: Path, venv_name: str, venv_path: Path, claude_executable: Path, env: dict,
+                             package_name: str, previous_version: str, new_version: str, bench_options: dict) -> Tuple[bool, str]:
+    """
+    升级后测量启动性能并与上一版本的基准对比，超过阈值时提示（可选自动回滚）
+    返回: (是否未发现回退, 当前实际安装的版本)
+    """
+    runs = bench_options.get("runs", DEFAULT_BENCH_RUNS)
+    threshold = bench_options.get("threshold", DEFAULT_BENCH_THRESHOLD)
+
+    print(f"⏱️  测量 {new_version} 的启动性能（{runs} 次）...")
+    result = benchmark_startup(venv_path, claude_executable, env, runs)
+    print_bench_result(result)
+    save_bench_baseline(script_dir, venv_name, new_version, result)
+
+    baseline = load_bench_baselines(script_dir).get(venv_name, {}).get(previous_version)
+    if not baseline:
+        print(f"💡 没有 {previous_version} 的基准记录，已保存本次结果作为后续对比基线")
+        print()
+        return True, new_version
+
+    regressions = find_bench_regressions(baseline, result, threshold)
+    if not regressions:
+        print(f"✅ 与 {previous_version} 相比未发现超过 {threshold:.0f}% 的启动回退")
+        print()
+        return True, new_version
+
+    print(f"⚠️  与 {previous_version} 相比发现启动性能回退（阈值 {threshold:.0f}%）：")
+    for name, before, after, change in regressions:
+        print(f"   {name}: {before:.1f} ms -> {after:.1f} ms (+{change}%)")
+
+    if bench_options.get("auto_rollback") and previous_version != "未安装":
+        print(f"↩️  自动回滚到 {previous_version} ...")
+        returncode, stdout, stderr = run_command(
+            ["npm", "install", "-g", f"{package_name}@{previous_version}", "--prefer-offline"],
+            env,
+            timeout=600
+        )
+        if returncode == 0:
+            print(f"✅ 已回滚到 {previous_version}")
+        else:
+            print("❌ 回滚失败")
+            print(f"错误信息: {(stderr or stdout).strip()[-500:]}")
+    print()
+    return False, get_npm_package_version(package_name, env)
 
 def check_all_versions(script_dir: Path, available_venvs: List[Tuple[str, str, str]], package_name: str) -> dict:
     """
@@ -320,54 +866,35 @@ def check_all_versions(script_dir: Path, available_venvs: List[Tuple[str, str, s
     print()
     
     for venv_name, bin_subdir, display_name in available_venvs:
-        venv_path = script_dir / venv_name
-        venv_bin_dir = venv_path / bin_subdir
-        is_windows = (venv_name == "venv_win")
-        
-        # 设置环境变量
-        env = os.environ.copy()
-        env["VIRTUAL_ENV"] = str(venv_path)
-        prepare_portable_npm_env(env, script_dir, venv_path)
+        record = new_history_record("check", venv_name)
 
-        # 更新 PATH
-        update_env_path(env, venv_path, venv_bin_dir, is_windows)
+        # 设置环境变量
+        env = build_venv_env(script_dir, venv_name, bin_subdir)
         
         # 获取当前版本
+        phase_start = time.perf_counter()
         current_version = get_npm_package_version(package_name, env)
+        record["phases"]["probe"] = round(time.perf_counter() - phase_start, 3)
         
-        # 只需要查询一次最新版本（使用 npm view 获取最新版本）
+        # 只需要查询一次最新版本
         if latest_version is None:
-            # 先尝试使用 npm view 获取最新版本
-            returncode, stdout, stderr = run_command(
-                ["npm", "view", package_name, "version"],
-                env,
-                timeout=60
-            )
-            
-            if returncode == 0 and stdout:
-                latest_version = stdout.strip()
-            else:
-                # 如果 npm view 失败，尝试使用 npm outdated
-                returncode, stdout, stderr = run_command(
-                    ["npm", "outdated", "-g", package_name, "--json"],
-                    env,
-                    timeout=60
-                )
-                
-                if stdout:
-                    try:
-                        data = json.loads(stdout)
-                        if package_name in data:
-                            latest_version = data[package_name].get("latest", "unknown")
-                    except:
-                        pass
-            
-            if latest_version is None:
-                latest_version = "unknown"
+            phase_start = time.perf_counter()
+            latest_version = get_latest_version(package_name, env)
+            record["phases"]["registry"] = round(time.perf_counter() - phase_start, 3)
         
         has_update = False
         if current_version != "未安装" and latest_version != "unknown":
             has_update = (current_version != latest_version)
+
+        record.update({
+            "before": current_version,
+            "after": current_version,
+            "latest": latest_version,
+            "status": ("failed" if latest_version == "unknown" else
+                       "not-installed" if current_version == "未安装" else
+                       "outdated" if has_update else "up-to-date"),
+        })
+        append_history(script_dir, record)
         
         version_info[venv_name] = {
             "current": current_version,
@@ -378,9 +905,832 @@ def check_all_versions(script_dir: Path, available_venvs: List[Tuple[str, str, s
     
     return version_info
 
+# ==================== 后台预取 ====================
+
+def acquire_lock(lock_file: Path, stale_seconds: int = 3600) -> bool:
+    """
+    基于 O_EXCL 的简单文件锁，超过 stale_seconds 的锁视为残留并清除
+    """
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if time.time() - lock_file.stat().st_mtime > stale_seconds:
+            lock_file.unlink()
+    except OSError:
+        pass
+
+    try:
+        fd = os.open(str(lock_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(os.getpid()))
+    return True
+
+def prefetch_latest(script_dir: Path, package_name: str, measure_download: bool = False) -> int:
+    """
+    后台预取最新版本：下载 tarball 及全部依赖到 .npm-cache，不修改虚拟环境
+    由 run.py 在启动 Claude 后以分离进程调用，下次 update.py 可直接从本地缓存完成升级
+    measure_download: 是否统计本次下载量（需要遍历整个 npm 缓存）
+    返回: 退出码
+    """
+    state_dir = get_state_dir(script_dir)
+    lock_file = state_dir / "prefetch.lock"
+    if not acquire_lock(lock_file):
+        print("⏭️  已有预取进程在运行")
+        return 0
+
+    # 降低优先级，避免影响前台的 Claude 会话
+    if hasattr(os, "nice"):
+        try:
+            os.nice(10)
+        except OSError:
+            pass
+
+    state = {"checked_at": datetime.now().isoformat(timespec="seconds"), "status": "failed"}
+    venv_name, bin_subdir, _ = get_platform_info()
+    record = new_history_record("prefetch", venv_name)
+    start = time.perf_counter()
+    try:
+        venv_path = script_dir / venv_name
+        if not venv_path.exists():
+            state["error"] = f"虚拟环境不存在: {venv_path}"
+            return 1
+
+        env = build_venv_env(script_dir, venv_name, bin_subdir)
+        phase_start = time.perf_counter()
+        installed = read_installed_version(venv_path, package_name) or get_npm_package_version(package_name, env)
+        record["phases"]["probe"] = round(time.perf_counter() - phase_start, 3)
+        phase_start = time.perf_counter()
+        latest = get_latest_version(package_name, env)
+        record["phases"]["registry"] = round(time.perf_counter() - phase_start, 3)
+        record.update({"before": installed, "after": installed, "latest": latest})
+        state.update({"installed": installed, "latest": latest})
+        previous = read_prefetch_state(script_dir)
+
+        if latest == "unknown":
+            state["error"] = "无法获取最新版本"
+            return 1
+        if latest == installed:
+            state["status"] = "up-to-date"
+            return 0
+        if previous.get("prefetched") == latest:
+            state.update({"status": "prefetched", "prefetched": latest})
+            return 0
+
+        # 安装到临时前缀：npm 会把 tarball 和全部依赖写入共享的缓存目录
+        staging_dir = get_portable_npm_paths(script_dir)[1] / "_prefetch" / latest
+        staging_env = dict(env)
+        staging_env["NPM_CONFIG_PREFIX"] = str(staging_dir)
+        print(f"📦 预取 {package_name}@{latest} ...")
+        npm_cache_dir = Path(env["NPM_CONFIG_CACHE"])
+        cache_bytes_before = get_cache_content_size(npm_cache_dir) if measure_download else 0
+        phase_start = time.perf_counter()
+        returncode, stdout, stderr = run_command(
+            ["npm", "install", "-g", f"{package_name}@{latest}", "--ignore-scripts"],
+            staging_env,
+            timeout=1800
+        )
+        record["phases"]["install"] = round(time.perf_counter() - phase_start, 3)
+        if measure_download:
+            record["bytes_downloaded"] = max(0, get_cache_content_size(npm_cache_dir) - cache_bytes_before)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        if returncode != 0:
+            state["error"] = (stderr or stdout).strip()[-500:]
+            return 1
+
+        state.update({"status": "prefetched", "prefetched": latest})
+        print(f"✅ 预取完成: {latest}")
+        return 0
+    finally:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        with open(state_dir / "prefetch.json", 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        record["status"] = state["status"]
+        record["error"] = state.get("error")
+        record["total_seconds"] = round(time.perf_counter() - start, 3)
+        append_history(script_dir, record)
+        try:
+            lock_file.unlink()
+        except OSError:
+            pass
+
+# ==================== Node.js 运行时升级 ====================
+
+# 与 nodeenv / node-gyp 相同的镜像环境变量
+DEFAULT_NODE_MIRROR = "https://nodejs.org/dist"
+
+# 输出 Node.js 版本和原生模块 ABI 的脚本
+NODE_INFO_SCRIPT = "console.log(JSON.stringify({version: process.version, modules: process.versions.modules}))"
+
+def get_node_dist_name(version: str) -> Tuple[str, str]:
+    """
+    返回当前系统对应的 Node.js 发行包名称和扩展名，如 ("node-v22.11.0-linux-x64", ".tar.gz")
+    """
+    system = platform.system()
+    machine = platform.machine().lower()
+    arch = {"x86_64": "x64", "amd64": "x64", "aarch64": "arm64", "arm64": "arm64"}.get(machine, machine)
+    if system == "Windows":
+        return f"node-v{version}-win-{arch}", ".zip"
+    plat = "linux" if system == "Linux" else "darwin"
+    return f"node-v{version}-{plat}-{arch}", ".tar.gz"
+
+def get_node_info(node_executable: Path, env: dict) -> Optional[dict]:
+    """
+    获取 node 的版本和原生模块 ABI 版本，失败时返回 None
+    """
+    returncode, stdout, stderr = run_command([str(node_executable), "-e", NODE_INFO_SCRIPT], env, timeout=30)
+    if returncode != 0:
+        return None
+    try:
+        return json.loads(stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None
+
+def download_file(url: str, target: Path, timeout: int = 300) -> None:
+    """
+    下载文件到临时文件后再重命名，避免留下不完整的缓存
+    """
+    partial = target.with_name(target.name + ".partial")
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(partial, 'wb') as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+    os.replace(partial, target)
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def fetch_node_archive(version: str, cache_dir: Path) -> Path:
+    """
+    从缓存或镜像获取 Node.js 发行包，并按 SHASUMS256.txt 校验
+    缓存目录中的发行包每次使用前都会重新校验
+    """
+    mirror = os.environ.get("NODEJS_ORG_MIRROR", DEFAULT_NODE_MIRROR).rstrip("/")
+    dist_name, ext = get_node_dist_name(version)
+    archive_name = dist_name + ext
+    version_dir = cache_dir / f"v{version}"
+    version_dir.mkdir(parents=True, exist_ok=True)
+
+    shasums_file = version_dir / "SHASUMS256.txt"
+    if not shasums_file.exists():
+        print(f"⏳ 下载校验文件: {mirror}/v{version}/SHASUMS256.txt")
+        download_file(f"{mirror}/v{version}/SHASUMS256.txt", shasums_file, timeout=60)
+
+    expected = None
+    for line in shasums_file.read_text(encoding='utf-8').splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == archive_name:
+            expected = parts[0]
+            break
+    if expected is None:
+        raise RuntimeError(f"SHASUMS256.txt 中没有 {archive_name}，该版本可能不支持当前平台")
+
+    archive = version_dir / archive_name
+    if archive.exists() and sha256_file(archive) == expected:
+        print(f"✅ 使用缓存的发行包: {archive}")
+        return archive
+
+    print(f"⏳ 下载 {mirror}/v{version}/{archive_name} ...")
+    download_file(f"{mirror}/v{version}/{archive_name}", archive)
+    if sha256_file(archive) != expected:
+        archive.unlink()
+        raise RuntimeError(f"{archive_name} 校验失败（SHA-256 不匹配）")
+    print(f"✅ 下载完成并已校验: {archive}")
+    return archive
+
+def extract_node_runtime(archive: Path, staging_dir: Path, is_windows: bool) -> Path:
+    """
+    只解压 node 可执行文件和头文件（node-gyp 编译原生模块时使用），不解压自带的 npm
+    返回: 暂存目录中的 node 可执行文件
+    """
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    staging_dir.mkdir(parents=True)
+
+    if is_windows:
+        with zipfile.ZipFile(archive) as zf:
+            member = next(name for name in zf.namelist() if name.endswith("/node.exe"))
+            with zf.open(member) as src, open(staging_dir / "node.exe", 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        return staging_dir / "node.exe"
+
+    with tarfile.open(archive, 'r:gz') as tf:
+        for member in tf.getmembers():
+            # 去掉顶层的 node-vX-平台 目录
+            relative = member.name.split("/", 1)[1] if "/" in member.name else ""
+            if relative != "bin/node" and not relative.startswith("include/node/"):
+                continue
+            if not (member.isfile() or member.isdir()):
+                continue
+            target = staging_dir / relative
+            if member.isdir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with tf.extractfile(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.chmod(target, member.mode & 0o777)
+    return staging_dir / "bin" / "node"
+
+def smoke_test_node(node_executable: Path, venv_path: Path, claude_executable: Path, package_name: str, env: dict) -> Tuple[bool, str]:
+    """
+    用指定的 node 运行 claude --version，在替换前确认新运行时可以启动 Claude Code
+    """
+    package_dir = None
+    for modules_dir in ["lib/node_modules", "node_modules", "Lib/node_modules"]:
+        if (venv_path / modules_dir / package_name / "package.json").exists():
+            package_dir = venv_path / modules_dir / package_name
+            break
+
+    entry = None
+    if package_dir:
+        try:
+            with open(package_dir / "package.json", 'r', encoding='utf-8') as f:
+                bin_field = json.load(f).get("bin")
+            entry = bin_field.get("claude") if isinstance(bin_field, dict) else bin_field
+        except (OSError, ValueError):
+            entry = None
+
+    if entry and entry.endswith((".js", ".mjs", ".cjs")):
+        cmd = [str(node_executable), str(package_dir / entry), "--version"]
+        test_env = env
+    else:
+        # 入口不是 JS 文件时，让 claude 启动脚本通过 PATH 找到新的 node
+        cmd = [str(claude_executable), "--version"]
+        test_env = dict(env)
+        test_env["PATH"] = os.pathsep.join([str(node_executable.parent), env.get("PATH", "")])
+
+    returncode, stdout, stderr = run_command(cmd, test_env, timeout=60)
+    if returncode != 0:
+        return False, (stderr or stdout).strip()[-500:]
+    return True, stdout.strip()
+
+def swap_path(current: Path, replacement: Path, backup: Path) -> None:
+    """
+    current -> backup，replacement -> current（同一文件系统内的重命名）
+    """
+    if backup.exists() or backup.is_symlink():
+        if backup.is_dir() and not backup.is_symlink():
+            shutil.rmtree(backup)
+        else:
+            backup.unlink()
+    if current.exists() or current.is_symlink():
+        os.replace(current, backup)
+    os.replace(replacement, current)
+
+def restore_path(current: Path, backup: Path) -> None:
+    """
+    撤销 swap_path：删除新文件，恢复备份
+    """
+    if not (backup.exists() or backup.is_symlink()):
+        return
+    if current.is_dir() and not current.is_symlink():
+        shutil.rmtree(current)
+    elif current.exists() or current.is_symlink():
+        current.unlink()
+    os.replace(backup, current)
+
+def upgrade_node_runtime(script_dir: Path, version: str, package_name: str) -> bool:
+    """
+    原地替换当前系统虚拟环境中的 Node.js 运行时，保留 lib/node_modules
+    流程：获取并校验发行包 -> 暂存 -> 冒烟测试 -> 替换 -> ABI 变化时 npm rebuild -> 验证，失败则恢复
+    返回: 是否成功
+    """
+    venv_name, bin_subdir, is_windows = get_platform_info()
+    version = version.lstrip("v")
+    record = new_history_record("node-upgrade", venv_name)
+    record["latest"] = version
+    start = time.perf_counter()
+    try:
+        success = perform_node_upgrade(script_dir, venv_name, bin_subdir, is_windows, version, package_name, record)
+        record["status"] = "success" if success else "failed"
+        return success
+    except KeyboardInterrupt:
+        record["status"] = "interrupted"
+        raise
+    finally:
+        record["total_seconds"] = round(time.perf_counter() - start, 3)
+        append_history(script_dir, record)
+
+def perform_node_upgrade(script_dir: Path, venv_name: str, bin_subdir: str, is_windows: bool, version: str,
+                         package_name: str, record: dict) -> bool:
+    """
+    执行 Node.js 运行时替换，各阶段耗时写入 record["phases"]
+    """
+    phases = record["phases"]
+    venv_path = script_dir / venv_name
+    bin_dir = venv_path / bin_subdir
+
+    print("=" * 70)
+    print(f"🟢 升级 Node.js 运行时: {venv_name} -> v{version}")
+    print("=" * 70)
+
+    if not venv_path.exists():
+        print(f"❌ 错误：虚拟环境不存在: {venv_path}")
+        record["error"] = "虚拟环境不存在"
+        return False
+
+    node_name = "node.exe" if is_windows else "node"
+    current_node = bin_dir / node_name
+    if not current_node.exists():
+        print(f"❌ 错误：未找到 node: {current_node}")
+        record["error"] = "未找到 node"
+        return False
+
+    env = build_venv_env(script_dir, venv_name, bin_subdir)
+    claude_executable = get_claude_executable(venv_path, bin_dir, is_windows)
+
+    phase_start = time.perf_counter()
+    old_info = get_node_info(current_node, env) or {}
+    record["before"] = old_info.get("version")
+    print(f"📦 当前 Node.js: {old_info.get('version', '未知')} (ABI {old_info.get('modules', '未知')})")
+    if old_info.get("version") == f"v{version}":
+        print("✅ 已是目标版本，无需升级")
+        record["after"] = old_info.get("version")
+        return True
+    phases["probe"] = round(time.perf_counter() - phase_start, 3)
+
+    # 1. 获取发行包（缓存在 .npm-cache/_node，与 npm 下载缓存放在一起）
+    phase_start = time.perf_counter()
+    cache_dir = get_portable_npm_paths(script_dir)[1] / "_node"
+    try:
+        archive = fetch_node_archive(version, cache_dir)
+    except Exception as e:
+        print(f"❌ 获取 Node.js 发行包失败: {e}")
+        print("💡 可通过 NODEJS_ORG_MIRROR 环境变量指定镜像")
+        record["error"] = str(e)
+        return False
+    phases["registry"] = round(time.perf_counter() - phase_start, 3)
+
+    # 2. 解压到虚拟环境内的暂存目录（与目标在同一文件系统，替换时只需重命名）
+    phase_start = time.perf_counter()
+    staging_dir = venv_path / ".node-staging"
+    staged_node = extract_node_runtime(archive, staging_dir, is_windows)
+    new_info = get_node_info(staged_node, env)
+    if not new_info:
+        print("❌ 新的 node 无法运行，已放弃替换")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        record["error"] = "新的 node 无法运行"
+        return False
+    print(f"📦 新 Node.js: {new_info['version']} (ABI {new_info['modules']})")
+
+    # 3. 替换前的冒烟测试：用新 node 运行现有的 Claude Code
+    ok, output = smoke_test_node(staged_node, venv_path, claude_executable, package_name, env)
+    if not ok:
+        print("❌ 冒烟测试失败，已放弃替换")
+        print(f"错误信息: {output}")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        record["error"] = f"冒烟测试失败: {output}"
+        return False
+    print(f"✅ 冒烟测试通过: {output}")
+    phases["install"] = round(time.perf_counter() - phase_start, 3)
+
+    # 4. 替换 node（以及头文件），保留旧文件直到验证通过
+    swaps = [(current_node, staged_node, bin_dir / f"{node_name}.previous")]
+    if not is_windows and (staging_dir / "include" / "node").exists():
+        (venv_path / "include").mkdir(exist_ok=True)
+        swaps.append((venv_path / "include" / "node", staging_dir / "include" / "node", venv_path / "include" / "node.previous"))
+
+    phase_start = time.perf_counter()
+    done = []
+    success = False
+    try:
+        for current, replacement, backup in swaps:
+            swap_path(current, replacement, backup)
+            done.append((current, backup))
+
+        # 5. ABI 变化时重新编译全局包中的原生模块
+        if old_info.get("modules") != new_info["modules"]:
+            print(f"🔧 原生模块 ABI 已变化（{old_info.get('modules')} -> {new_info['modules']}），执行 npm rebuild -g ...")
+            returncode, stdout, stderr = run_command(["npm", "rebuild", "-g"], env, timeout=1200, show_output=True)
+            if returncode != 0:
+                print("❌ npm rebuild 失败")
+                record["error"] = (stderr or stdout).strip()[-500:]
+                return False
+        else:
+            print("✅ 原生模块 ABI 未变化，无需重新编译")
+
+        # 6. 替换后验证
+        returncode, stdout, stderr = run_command([str(claude_executable), "--version"], env, timeout=60)
+        if returncode != 0:
+            print("❌ 替换后 claude 命令测试失败")
+            print(f"错误信息: {stderr}")
+            record["error"] = (stderr or stdout).strip()[-500:]
+            return False
+        print(f"✅ claude 命令可用: {stdout.strip()}")
+        record["after"] = new_info["version"]
+        success = True
+
+        # V8 版本变化，已有的编译缓存全部失效
+        clear_compile_cache(script_dir, venv_name)
+        return True
+    finally:
+        phases["verify"] = round(time.perf_counter() - phase_start, 3)
+        if success:
+            for current, backup in done:
+                if backup.is_dir() and not backup.is_symlink():
+                    shutil.rmtree(backup, ignore_errors=True)
+                elif backup.exists():
+                    backup.unlink()
+        else:
+            print("↩️  恢复原来的 Node.js 运行时...")
+            for current, backup in reversed(done):
+                restore_path(current, backup)
+            if done and old_info.get("modules") != new_info["modules"]:
+                run_command(["npm", "rebuild", "-g"], env, timeout=1200)
+            record["after"] = old_info.get("version")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print("=" * 70)
+
+# ==================== 局域网缓存仓库 ====================
+
+def set_portable_registry(script_dir: Path, registry_url: str) -> Path:
+    """
+    在项目内的 .npmrc.portable 中设置（或移除）registry，不影响用户全局 npm 配置
+    registry_url 为 "default" 时恢复为 npm 默认仓库
+    返回: .npmrc.portable 路径
+    """
+    npm_userconfig, _ = get_portable_npm_paths(script_dir)
+    lines = []
+    if npm_userconfig.exists():
+        lines = [
+            line for line in npm_userconfig.read_text(encoding='utf-8').splitlines()
+            if not line.strip().startswith("registry=")
+        ]
+    if registry_url != "default":
+        lines.append(f"registry={registry_url.rstrip('/')}/")
+    npm_userconfig.write_text("\n".join(lines) + ("\n" if lines else ""), encoding='utf-8')
+    return npm_userconfig
+
+# ==================== 批量升级（fleet 模式） ====================
+
+# 发现便携目录时不进入的目录
+FLEET_SKIP_DIRS = {".git", "node_modules", ".npm-cache", ".claude", "__pycache__"}
+
+def is_portable_root(path: Path) -> bool:
+    """
+    判断目录是否是一个 claude-code-venv 便携目录
+    """
+    return (path / "run.py").is_file() and bool(get_available_venvs(path))
+
+def discover_portable_roots(base_dir: Path, max_depth: int = 4) -> List[Path]:
+    """
+    在指定目录下查找所有便携目录（找到后不再深入其内部）
+    """
+    roots = []
+    base_depth = len(base_dir.parts)
+
+    for current, dirs, _ in os.walk(base_dir):
+        current_path = Path(current)
+        if is_portable_root(current_path):
+            roots.append(current_path)
+            dirs[:] = []
+            continue
+
+        if len(current_path.parts) - base_depth >= max_depth:
+            dirs[:] = []
+            continue
+
+        dirs[:] = [d for d in dirs if d not in FLEET_SKIP_DIRS and not d.startswith("venv_")]
+
+    return sorted(roots)
+
+def resolve_fleet_roots(roots: List[str], discover_dirs: List[str], max_depth: int) -> List[Path]:
+    """
+    合并命令行给出的目录和自动发现的目录，去重并保持顺序
+    给出的目录本身不是便携目录时，尝试其下的 claude-code-venv 子目录
+    """
+    candidates = []
+    for root in roots:
+        root_path = Path(root).expanduser().absolute()
+        if not is_portable_root(root_path) and is_portable_root(root_path / "claude-code-venv"):
+            root_path = root_path / "claude-code-venv"
+        candidates.append(root_path)
+
+    for discover_dir in discover_dirs:
+        candidates.extend(discover_portable_roots(Path(discover_dir).expanduser().absolute(), max_depth))
+
+    resolved = []
+    seen = set()
+    for candidate in candidates:
+        key = os.path.normcase(str(candidate))
+        if key not in seen:
+            seen.add(key)
+            resolved.append(candidate)
+    return resolved
+
+def probe_fleet_root(root: Path, package_name: str, npm_cache_dir: Path) -> dict:
+    """
+    探测单个便携目录中当前系统虚拟环境的版本（只读，可并发执行）
+    """
+    venv_name, bin_subdir, _ = get_platform_info()
+    record = {
+        "root": str(root),
+        "venv": venv_name,
+        "before": None,
+        "after": None,
+        "status": "pending",
+        "error": "",
+        "probe_seconds": 0.0,
+        "upgrade_seconds": 0.0,
+        "verify_seconds": 0.0,
+    }
+
+    start = time.perf_counter()
+    venv_path = root / venv_name
+    if not venv_path.exists():
+        record["status"] = "missing-venv"
+        record["error"] = f"虚拟环境不存在: {venv_path}"
+    else:
+        version = read_installed_version(venv_path, package_name)
+        if version is None:
+            # package.json 不可读时回退到 npm list
+            env = build_venv_env(root, venv_name, bin_subdir, npm_cache_dir)
+            version = get_npm_package_version(package_name, env)
+        record["before"] = version
+        record["after"] = version
+        if version == "未安装":
+            record["status"] = "not-installed"
+
+    record["probe_seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+def upgrade_fleet_root(record: dict, package_name: str, target_version: str, npm_cache_dir: Path) -> dict:
+    """
+    非交互式升级单个便携目录，输出全部捕获，避免并发时互相穿插
+    """
+    root = Path(record["root"])
+    venv_name, bin_subdir, is_windows = get_platform_info()
+    venv_path = root / venv_name
+    env = build_venv_env(root, venv_name, bin_subdir, npm_cache_dir)
+
+    # 显式指定版本号，保证整个批次升级到同一个版本
+    start = time.perf_counter()
+    returncode, stdout, stderr = run_command(
+        ["npm", "install", "-g", f"{package_name}@{target_version}"],
+        env,
+        timeout=600
+    )
+    record["upgrade_seconds"] = round(time.perf_counter() - start, 3)
+
+    if returncode != 0:
+        record["status"] = "failed"
+        record["error"] = (stderr or stdout).strip()[-500:]
+        return record
+
+    start = time.perf_counter()
+    record["after"] = read_installed_version(venv_path, package_name) or get_npm_package_version(package_name, env)
+    claude_executable = get_claude_executable(venv_path, venv_path / bin_subdir, is_windows)
+    returncode, stdout, stderr = run_command([str(claude_executable), "--version"], env, timeout=30)
+    record["verify_seconds"] = round(time.perf_counter() - start, 3)
+
+    if record["after"] != target_version:
+        record["status"] = "failed"
+        record["error"] = f"升级后版本不符: {record['after']}"
+    elif returncode != 0:
+        record["status"] = "failed"
+        record["error"] = f"claude --version 失败: {(stderr or stdout).strip()[-300:]}"
+    else:
+        record["status"] = "upgraded"
+        clear_compile_cache(root, venv_name, record["after"], verbose=False)
+        repack_runtime_image(venv_path, verbose=False)
+    return record
+
+def format_fleet_table(records: List[dict]) -> str:
+    """
+    将批量升级结果格式化为文本表格
+    """
+    headers = ["目录", "升级前", "升级后", "状态", "探测(s)", "升级(s)", "验证(s)"]
+    rows = [
+        [
+            r["root"],
+            r["before"] or "-",
+            r["after"] or "-",
+            r["status"],
+            f"{r['probe_seconds']:.2f}",
+            f"{r['upgrade_seconds']:.2f}",
+            f"{r['verify_seconds']:.2f}",
+        ]
+        for r in records
+    ]
+    widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+
+    lines = [" | ".join(str(cell).ljust(widths[i]) for i, cell in enumerate(headers))]
+    lines.append("-+-".join("-" * w for w in widths))
+    for row in rows:
+        lines.append(" | ".join(str(cell).ljust(widths[i]) for i, cell in enumerate(row)))
+    return "\n".join(lines)
+
+def run_fleet(roots: List[Path], package_name: str, jobs: int, npm_cache_dir: Path, report_path: Path,
+              dry_run: bool = False, history_dir: Path = None) -> bool:
+    """
+    批量升级多个便携目录：并发探测版本，限制并发数升级过期的副本，共享同一个下载缓存
+    history_dir: 写入历史记录的便携目录（通常是执行批量升级的本目录）
+    返回: 是否全部成功
+    """
+    fleet_start = time.perf_counter()
+    npm_cache_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=" * 70)
+    print("🚚 批量升级模式")
+    print("=" * 70)
+    print(f"📦 便携目录: {len(roots)} 个")
+    print(f"🗄️  共享缓存: {npm_cache_dir}")
+    print(f"⚙️  并发数: {jobs}")
+    print("=" * 70)
+    print()
+
+    # 1. 并发探测所有副本的当前版本（只读操作，不受并发数限制）
+    print("🔍 正在探测所有副本的版本...")
+    with ThreadPoolExecutor(max_workers=min(32, max(1, len(roots)))) as executor:
+        records = list(executor.map(lambda root: probe_fleet_root(root, package_name, npm_cache_dir), roots))
+
+    # 2. 只查询一次最新版本
+    latest_version = "unknown"
+    venv_name, bin_subdir, _ = get_platform_info()
+    for record in records:
+        if record["status"] in ("pending", "not-installed"):
+            env = build_venv_env(Path(record["root"]), venv_name, bin_subdir, npm_cache_dir)
+            latest_version = get_latest_version(package_name, env)
+            break
+    print(f"✨ 最新版本: {latest_version}")
+    print()
+
+    # 3. 标记需要升级的副本
+    outdated = []
+    for record in records:
+        if record["status"] == "missing-venv":
+            continue
+        if latest_version == "unknown":
+            record["status"] = "failed"
+            record["error"] = "无法获取最新版本"
+        elif record["before"] == latest_version:
+            record["status"] = "up-to-date"
+        elif dry_run:
+            record["status"] = "outdated"
+        else:
+            outdated.append(record)
+
+    # 4. 限制并发数升级（共享缓存，同一个 tarball 只下载一次）
+    if outdated:
+        print(f"🚀 开始升级 {len(outdated)} 个副本...")
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(upgrade_fleet_root, record, package_name, latest_version, npm_cache_dir) for record in outdated]
+            for future in futures:
+                record = future.result()
+                icon = "✅" if record["status"] == "upgraded" else "❌"
+                print(f"   {icon} {record['root']}: {record['before']} -> {record['after']}")
+        print()
+
+    # 5. 输出报告
+    table = format_fleet_table(records)
+    print(table)
+    print()
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "package": package_name,
+        "latest": latest_version,
+        "npm_cache": str(npm_cache_dir),
+        "jobs": jobs,
+        "total_seconds": round(time.perf_counter() - fleet_start, 3),
+        "roots": records,
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    # 每个副本一条历史记录；并发下载共享缓存，无法按副本区分下载量
+    if history_dir and not dry_run:
+        for r in records:
+            record = new_history_record("fleet-upgrade", r["venv"])
+            record.update({
+                "root": r["root"],
+                "before": r["before"],
+                "after": r["after"],
+                "latest": latest_version,
+                "status": r["status"],
+                "error": r["error"] or None,
+                "phases": {
+                    "probe": r["probe_seconds"],
+                    "install": r["upgrade_seconds"] or None,
+                    "verify": r["verify_seconds"] or None,
+                },
+            })
+            append_history(history_dir, record)
+    table_path = report_path.with_suffix(".txt")
+    table_path.write_text(table + "\n", encoding='utf-8')
+
+    failed = [r for r in records if r["status"] in ("failed", "missing-venv")]
+    print("=" * 70)
+    print(f"✅ 已升级: {sum(1 for r in records if r['status'] == 'upgraded')} 个")
+    print(f"✅ 已是最新: {sum(1 for r in records if r['status'] == 'up-to-date')} 个")
+    if failed:
+        print(f"❌ 失败: {len(failed)} 个")
+    print(f"📄 JSON 报告: {report_path}")
+    print(f"📄 表格报告: {table_path}")
+    print("=" * 70)
+
+    return not failed
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """
+    解析命令行参数（不带参数时进入交互模式）
+    """
+    parser = argparse.ArgumentParser(
+        description="Claude Code 虚拟环境升级工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python update.py                                   # 交互式升级
+  python update.py --fleet /mnt/a/claude-code-venv /mnt/b/claude-code-venv
+  python update.py --discover /mnt/share --jobs 4    # 自动发现并批量升级
+  python update.py --discover /mnt/share --dry-run   # 只探测版本，不升级
+  python update.py --serve-cache                     # 启动局域网 npm 缓存仓库
+  python update.py --registry http://10.0.0.5:4873   # 让本目录使用局域网缓存仓库
+  python update.py --history --history-limit 50      # 查看最近 50 次升级的耗时统计
+  python update.py --measure-download                # 升级并记录下载量（供 --history 统计）
+  python update.py --node 22.11.0                    # 原地升级 Node.js 运行时
+        """
+    )
+    parser.add_argument("--fleet", nargs="+", default=[], metavar="ROOT", help="批量升级指定的便携目录（非交互）")
+    parser.add_argument("--discover", action="append", default=[], metavar="DIR", help="在目录下自动发现便携目录（可多次指定）")
+    parser.add_argument("--max-depth", type=int, default=4, help="自动发现的最大目录深度（默认：4）")
+    parser.add_argument("--jobs", type=int, default=4, help="同时升级的副本数（默认：4）")
+    parser.add_argument("--cache-dir", help="共享 npm 下载缓存目录（默认：当前脚本目录的 .npm-cache）")
+    parser.add_argument("--report", help="JSON 报告路径（默认：fleet_report_<时间>.json）")
+    parser.add_argument("--dry-run", action="store_true", help="只探测版本，不执行升级")
+    parser.add_argument("--prefetch", action="store_true", help="只预取最新版本到本地缓存，不升级（供 run.py 后台调用）")
+    parser.add_argument("--serve-cache", action="store_true", help="启动局域网 npm 缓存仓库服务")
+    parser.add_argument("--serve-host", default="0.0.0.0", help="缓存仓库监听地址（默认：0.0.0.0）")
+    parser.add_argument("--serve-port", type=int, default=4873, help="缓存仓库监听端口（默认：4873）")
+    parser.add_argument("--serve-dir", help="缓存仓库的共享缓存目录（默认：当前脚本目录的 .registry-cache）")
+    parser.add_argument("--upstream", default="https://registry.npmjs.org", help="缓存仓库的上游地址")
+    parser.add_argument("--offline", action="store_true", help="缓存仓库只使用已有缓存，不访问上游")
+    parser.add_argument("--registry", metavar="URL", help="让本便携目录使用指定仓库（写入 .npmrc.portable，default 表示恢复默认）")
+    parser.add_argument("--bench-runs", type=int, default=DEFAULT_BENCH_RUNS,
+                        help=f"升级后启动基准每项的运行次数，0 表示不测试（默认：{DEFAULT_BENCH_RUNS}）")
+    parser.add_argument("--bench-threshold", type=float, default=DEFAULT_BENCH_THRESHOLD,
+                        help=f"判定启动回退的阈值百分比（默认：{DEFAULT_BENCH_THRESHOLD:.0f}）")
+    parser.add_argument("--node", metavar="VERSION", help="只替换当前系统虚拟环境中的 Node.js 运行时（保留已安装的 npm 包）")
+    parser.add_argument("--history", action="store_true", help="汇总显示升级历史（成功率、各阶段耗时、下载量趋势）")
+    parser.add_argument("--measure-download", action="store_true",
+                        help="统计升级 / 预取的下载量并写入历史（安装前后各遍历一次 npm 缓存，缓存较大时较慢）")
+    parser.add_argument("--history-limit", type=int, default=0, metavar="N", help="只汇总最近 N 条历史记录（默认：全部）")
+    parser.add_argument("--auto-rollback", action="store_true", help="发现启动回退时自动回滚到升级前的版本")
+    return parser.parse_args(argv)
+
 def main():
+    args = parse_args()
+
     # 获取脚本所在目录
     script_dir = Path(__file__).parent.absolute()
+    package_name = "@anthropic-ai/claude-code"
+
+    # 升级历史汇总
+    if args.history:
+        show_history(script_dir, max(0, args.history_limit))
+        sys.exit(0)
+
+    # 原地升级 Node.js 运行时
+    if args.node:
+        sys.exit(0 if upgrade_node_runtime(script_dir, args.node, package_name) else 1)
+
+    # 局域网缓存仓库服务
+    if args.serve_cache:
+        from registry_cache import serve_cache
+        serve_dir = Path(args.serve_dir).expanduser().absolute() if args.serve_dir else script_dir / ".registry-cache"
+        sys.exit(serve_cache(serve_dir, args.serve_host, args.serve_port, args.upstream, args.offline))
+
+    # 设置本便携目录使用的仓库
+    if args.registry:
+        npmrc_file = set_portable_registry(script_dir, args.registry)
+        if args.registry == "default":
+            print(f"✅ 已恢复 npm 默认仓库: {npmrc_file}")
+        else:
+            print(f"✅ 已设置仓库 {args.registry}: {npmrc_file}")
+        sys.exit(0)
+
+    # 后台预取模式（非交互）
+    if args.prefetch:
+        sys.exit(prefetch_latest(script_dir, package_name, args.measure_download))
+
+    # 批量升级模式（非交互）
+    if args.fleet or args.discover:
+        roots = resolve_fleet_roots(args.fleet, args.discover, args.max_depth)
+        if not roots:
+            print("❌ 错误：没有找到任何便携目录")
+            sys.exit(1)
+        npm_cache_dir = Path(args.cache_dir).expanduser().absolute() if args.cache_dir else get_portable_npm_paths(script_dir)[1]
+        if args.report:
+            report_path = Path(args.report).expanduser().absolute()
+        else:
+            report_path = Path.cwd() / f"fleet_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        success = run_fleet(roots, package_name, args.jobs, npm_cache_dir, report_path,
+                            dry_run=args.dry_run, history_dir=script_dir)
+        sys.exit(0 if success else 1)
     
     # 获取当前系统信息
     current_venv_name, current_bin_subdir, is_windows = get_platform_info()
@@ -403,7 +1753,6 @@ def main():
         sys.exit(1)
     
     # 检查所有虚拟环境的版本
-    package_name = "@anthropic-ai/claude-code"
     version_info = check_all_versions(script_dir, available_venvs, package_name)
     
     # 显示版本信息表格
@@ -501,12 +1850,18 @@ def main():
         sys.exit(0)
     
     # 执行升级
+    bench_options = {
+        "runs": max(0, args.bench_runs),
+        "threshold": args.bench_threshold,
+        "auto_rollback": args.auto_rollback,
+        "measure_download": args.measure_download,
+    }
     success_count = 0
     fail_count = 0
     
     for venv_name, bin_subdir, display_name in selected_venvs:
         try:
-            if upgrade_venv(script_dir, venv_name, bin_subdir, display_name, package_name):
+            if upgrade_venv(script_dir, venv_name, bin_subdir, display_name, package_name, bench_options):
                 success_count += 1
             else:
                 fail_count += 1
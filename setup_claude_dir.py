@@ -2,13 +2,21 @@
 """
 符号链接管理工具
 创建/移除 .claude 目录的符号链接，实现多项目共享配置
+支持对多个项目批量 link / unlink / status / repair（项目列表文件或自动发现目录树）
+分层模式（--mode layered）只链接共享的设置、命令、代理、插件，高频写入的状态留在项目本地，用 merge 汇总
+镜像模式（--mode mirror）在项目中保留共享目录的本地副本，用 sync 双向增量同步（适合网络路径上的共享目录）
 """
 
 import os
 import sys
+import json
+import time
+import hashlib
+import argparse
 import platform
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # 各系统默认外部 .claude 目录路径
@@ -153,9 +161,9 @@ def create_symlink_windows(target: Path, link: Path) -> bool:
     return False
 
 
-def create_symlink(external_dir: Path):
-    """创建符号链接"""
-    project_dir = Path.cwd()
+def create_symlink(external_dir: Path, project_dir: Path = None):
+    """创建符号链接（默认为当前目录）"""
+    project_dir = project_dir or Path.cwd()
     local_claude = project_dir / ".claude"
     backup_claude = project_dir / ".claude.bak"
 
@@ -237,9 +245,9 @@ def is_junction(path: Path) -> bool:
         return False
 
 
-def remove_symlink():
-    """移除符号链接或 junction 并恢复原目录"""
-    project_dir = Path.cwd()
+def remove_symlink(project_dir: Path = None):
+    """移除符号链接或 junction 并恢复原目录（默认为当前目录）"""
+    project_dir = project_dir or Path.cwd()
     local_claude = project_dir / ".claude"
     backup_claude = project_dir / ".claude.bak"
 
@@ -247,6 +255,12 @@ def remove_symlink():
     is_junc = is_junction(local_claude)
     
     if not is_symlink and not is_junc:
+        if read_layered_marker(local_claude) is not None:
+            remove_layered(project_dir)
+            return
+        if read_mirror_marker(local_claude) is not None:
+            remove_mirror(project_dir)
+            return
         print(f"当前不是符号链接或目录连接: {local_claude}")
         return
 
@@ -265,9 +279,9 @@ def remove_symlink():
         print(f"恢复备份目录: {backup_claude} -> {local_claude}")
 
 
-def show_status():
-    """显示当前状态"""
-    project_dir = Path.cwd()
+def show_status(project_dir: Path = None):
+    """显示当前状态（默认为当前目录）"""
+    project_dir = project_dir or Path.cwd()
     local_claude = project_dir / ".claude"
     backup_claude = project_dir / ".claude.bak"
 
@@ -281,6 +295,11 @@ def show_status():
     elif is_junction(local_claude):
         target = local_claude.resolve()
         print(f".claude 状态: 目录连接 (junction) -> {target}")
+    elif read_layered_marker(local_claude) is not None:
+        print(f".claude 状态: 分层目录 -> {read_layered_marker(local_claude).get('source')}")
+    elif read_mirror_marker(local_claude) is not None:
+        marker = read_mirror_marker(local_claude)
+        print(f".claude 状态: 镜像目录 <-> {marker.get('source')}（上次同步 {marker.get('synced_at')}）")
     elif local_claude.exists():
         print(f".claude 状态: 普通目录")
     else:
@@ -290,6 +309,773 @@ def show_status():
         print(f".claude.bak: 存在（有备份）")
 
 
+# ==================== 分层模式 ====================
+# 项目的 .claude 是普通目录（可写层），其中只读为主的共享部分逐项链接到共享目录，
+# 会话记录、待办等高频写入的状态留在项目本地，各项目互不争用同一批文件
+
+# 直接链接的共享文件
+LAYERED_SHARED_FILES = ("settings.json", "CLAUDE.md")
+# 逐项链接其子项的共享目录（项目可以在其中加入自己的文件）
+LAYERED_SHARED_DIRS = ("commands", "agents", "plugins", "skills", "output-styles")
+# merge 时汇总到共享目录的本地状态
+LAYERED_MERGED_DIRS = ("projects", "todos")
+# 分层目录的标记文件，记录共享目录和创建的链接
+LAYERED_MARKER = ".layered.json"
+# 链接前本地已有的同名条目移到这里
+LAYERED_BACKUP = ".layer-backup"
+
+
+def read_layered_marker(local_claude: Path):
+    try:
+        with open(local_claude / LAYERED_MARKER, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def link_entry(target: Path, link: Path) -> bool:
+    """
+    为单个文件或目录创建链接：优先符号链接，
+    Windows 上没有权限时目录用 junction、文件用硬链接
+    """
+    try:
+        os.symlink(target, link, target_is_directory=target.is_dir())
+        return True
+    except OSError as e:
+        if SYSTEM != "Windows":
+            print(f"链接失败: {link}: {e}")
+            return False
+    if target.is_dir():
+        result = subprocess.run(['cmd', '/c', 'mklink', '/J', str(link), str(target)],
+                                capture_output=True, text=True)
+        if result.returncode == 0:
+            return True
+    else:
+        try:
+            os.link(target, link)
+            return True
+        except OSError:
+            pass
+    print(f"链接失败: {link} -> {target}")
+    return False
+
+
+def unlink_entry(path: Path) -> None:
+    """移除 link_entry 创建的链接（junction 用 rmdir）"""
+    if path.is_symlink() or not path.is_dir():
+        os.unlink(path)
+    else:
+        os.rmdir(path)
+
+
+def create_layered(external_dir: Path, project_dir: Path = None) -> bool:
+    """
+    创建（或刷新）分层的 .claude 目录：
+    - 已是整目录链接时先移除链接，已是普通目录时原地保留为可写层
+    - 本地已有的同名文件移到 .claude/.layer-backup/
+    - 重复运行只补上共享目录中新增的条目、修复失效的链接
+    """
+    project_dir = project_dir or Path.cwd()
+    local_claude = project_dir / ".claude"
+    if not external_dir.exists():
+        print(f"错误：外部 .claude 目录不存在: {external_dir}")
+        return False
+
+    if local_claude.is_symlink() or is_junction(local_claude):
+        remove_symlink(project_dir)
+    local_claude.mkdir(exist_ok=True)
+
+    marker = read_layered_marker(local_claude) or {}
+    links = set(marker.get("links", []))
+    backup_dir = local_claude / LAYERED_BACKUP
+
+    def place(target: Path, link: Path) -> bool:
+        relative = link.relative_to(local_claude).as_posix()
+        if os.path.lexists(link):
+            if relative in links and (link.is_symlink() or is_junction(link)) and link.exists() \
+                    and os.path.samefile(link, target):
+                return True
+            if relative in links:
+                unlink_entry(link)
+            else:
+                backup = backup_dir / relative
+                backup.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(link), str(backup))
+                print(f"备份本地条目: {relative} -> {LAYERED_BACKUP}/{relative}")
+        if not link_entry(target, link):
+            return False
+        links.add(relative)
+        return True
+
+    ok = True
+    created = 0
+    for name in LAYERED_SHARED_FILES:
+        if (external_dir / name).exists():
+            before = len(links)
+            ok &= place(external_dir / name, local_claude / name)
+            created += len(links) - before
+    for name in LAYERED_SHARED_DIRS:
+        shared_dir = external_dir / name
+        if not shared_dir.is_dir():
+            continue
+        local_dir = local_claude / name
+        if local_dir.is_symlink() or is_junction(local_dir):
+            # 整个子目录是链接时改为逐项链接
+            unlink_entry(local_dir)
+            links.discard(name)
+        elif local_dir.exists() and not local_dir.is_dir():
+            backup_dir.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(local_dir), str(backup_dir / name))
+        local_dir.mkdir(exist_ok=True)
+        for child in sorted(shared_dir.iterdir()):
+            before = len(links)
+            ok &= place(child, local_dir / child.name)
+            created += len(links) - before
+
+    # 共享目录中已删除的条目：移除对应的失效链接
+    for relative in sorted(links):
+        link = local_claude / relative
+        if os.path.lexists(link) and not link.exists():
+            unlink_entry(link)
+            links.discard(relative)
+            print(f"移除失效链接: {relative}")
+
+    marker.update(source=str(external_dir), links=sorted(links))
+    with open(local_claude / LAYERED_MARKER, "w", encoding="utf-8") as f:
+        json.dump(marker, f, ensure_ascii=False, indent=2)
+    print(f"分层目录: {local_claude} -> {external_dir}（共享 {len(links)} 项，本次新建 {created} 项）")
+    return ok
+
+
+def remove_layered(project_dir: Path) -> None:
+    """移除分层目录中的共享链接并恢复 .layer-backup，本地可写层保留为普通目录"""
+    local_claude = project_dir / ".claude"
+    marker = read_layered_marker(local_claude) or {}
+    promoted = set(marker.get("promoted", []))
+    for relative in marker.get("links", []):
+        link = local_claude / relative
+        if not os.path.lexists(link):
+            continue
+        shared = link.resolve()
+        unlink_entry(link)
+        # merge 提升到共享目录的本项目条目：恢复为本地副本
+        if relative in promoted and shared.exists():
+            if shared.is_dir():
+                shutil.copytree(shared, link)
+            else:
+                shutil.copy2(shared, link)
+    for name in LAYERED_SHARED_DIRS:
+        try:
+            (local_claude / name).rmdir()
+        except OSError:
+            pass
+    backup_dir = local_claude / LAYERED_BACKUP
+    if backup_dir.is_dir():
+        for path in sorted(backup_dir.rglob("*")):
+            if path.is_file() or path.is_symlink():
+                restored = local_claude / path.relative_to(backup_dir)
+                if not os.path.lexists(restored):
+                    restored.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(path), str(restored))
+        shutil.rmtree(backup_dir, ignore_errors=True)
+    (local_claude / LAYERED_MARKER).unlink(missing_ok=True)
+    print(f"移除分层链接: {local_claude}（本地文件已保留）")
+
+
+def files_equal(a: Path, b: Path) -> bool:
+    if a.stat().st_size != b.stat().st_size:
+        return False
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            chunk = fa.read(1024 * 1024)
+            if chunk != fb.read(1024 * 1024):
+                return False
+            if not chunk:
+                return True
+
+
+def plan_layered_merge(project_dir: Path, external_dir: Path) -> list:
+    """
+    汇总一个分层项目的本地层
+    返回操作列表 (动作, 相对路径)：
+    - promote: 共享目录（commands、agents 等）中项目本地新建的条目，复制到共享目录后改为链接
+    - copy: 会话记录、待办等本地状态，共享目录中没有或较旧时复制过去
+    - same: 与共享目录内容相同的本地条目，直接改为链接
+    - conflict: 共享目录中已有同名但内容不同的条目，不处理
+    """
+    local_claude = project_dir / ".claude"
+    marker = read_layered_marker(local_claude) or {}
+    links = set(marker.get("links", []))
+    actions = []
+    for name in LAYERED_SHARED_DIRS:
+        local_dir = local_claude / name
+        if not local_dir.is_dir() or local_dir.is_symlink():
+            continue
+        for child in sorted(local_dir.iterdir()):
+            relative = f"{name}/{child.name}"
+            if relative in links or child.is_symlink():
+                continue
+            shared = external_dir / relative
+            if not os.path.lexists(shared):
+                actions.append(("promote", relative))
+            elif child.is_file() and shared.is_file() and files_equal(child, shared):
+                actions.append(("same", relative))
+            else:
+                actions.append(("conflict", relative))
+    for name in LAYERED_MERGED_DIRS:
+        local_dir = local_claude / name
+        if not local_dir.is_dir() or local_dir.is_symlink():
+            continue
+        for path in sorted(local_dir.rglob("*")):
+            if not path.is_file() or path.is_symlink():
+                continue
+            relative = path.relative_to(local_claude).as_posix()
+            shared = external_dir / relative
+            try:
+                shared_stat = shared.stat()
+            except OSError:
+                actions.append(("copy", relative))
+                continue
+            local_stat = path.stat()
+            if local_stat.st_mtime > shared_stat.st_mtime and local_stat.st_size != shared_stat.st_size:
+                actions.append(("copy", relative))
+    return actions
+
+
+def merge_layered(project_dir: Path, external_dir: Path, apply: bool) -> int:
+    """
+    把分层项目的本地层汇总到共享目录（默认只预览，apply=True 时执行）
+    返回: 冲突数
+    """
+    local_claude = project_dir / ".claude"
+    actions = plan_layered_merge(project_dir, external_dir)
+    labels = {"promote": "提升", "copy": "复制", "same": "相同", "conflict": "冲突"}
+    conflicts = 0
+    for action, relative in actions:
+        print(f"  {labels[action]}: {relative}")
+        if action == "conflict":
+            conflicts += 1
+            continue
+        if not apply:
+            continue
+        local = local_claude / relative
+        shared = external_dir / relative
+        if action == "copy":
+            shared.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(local, shared)
+            continue
+        if action == "promote":
+            if local.is_dir():
+                shutil.copytree(local, shared)
+            else:
+                shared.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(local, shared)
+        # 提升或内容相同的条目改为链接到共享目录
+        if local.is_dir():
+            shutil.rmtree(local)
+        else:
+            local.unlink()
+        if link_entry(shared, local):
+            marker = read_layered_marker(local_claude) or {"source": str(external_dir), "links": []}
+            marker["links"] = sorted(set(marker["links"]) | {relative})
+            if action == "promote":
+                marker["promoted"] = sorted(set(marker.get("promoted", [])) | {relative})
+            with open(local_claude / LAYERED_MARKER, "w", encoding="utf-8") as f:
+                json.dump(marker, f, ensure_ascii=False, indent=2)
+    if not actions:
+        print("  无需汇总")
+    return conflicts
+
+
+# ==================== 镜像模式 ====================
+# 共享目录在网络路径上时，整目录链接会让 Claude 的每次读写都走网络。
+# 镜像模式在项目中保留一份本地副本，按需双向增量同步：
+# 索引记录上次同步时每个文件的 (大小, 两侧的修改时间, 哈希)，只有大小或修改时间变化的文件才计算哈希，
+# 只有内容变化的文件才复制。两侧都修改时修改时间较新的一方获胜（相同则哈希较大的一方获胜），
+# 另一方的内容另存为 <文件名>.conflict-<哈希前 8 位><扩展名>，两侧都保留。
+# 项目原有的普通 .claude 目录不参与同步，而是备份为 .claude.bak，避免项目私有配置被发布到共享目录
+
+# 镜像目录的标记文件，同时保存同步索引
+MIRROR_MARKER = ".mirror.json"
+# 复制时的临时文件后缀
+MIRROR_TMP_SUFFIX = ".mirror-tmp"
+# 并发同步的项目数上限（同步主要受网络限制）
+MIRROR_SYNC_JOBS = 4
+
+
+def read_mirror_marker(local_claude: Path):
+    try:
+        with open(local_claude / MIRROR_MARKER, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_mirror_marker(local_claude: Path, marker: dict) -> None:
+    path = local_claude / MIRROR_MARKER
+    tmp = path.with_name(path.name + MIRROR_TMP_SUFFIX)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(marker, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def walk_files(root: Path) -> dict:
+    """返回 {相对路径: (大小, mtime_ns)}，不跟随符号链接，跳过标记文件和临时文件"""
+    files = {}
+    stack = [""]
+    while stack:
+        relative_dir = stack.pop()
+        try:
+            with os.scandir(root / relative_dir if relative_dir else root) as entries:
+                for entry in entries:
+                    relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(relative)
+                    elif entry.is_file(follow_symlinks=False):
+                        if relative == MIRROR_MARKER or entry.name.endswith(MIRROR_TMP_SUFFIX):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        files[relative] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            continue
+    return files
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file(src: Path, dst: Path) -> tuple:
+    """复制文件（保留修改时间，先写临时文件再替换），返回目标的 (大小, mtime_ns)"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + MIRROR_TMP_SUFFIX)
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    st = dst.stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def conflict_name(relative: str, digest: str) -> str:
+    """冲突副本的相对路径：name.conflict-<哈希前 8 位>.ext"""
+    directory, _, name = relative.rpartition("/")
+    stem, dot, suffix = name.rpartition(".")
+    if not stem:
+        stem, dot, suffix = name, "", ""
+    name = f"{stem}.conflict-{digest[:8]}{dot}{suffix}"
+    return f"{directory}/{name}" if directory else name
+
+
+def sync_mirror(project_dir: Path, external_dir: Path) -> dict:
+    """
+    双向增量同步镜像目录和共享目录
+    返回: 统计 {"pulled", "pushed", "deleted", "conflicts", "hashed", "bytes"}
+    """
+    local_claude = project_dir / ".claude"
+    marker = read_mirror_marker(local_claude) or {}
+    index = marker.get("files", {})
+    local_files = walk_files(local_claude)
+    remote_files = walk_files(external_dir)
+    stats = {"pulled": 0, "pushed": 0, "deleted": 0, "conflicts": 0, "hashed": 0, "bytes": 0}
+    roots = {"local": local_claude, "remote": external_dir}
+    current = {"local": local_files, "remote": remote_files}
+
+    hashes = {}
+
+    def digest_of(side: str, relative: str) -> str:
+        entry = index.get(relative)
+        if entry and tuple(current[side][relative]) == (entry["size"], entry[side]):
+            return entry["hash"]
+        if (side, relative) not in hashes:
+            stats["hashed"] += 1
+            hashes[side, relative] = hash_file(roots[side] / relative)
+        return hashes[side, relative]
+
+    def changed(side: str, relative: str) -> bool:
+        """与上次同步相比是否变化（修改时间变了但内容相同时只更新索引）"""
+        entry = index[relative]
+        if relative not in current[side]:
+            return True
+        size, mtime = current[side][relative]
+        if (size, mtime) == (entry["size"], entry[side]):
+            return False
+        if size == entry["size"] and digest_of(side, relative) == entry["hash"]:
+            entry[side] = mtime
+            return False
+        return True
+
+    def transfer(source: str, relative: str, digest: str) -> None:
+        target = "remote" if source == "local" else "local"
+        size, mtime = copy_file(roots[source] / relative, roots[target] / relative)
+        current[target][relative] = (size, mtime)
+        index[relative] = {"size": size, "hash": digest, source: current[source][relative][1], target: mtime}
+        stats["pushed" if source == "local" else "pulled"] += 1
+        stats["bytes"] += size
+
+    def delete(side: str, relative: str) -> None:
+        try:
+            (roots[side] / relative).unlink()
+        except FileNotFoundError:
+            pass
+        current[side].pop(relative, None)
+        index.pop(relative, None)
+        stats["deleted"] += 1
+
+    def resolve_conflict(relative: str) -> None:
+        local_digest = digest_of("local", relative)
+        remote_digest = digest_of("remote", relative)
+        if local_digest == remote_digest:
+            index[relative] = {"size": current["local"][relative][0], "hash": local_digest,
+                               "local": current["local"][relative][1], "remote": current["remote"][relative][1]}
+            return
+        local_key = (current["local"][relative][1], local_digest)
+        remote_key = (current["remote"][relative][1], remote_digest)
+        winner, loser = ("local", "remote") if local_key > remote_key else ("remote", "local")
+        loser_digest = remote_digest if loser == "remote" else local_digest
+        # 失败一方的内容另存为冲突副本，两侧都保留
+        copy_name = conflict_name(relative, loser_digest)
+        current[loser][copy_name] = copy_file(roots[loser] / relative, roots[loser] / copy_name)
+        transfer(loser, copy_name, loser_digest)
+        transfer(winner, relative, local_digest if winner == "local" else remote_digest)
+        stats["conflicts"] += 1
+        print(f"冲突: {relative}（保留{'本地' if winner == 'local' else '共享目录'}的版本，另一方另存为 {copy_name}）")
+
+    for relative in sorted(set(local_files) | set(remote_files) | set(index)):
+        in_local = relative in current["local"]
+        in_remote = relative in current["remote"]
+        if relative not in index:
+            if in_local and in_remote:
+                resolve_conflict(relative)
+            elif in_local:
+                transfer("local", relative, digest_of("local", relative))
+            elif in_remote:
+                transfer("remote", relative, digest_of("remote", relative))
+            continue
+
+        local_changed = changed("local", relative)
+        remote_changed = changed("remote", relative)
+        if not local_changed and not remote_changed:
+            continue
+        if not in_local and not in_remote:
+            index.pop(relative)
+        elif local_changed and not remote_changed:
+            if in_local:
+                transfer("local", relative, digest_of("local", relative))
+            else:
+                delete("remote", relative)
+        elif remote_changed and not local_changed:
+            if in_remote:
+                transfer("remote", relative, digest_of("remote", relative))
+            else:
+                delete("local", relative)
+        elif not in_local:
+            # 一方删除、另一方修改：保留修改
+            transfer("remote", relative, digest_of("remote", relative))
+        elif not in_remote:
+            transfer("local", relative, digest_of("local", relative))
+        else:
+            resolve_conflict(relative)
+
+    marker.update(source=str(external_dir), synced_at=time.strftime("%Y-%m-%d %H:%M:%S"), files=index)
+    write_mirror_marker(local_claude, marker)
+    return stats
+
+
+def format_sync_stats(stats: dict) -> str:
+    return (f"拉取 {stats['pulled']}，推送 {stats['pushed']}，删除 {stats['deleted']}，"
+            f"冲突 {stats['conflicts']}，计算哈希 {stats['hashed']}，传输 {stats['bytes'] / 1024 / 1024:.1f} MB")
+
+
+def create_mirror(external_dir: Path, project_dir: Path = None) -> bool:
+    """
+    把项目的 .claude 改为共享目录的本地镜像并做第一次同步
+    已是链接时先移除链接；已是普通目录（还不是镜像）时与符号链接模式一样备份为 .claude.bak，
+    镜像从共享目录拉取，项目自己的配置不会被推送到共享目录（需要共享时用 merge 显式合并）
+    """
+    project_dir = project_dir or Path.cwd()
+    local_claude = project_dir / ".claude"
+    backup_claude = project_dir / ".claude.bak"
+    if not external_dir.exists():
+        print(f"错误：外部 .claude 目录不存在: {external_dir}")
+        return False
+    if local_claude.is_symlink() or is_junction(local_claude):
+        remove_symlink(project_dir)
+    if os.path.lexists(local_claude) and read_mirror_marker(local_claude) is None:
+        if os.path.lexists(backup_claude):
+            print(f"错误：备份目录已存在，请先处理: {backup_claude}")
+            return False
+        if read_layered_marker(local_claude) is not None:
+            remove_layered(project_dir)
+        shutil.move(str(local_claude), str(backup_claude))
+        print(f"备份现有目录: {local_claude} -> {backup_claude}")
+    local_claude.mkdir(exist_ok=True)
+    marker = read_mirror_marker(local_claude)
+    if marker and normalize_path(marker.get("source", "")) != normalize_path(str(external_dir)):
+        # 换了共享目录：旧索引作废
+        write_mirror_marker(local_claude, {})
+    stats = sync_mirror(project_dir, external_dir)
+    print(f"镜像目录: {local_claude} <-> {external_dir}（{format_sync_stats(stats)}）")
+    return True
+
+
+def remove_mirror(project_dir: Path) -> None:
+    """
+    最后同步一次并移除镜像标记
+    有 .claude.bak 时删除镜像副本（内容已同步到共享目录）并恢复备份，否则本地副本保留为普通目录
+    """
+    local_claude = project_dir / ".claude"
+    backup_claude = project_dir / ".claude.bak"
+    marker = read_mirror_marker(local_claude) or {}
+    source = Path(marker.get("source", ""))
+    synced = bool(marker.get("source")) and source.exists()
+    if synced:
+        print(f"最后同步: {format_sync_stats(sync_mirror(project_dir, source))}")
+    if synced and backup_claude.is_dir():
+        shutil.rmtree(local_claude)
+        shutil.move(str(backup_claude), str(local_claude))
+        print(f"移除镜像: {local_claude}，恢复备份目录: {backup_claude} -> {local_claude}")
+        return
+    (local_claude / MIRROR_MARKER).unlink(missing_ok=True)
+    print(f"移除镜像: {local_claude}（本地副本已保留）")
+
+
+# ==================== 批量管理 ====================
+
+# Windows 的重解析点属性（符号链接、junction）
+FILE_ATTRIBUTE_REPARSE_POINT = 0x400
+# 自动发现项目时跳过的目录
+DISCOVER_SKIP_DIRS = {"node_modules", "__pycache__", "venv", "site-packages"}
+# 并发扫描的线程数
+DEFAULT_SCAN_JOBS = 32
+
+STATE_LABELS = {
+    "linked": "已链接",
+    "layered": "分层",
+    "mirror": "镜像",
+    "stale": "指向其他目录",
+    "dangling": "目标不存在",
+    "directory": "普通目录",
+    "file": "普通文件",
+    "missing": "不存在",
+    "error": "读取失败",
+}
+
+
+def normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+
+def read_link_target(path: str):
+    """
+    只用 lstat / readlink 读取符号链接或 junction 的目标（不访问目标本身）
+    不是链接时返回 None，路径不存在时抛出 FileNotFoundError
+    """
+    st = os.lstat(path)
+    if not (os.path.islink(path) or getattr(st, "st_file_attributes", 0) & FILE_ATTRIBUTE_REPARSE_POINT):
+        return None
+    target = os.readlink(path)
+    if target.startswith("\\\\?\\"):
+        target = target[4:]
+    return os.path.join(os.path.dirname(path), target)
+
+
+def scan_link(project_dir: Path, external_dir: Path) -> dict:
+    """
+    检查一个项目的 .claude 状态（lstat 为主，只有链接目标与预期不同时才解析路径）
+    返回: {"project", "state", "target", "backup"}
+    """
+    local_claude = str(project_dir / ".claude")
+    result = {"project": str(project_dir), "state": "missing", "target": None,
+              "backup": os.path.lexists(str(project_dir / ".claude.bak"))}
+    try:
+        target = read_link_target(local_claude)
+    except FileNotFoundError:
+        return result
+    except OSError as e:
+        result.update(state="error", target=str(e))
+        return result
+
+    if target is None:
+        result["state"] = "directory" if os.path.isdir(local_claude) else "file"
+        for state, marker_name, read_marker in (("layered", LAYERED_MARKER, read_layered_marker),
+                                                ("mirror", MIRROR_MARKER, read_mirror_marker)):
+            if result["state"] == "directory" and os.path.lexists(os.path.join(local_claude, marker_name)):
+                marker = read_marker(Path(local_claude)) or {}
+                result["target"] = marker.get("source")
+                result["state"] = state if result["target"] \
+                    and normalize_path(result["target"]) == normalize_path(str(external_dir)) else "stale"
+        return result
+    result["target"] = target
+    if not os.path.exists(target):
+        result["state"] = "dangling"
+    elif normalize_path(target) == normalize_path(str(external_dir)) \
+            or os.path.realpath(target) == os.path.realpath(str(external_dir)):
+        result["state"] = "linked"
+    else:
+        result["state"] = "stale"
+    return result
+
+
+def scan_links(projects: list, external_dir: Path, jobs: int = DEFAULT_SCAN_JOBS) -> list:
+    """并发检查多个项目，结果顺序与 projects 一致"""
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(lambda project: scan_link(project, external_dir), projects))
+
+
+def load_roots(roots_file: Path) -> list:
+    """读取项目列表文件：每行一个目录，忽略空行和 # 注释"""
+    projects = []
+    with open(roots_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                projects.append(Path(line).expanduser().absolute())
+    return projects
+
+
+def discover_projects(root: Path, depth: int) -> list:
+    """
+    在目录树中查找项目：包含 .git 或 .claude 的目录（找到后不再深入其子目录）
+    只读取目录项，不逐个 stat
+    """
+    projects = []
+    level = [str(root)]
+    for _ in range(depth + 1):
+        next_level = []
+        for directory in level:
+            try:
+                with os.scandir(directory) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            names = {entry.name for entry in entries}
+            if ".git" in names or ".claude" in names:
+                projects.append(Path(directory))
+                continue
+            next_level.extend(
+                entry.path for entry in entries
+                if not entry.name.startswith(".") and entry.name not in DISCOVER_SKIP_DIRS
+                and entry.is_dir(follow_symlinks=False)
+            )
+        level = next_level
+    return sorted(projects)
+
+
+def pad_label(label: str, width: int = 14) -> str:
+    """按显示宽度补齐（中文字符占两列）"""
+    return label + " " * max(0, width - sum(2 if ord(ch) > 0x2000 else 1 for ch in label))
+
+
+def print_link_table(results: list) -> None:
+    """输出汇总表：需要处理的项目逐行列出，已链接和未链接的项目只计数"""
+    counts = {}
+    for result in results:
+        counts[result["state"]] = counts.get(result["state"], 0) + 1
+
+    rows = [result for result in results if result["state"] not in ("linked", "layered", "mirror", "missing")]
+    if rows:
+        width = max(len(result["project"]) for result in rows)
+        print(f"{pad_label('状态')}{'项目':<{width - 2}}  链接目标")
+        print("-" * (width + 40))
+        for result in rows:
+            backup = "  (有 .claude.bak)" if result["backup"] else ""
+            print(f"{pad_label(STATE_LABELS[result['state']])}{result['project']:<{width}}  {result['target'] or ''}{backup}")
+        print()
+    summary = "，".join(f"{STATE_LABELS[state]} {count}" for state, count in counts.items())
+    print(f"共 {len(results)} 个项目：{summary}")
+
+
+def run_batch(command: str, projects: list, external_dir: Path, jobs: int,
+              mode: str = "symlink", apply: bool = False) -> int:
+    """
+    批量执行 link / unlink / status / repair / merge / sync
+    - status: 只扫描并输出汇总表，存在失效链接时返回 1
+    - link: 链接所有尚未指向共享目录的项目（mode 为 layered / mirror 时创建或刷新分层 / 镜像目录）
+    - unlink: 移除所有链接（包括失效的）并恢复备份
+    - repair: 只重建指向其他目录或目标不存在的链接，并刷新分层目录
+    - merge: 把分层项目的本地层汇总到共享目录（apply 为 False 时只预览）
+    - sync: 双向同步所有镜像项目
+    """
+    source_dirs = {normalize_path(str(external_dir)), normalize_path(str(external_dir.parent))}
+    projects = [project for project in projects if normalize_path(str(project)) not in source_dirs]
+    results = scan_links(projects, external_dir, jobs)
+
+    if command == "status":
+        print(f"共享目录: {external_dir}")
+        print()
+        print_link_table(results)
+        return 1 if any(result["state"] in ("stale", "dangling", "error") for result in results) else 0
+
+    if command in ("link", "repair", "merge", "sync") and not external_dir.exists():
+        print(f"错误：外部 .claude 目录不存在: {external_dir}")
+        return 1
+
+    if command == "merge":
+        conflicts = 0
+        for result in results:
+            if result["state"] == "layered":
+                print(f"[{result['project']}]")
+                conflicts += merge_layered(Path(result["project"]), external_dir, apply)
+        if not apply:
+            print()
+            print("以上为预览，加 --apply 执行")
+        return 1 if conflicts else 0
+
+    if command == "sync":
+        mirrors = [Path(result["project"]) for result in results if result["state"] == "mirror"]
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, MIRROR_SYNC_JOBS))) as pool:
+            futures = {project: pool.submit(sync_mirror, project, external_dir) for project in mirrors}
+            for project, future in futures.items():
+                try:
+                    print(f"{project}: {format_sync_stats(future.result())}")
+                except OSError as e:
+                    print(f"{project}: 同步失败: {e}")
+        print(f"共同步 {len(mirrors)} 个镜像项目")
+        return 0
+
+    if command == "link" and mode in ("layered", "mirror"):
+        todo = [result for result in results if result["state"] not in ("file", "error")]
+    elif command == "link":
+        todo = [result for result in results if result["state"] != "linked"]
+    elif command == "repair":
+        todo = [result for result in results if result["state"] in ("stale", "dangling", "layered")]
+    else:
+        todo = [result for result in results if result["state"] in ("linked", "layered", "mirror", "stale", "dangling")]
+
+    failed = 0
+    for result in todo:
+        project_dir = Path(result["project"])
+        print(f"[{project_dir}]")
+        if command == "unlink":
+            remove_symlink(project_dir)
+            continue
+        if command == "link":
+            layered, mirror = mode == "layered", mode == "mirror"
+        else:
+            layered = read_layered_marker(project_dir / ".claude") is not None
+            mirror = read_mirror_marker(project_dir / ".claude") is not None
+        if layered:
+            if not create_layered(external_dir, project_dir):
+                failed += 1
+        elif mirror:
+            if not create_mirror(external_dir, project_dir):
+                failed += 1
+        elif result["state"] == "directory" and result["backup"]:
+            # 已有备份时再移动会把目录嵌套进 .claude.bak
+            print("跳过：已存在 .claude.bak，请先手动处理")
+            failed += 1
+        elif not create_symlink(external_dir, project_dir):
+            failed += 1
+
+    print()
+    print("=" * 50)
+    print_link_table(scan_links(projects, external_dir, jobs))
+    return 1 if failed else 0
+
+
 def interactive_menu():
     """交互式菜单"""
     while True:
@@ -323,15 +1109,48 @@ def interactive_menu():
 
 
 def main():
-    usage = """
-符号链接管理工具
-
-用法:
-    python3 run_claude.py           交互式菜单
-    python3 run_claude.py link      创建符号链接（使用默认路径）
-    python3 run_claude.py unlink    移除符号链接并恢复
-    python3 run_claude.py status    显示当前状态
+    parser = argparse.ArgumentParser(
+        description="符号链接管理工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例：
+  python3 setup_claude_dir.py                    交互式菜单
+  python3 setup_claude_dir.py link               为当前目录创建符号链接（使用默认路径）
+  python3 setup_claude_dir.py unlink             移除当前目录的符号链接并恢复
+  python3 setup_claude_dir.py status             显示当前目录的状态
+  python3 setup_claude_dir.py status --discover ~/Documents/GitHub      检查目录树下所有项目
+  python3 setup_claude_dir.py repair --roots projects.txt               批量修复失效的链接
+  python3 setup_claude_dir.py link ../repo-a ../repo-b --target /data/shared/.claude
+  python3 setup_claude_dir.py link --mode layered --discover ~/Documents/GitHub  分层：共享设置和命令，会话记录写在项目本地
+  python3 setup_claude_dir.py merge --discover ~/Documents/GitHub --apply        把各项目本地层汇总到共享目录
+  python3 setup_claude_dir.py link --mode mirror --target \\\\server\\share\\.claude    网络共享目录：使用本地镜像
+  python3 setup_claude_dir.py sync --discover ~/Documents/GitHub                 双向同步所有镜像项目
 """
+    )
+    parser.add_argument("command", nargs="?", choices=["link", "unlink", "status", "repair", "merge", "sync"],
+                        help="不指定时进入交互式菜单")
+    parser.add_argument("projects", nargs="*", help="项目目录（默认当前目录）")
+    parser.add_argument("--roots", help="项目列表文件，每行一个目录")
+    parser.add_argument("--discover", metavar="DIR", help="在目录树中查找项目（包含 .git 或 .claude 的目录）")
+    parser.add_argument("--depth", type=int, default=3, help="--discover 的查找深度（默认 3）")
+    parser.add_argument("--target", help=f"共享的 .claude 目录（默认 {DEFAULT_EXTERNAL_DIR}）")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_SCAN_JOBS, help="并发扫描线程数")
+    parser.add_argument("--mode", choices=["symlink", "layered", "mirror"], default="symlink",
+                        help="link 的方式：symlink 整目录链接（默认）/ layered 分层（共享部分逐项链接，其余写在项目本地）"
+                             " / mirror 本地镜像（用 sync 双向同步）")
+    parser.add_argument("--apply", action="store_true", help="merge 时实际执行（默认只预览）")
+    args = parser.parse_intermixed_args()
+    external_dir = Path(args.target).expanduser().absolute() if args.target else Path(DEFAULT_EXTERNAL_DIR)
+
+    # 批量模式
+    projects = [Path(project).expanduser().absolute() for project in args.projects]
+    if args.roots:
+        projects += load_roots(Path(args.roots))
+    if args.discover:
+        projects += discover_projects(Path(args.discover).expanduser().absolute(), args.depth)
+    if args.command and (projects or args.roots or args.discover or args.command in ("repair", "merge", "sync")):
+        projects = list(dict.fromkeys(projects or [Path.cwd()]))
+        sys.exit(run_batch(args.command, projects, external_dir, args.jobs, args.mode, args.apply))
 
     # 检查当前目录是否是源目录本身
     cwd = Path.cwd().resolve()
@@ -343,20 +1162,21 @@ def main():
         input("\n按回车键退出...")
         sys.exit(1)
 
-    if len(sys.argv) < 2:
+    if args.command is None:
         interactive_menu()
-    else:
-        cmd = sys.argv[1]
-        if cmd == "link":
-            create_symlink(Path(DEFAULT_EXTERNAL_DIR))
-        elif cmd == "unlink":
-            remove_symlink()
-        elif cmd == "status":
-            show_status()
-        else:
-            print(usage)
-            sys.exit(1)
+    elif args.command == "link" and args.mode == "layered":
+        create_layered(external_dir)
+    elif args.command == "link" and args.mode == "mirror":
+        create_mirror(external_dir)
+    elif args.command == "link":
+        if is_network_path(external_dir):
+            print("提示：目标是网络路径，Claude 的每次读写都会经过网络，可以改用 --mode mirror")
+        create_symlink(external_dir)
+    elif args.command == "unlink":
+        remove_symlink()
+    elif args.command == "status":
+        show_status()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()